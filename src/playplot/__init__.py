@@ -1,3 +1,4 @@
 from .session import Session
+from ._plotProcess import mapping_functions
 from ._util import ForeignProcessException, PlotProcessException, AudioProcessException
-__all__ = ["Session", "ForeignProcessException", "PlotProcessException", "AudioProcessException"]
+__all__ = ["Session", "mapping_functions", "ForeignProcessException", "PlotProcessException", "AudioProcessException"]
@@ -1,13 +1,19 @@
+import itertools
 import os
+import struct
 import time
 import traceback
+from collections import OrderedDict, namedtuple
 from time import sleep
-from typing import Union
+from typing import Union, Optional, Tuple
 
 import miniaudio
 import numpy as np
 
-from ._util import SharedObject, UrlFile, show_error_box, AudioProcessException
+from ._decodeCache import DecodeCache
+from ._scheduling import apply_scheduling, reset_thread_scheduling
+from ._seekIndex import Mp3SeekIndex, StreamingSoundFile, build_seek_index
+from ._util import SharedObject, SharedArray, UrlFile, show_error_box, AudioProcessException
 
 import soundfile
 import threading
@@ -16,34 +22,284 @@ import sys
 TIMEOUT = 5.0
 
 
+# sample data of an uncompressed wav file: byte offset, frames, channels, sample format (numpy dtype, 24 bit as "<i3")
+WavLayout = namedtuple("WavLayout", ("offset", "frames", "channels", "dtype"))
+# (format tag, bits per sample) -> sample format, 1 is integer pcm and 3 is float
+WAV_SAMPLE_FORMATS = {(1, 16): "<i2", (1, 24): "<i3", (1, 32): "<i4", (3, 32): "<f4", (3, 64): "<f8"}
+
+
+def pcm_wav_layout(path: str) -> Optional[WavLayout]:
+    """
+    Layout of the sample data if path is a wav (or rf64) file with 16/24/32 bit integer or float samples,
+    None otherwise
+    """
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] not in (b"RIFF", b"RF64") or header[8:] != b"WAVE":
+            return None
+        file_size = os.fstat(f.fileno()).st_size
+        dtype = None
+        # rf64 files store the 64 bit data size in the ds64 chunk
+        ds64_data_size = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"ds64" and size >= 16:
+                ds64_data_size = struct.unpack("<QQ", f.read(16))[1]
+                f.seek(size - 16 + size % 2, os.SEEK_CUR)
+            elif chunk_id == b"fmt ":
+                fmt = f.read(size)
+                if len(fmt) < 16:
+                    return None
+                tag, channels, _, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+                if tag == 0xFFFE and len(fmt) >= 26:
+                    # WAVE_FORMAT_EXTENSIBLE, the format tag starts the sub format guid
+                    tag = struct.unpack("<H", fmt[24:26])[0]
+                dtype = WAV_SAMPLE_FORMATS.get((tag, bits))
+                if dtype is None or channels == 0 or block_align != channels * bits // 8:
+                    return None
+                f.seek(size % 2, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if dtype is None:
+                    return None
+                offset = f.tell()
+                if size == 0xFFFFFFFF and ds64_data_size is not None:
+                    size = ds64_data_size
+                # the size of streamed recordings is not always filled in, the file size limits it in any case
+                available = file_size - offset
+                data_size = available if size in (0, 0xFFFFFFFF) and ds64_data_size is None else min(size, available)
+                return WavLayout(offset, data_size // block_align, channels, dtype)
+            else:
+                f.seek(size + size % 2, os.SEEK_CUR)
+
+
+class MemmapAudioReader:
+    """
+    Serves an uncompressed wav file from a memory map of its sample data, seeking is free and only the pages
+    played are read (by the os, they do not count towards the memory of the process).
+    Integer samples are converted to float32 for the requested frames only, float32 samples are not copied at all.
+    """
+    def __init__(self, path: str, layout: WavLayout):
+        self.length = layout.frames
+        self.channels = layout.channels
+        if layout.dtype == "<i3":
+            # every 24 bit sample is read as the upper bytes of an (unaligned) int32 starting one byte earlier,
+            # the lowest byte belongs to the previous sample and gets masked
+            data = np.memmap(path, dtype=np.uint8, mode="r", offset=layout.offset - 1,
+                             shape=(layout.frames * layout.channels * 3 + 1,))
+            self.samples = np.ndarray((layout.frames, layout.channels), dtype="<i4", buffer=data,
+                                      strides=(layout.channels * 3, 3))
+            self.mask = -256
+        else:
+            self.samples = np.memmap(path, dtype=layout.dtype, mode="r", offset=layout.offset,
+                                     shape=(layout.frames, layout.channels))
+            self.mask = None
+        self.scale = np.float32({"<i2": 2.0 ** -15, "<i3": 2.0 ** -31, "<i4": 2.0 ** -31}.get(layout.dtype, 1.0))
+
+        self.converted = np.empty((0, self.channels), dtype=np.float32)
+        self.masked = np.empty((0, self.channels), dtype=np.int32)
+
+    def close(self):
+        self.samples = None
+
+    def read(self, start, stop):
+        """Views of the frames start to stop, valid until the next call"""
+        samples = self.samples[start:stop]
+        if samples.dtype == np.float32:
+            return [samples]
+
+        frames = samples.shape[0]
+        if frames > self.converted.shape[0]:
+            # only happens if more frames are requested than ever before
+            self.converted = np.empty((frames, self.channels), dtype=np.float32)
+            self.masked = np.empty((frames, self.channels), dtype=np.int32)
+        if self.mask is not None:
+            samples = np.bitwise_and(samples, self.mask, out=self.masked[:frames])
+        return [np.multiply(samples, self.scale, out=self.converted[:frames], casting="unsafe")]
+
+
+class MiniaudioDecoder:
+    """
+    Decodes a local file (flac, ogg vorbis, wav) with the native decoders of miniaudio, with the part of the
+    SoundFile interface AudioFileReaderThread uses. The frames are converted to float32 with the given
+    sample rate and channel count by miniaudio.
+    """
+    def __init__(self, path: str, sample_rate: int, channels: int = 2):
+        info = miniaudio.get_file_info(path)
+        self.format = info.file_format.name
+        self.samplerate = sample_rate
+        self.channels = channels
+        self.length = info.num_frames * sample_rate // info.sample_rate
+
+        self.decoder = miniaudio.ffi.new("ma_decoder *")
+        config = miniaudio.lib.ma_decoder_config_init(miniaudio.lib.ma_format_f32, channels, sample_rate)
+        if sys.platform == "win32":
+            result = miniaudio.lib.ma_decoder_init_file_w(miniaudio.ffi.new("wchar_t[]", path),
+                                                          miniaudio.ffi.addressof(config), self.decoder)
+        else:
+            result = miniaudio.lib.ma_decoder_init_file(os.fsencode(path), miniaudio.ffi.addressof(config),
+                                                        self.decoder)
+        if result != miniaudio.lib.MA_SUCCESS:
+            self.decoder = None
+            raise miniaudio.DecodeError("failed to init decoder", result)
+
+        self.position = 0
+        self.frames_read = miniaudio.ffi.new("ma_uint64 *")
+
+    def __len__(self):
+        return self.length
+
+    def close(self):
+        if self.decoder is not None:
+            miniaudio.lib.ma_decoder_uninit(self.decoder)
+            self.decoder = None
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, frame) -> None:
+        result = miniaudio.lib.ma_decoder_seek_to_pcm_frame(self.decoder, frame)
+        if result != miniaudio.lib.MA_SUCCESS:
+            raise miniaudio.DecodeError("failed to seek to frame", result)
+        self.position = frame
+
+    def read(self, frames, out: np.ndarray) -> np.ndarray:
+        """Decode into out (c-contiguous float32 frames), returns the filled part"""
+        lib = miniaudio.lib
+        pointer = miniaudio.ffi.cast("void *", miniaudio.ffi.from_buffer(out))
+        result = lib.ma_decoder_read_pcm_frames(self.decoder, pointer, frames, self.frames_read)
+        if result not in (lib.MA_SUCCESS, lib.MA_AT_END):
+            raise miniaudio.DecodeError("failed to read frames", result)
+        read = self.frames_read[0]
+        self.position += read
+        if 0 < read < frames:
+            # the length is an estimate for some formats
+            out[read:frames] = 0
+            return out[:frames]
+        return out[:read]
+
+
+# decoders selectable for files which are neither memory mapped nor in the decode cache
+DECODING_BACKENDS = ("soundfile", "miniaudio")
+
+
+def open_audio_file(purl: str, cache_size: int, decode_cache: Optional[DecodeCache] = None,
+                    backend: str = "soundfile", sample_rate: Optional[int] = None) \
+        -> Union[MemmapAudioReader, "AudioFileReaderThread"]:
+    """
+    Memory mapped uncompressed wav files (or decoded files from the decode cache),
+    all other files are decoded by the backend in a reader thread (and stored in the decode cache in the background),
+    urls and mp3 files via soundfile
+    """
+    if os.path.isfile(purl):
+        layout = pcm_wav_layout(purl)
+        if layout is not None and layout.frames > 0:
+            return MemmapAudioReader(purl, layout)
+
+        if decode_cache is not None:
+            entry = decode_cache.lookup(purl)
+            layout = None if entry is None else pcm_wav_layout(entry.file)
+            if layout is not None and layout.frames > 0:
+                return MemmapAudioReader(entry.file, layout)
+            decode_cache.store_in_background(purl)
+
+        info = soundfile.info(purl) if backend == "miniaudio" else None
+        # dr_mp3 seeks by decoding from the start of the file, soundfile seeks in mp3 files with a seek index
+        if info is not None and info.format != "MP3":
+            try:
+                decoder = MiniaudioDecoder(purl, sample_rate or info.samplerate)
+            except miniaudio.DecodeError:
+                # formats miniaudio does not support
+                pass
+            else:
+                return AudioFileReaderThread(purl, cache_size, decode_cache, decoder)
+    return AudioFileReaderThread(purl, cache_size, decode_cache)
+
+
 class AudioFileReaderThread(threading.Thread):
-    def __init__(self, purl):
+    """
+    Streams an audio file into an LRU cache of decoded blocks spread across the file.
+    The blocks ahead of the playback position are read in advance, the ones around the loop start are kept,
+    all others stay cached until the memory budget is used up, so jumping back to a previous position is instant.
+    The lock is only held to look up and update the blocks, never while decoding.
+    For local mp3 files a seek index is built in the background (or loaded from the decode cache),
+    seeks start decoding at the nearest indexed frame instead of scanning the file.
+    Files are decoded by soundfile unless another decoder of the local file (MiniaudioDecoder) is given.
+    """
+    block_frames = 2 ** 15
+
+    def __init__(self, purl, cache_size, decode_cache: Optional[DecodeCache] = None,
+                 decoder: Optional[MiniaudioDecoder] = None):
         super().__init__(target=self.run, daemon=True)
-        buffer_duration = 5
-
-        self.chunk_size = 40000
+        read_ahead_duration = 5
+        loop_start_duration = 1
 
         self.lock = threading.Lock()
+        # set by read when it had to wait for a block
+        self.block_requested = threading.Event()
 
-        source = purl if os.path.isfile(purl) else UrlFile(purl)
-        self._sf: soundfile.SoundFile = soundfile.SoundFile(source)
+        self._source = purl if os.path.isfile(purl) else UrlFile(purl)
+        try:
+            self._sf: Union[soundfile.SoundFile, MiniaudioDecoder] = \
+                StreamingSoundFile(self._source) if decoder is None else decoder
+        except Exception:
+            if isinstance(self._source, UrlFile):
+                self._source.close()
+            raise
+        # file position of position 0 of _sf, which is a decoder started at an indexed frame after seeks
+        self._sf_origin = 0
+        self.seek_index: Optional[Mp3SeekIndex] = None
+        # decoders started at indexed frames read from it
+        self._index_file = None
         self.length = len(self._sf)
-        self.buffer = np.zeros((self._sf.samplerate*buffer_duration, 2), dtype='float32')
-
-        self.start_frame = 0
-        self.number_of_frames = 0
-
+        self.channels = self._sf.channels
+
+        block_count = -(-self.length // self.block_frames)
+        # the loop start is pinned, a few blocks are needed for read ahead in any case
+        self.pinned_blocks = min(block_count, -(-self._sf.samplerate * loop_start_duration // self.block_frames))
+        self.slot_count = min(block_count, max(cache_size // (self.block_frames * self.channels * 4),
+                                               self.pinned_blocks + 4))
+        self.read_ahead_blocks = max(2, min(-(-self._sf.samplerate * read_ahead_duration // self.block_frames),
+                                            self.slot_count - self.pinned_blocks - 1))
+        self.block_count = block_count
+        self.allocated_slots = 0
+
+        # block index -> (slot, number of frames), least recently used first
+        self.blocks: OrderedDict[int, Tuple[np.ndarray, int]] = OrderedDict()
+
+        # blocks in front of it are no longer needed for read ahead
         self.next_requested_frame = 0
 
         self.stop = False
         self.thread_exception = None
 
+        if isinstance(self._source, str) and self._sf.format == "MP3":
+            threading.Thread(target=self._load_seek_index, args=(decode_cache,), daemon=True).start()
         self.start()
 
+    def _load_seek_index(self, decode_cache: Optional[DecodeCache]):
+        # scanning the whole file must not compete with playback
+        reset_thread_scheduling()
+        # noinspection PyBroadException
+        try:
+            index = None if decode_cache is None else decode_cache.seek_index(self._source)
+            if index is None:
+                index = build_seek_index(self._source)
+                if index is not None and decode_cache is not None:
+                    decode_cache.store_seek_index(self._source, index)
+            self.seek_index = index
+        except Exception:
+            # seeking works without the index, just slower
+            pass
+
     def close(self):
         self.stop = True
 
     def read(self, start, stop):
+        """Views of the frames start to stop, one per block they span, valid until the next call"""
+        block_frames = self.block_frames
         start_time = time.monotonic()
         while True:
             if start_time + TIMEOUT < time.monotonic():
@@ -51,63 +307,198 @@ class AudioFileReaderThread(threading.Thread):
                     raise self.thread_exception
                 raise TimeoutError("SoundFile was unable to read the audio stream")
 
-            self.lock.acquire(timeout=TIMEOUT)
             if self.thread_exception:
                 raise self.thread_exception
 
-            start_index = start - self.start_frame
-            stop_index = stop - self.start_frame
-            if 0 <= start_index and stop_index <= self.number_of_frames:
-                self.next_requested_frame = stop
-                self.lock.release()
-                return self.buffer[start_index: stop_index]
-            self.lock.release()
-
-            self.next_requested_frame = start
+            views = []
+            frame = start
+            with self.lock:
+                # the blocks from start on are protected from eviction until the next call
+                self.next_requested_frame = start
+                while frame < stop:
+                    index = frame // block_frames
+                    block = self.blocks.get(index)
+                    if block is None:
+                        break
+                    self.blocks.move_to_end(index)
+                    offset = frame - index * block_frames
+                    end = min(block[1], offset + stop - frame)
+                    views.append(block[0][offset:end])
+                    frame += end - offset
+
+            if frame >= stop:
+                return views
+
+            self.block_requested.set()
             time.sleep(0.001)
 
+    def _missing_block(self) -> Optional[int]:
+        """Next block to read: read ahead from the requested position first, then the loop start"""
+        first = self.next_requested_frame // self.block_frames
+        for index in itertools.chain(range(first, min(first + self.read_ahead_blocks, self.block_count)),
+                                     range(self.pinned_blocks)):
+            if index not in self.blocks:
+                return index
+        return None
+
+    def _take_slot(self) -> Optional[np.ndarray]:
+        """A new slot until the budget is used up, afterwards the least recently used unprotected one"""
+        if self.allocated_slots < self.slot_count:
+            self.allocated_slots += 1
+            return np.empty((self.block_frames, self.channels), dtype=np.float32)
+
+        first = self.next_requested_frame // self.block_frames
+        for index in self.blocks:
+            if index >= self.pinned_blocks and not first <= index < first + self.read_ahead_blocks:
+                return self.blocks.pop(index)[0]
+        return None
+
+    def _seek(self, frame):
+        index = self.seek_index
+        if index is None:
+            self._sf.seek(frame - self._sf_origin)
+            return
+        if self._index_file is None:
+            self._index_file = open(self._source, "rb")
+        decoder, origin = index.decoder(self._index_file, frame)
+        self._sf.close()
+        self._sf, self._sf_origin = decoder, origin
+
     def run(self):
         try:
-            while True:
-                if self.stop:
-                    self._sf.close()
-                    return
-                # next frame is misaligned
-                if self.next_requested_frame != self.start_frame:
-                    with self.lock:
-                        # new position is inside of buffer -> move buffer
-                        if self.start_frame < self.next_requested_frame < self.start_frame + self.number_of_frames:
-                            to_keep = self.buffer[self.next_requested_frame-self.start_frame:self.number_of_frames]
-                            self.buffer = np.concatenate((to_keep, np.zeros((self.buffer.shape[0] - to_keep.shape[0], 2))),
-                                                         dtype='float32')
-                            self.start_frame = self.next_requested_frame
-                            self.number_of_frames = to_keep.shape[0]
-                        # new position is outside buffer -> reset
-                        elif self.start_frame != self.next_requested_frame:
-                            self.start_frame = self.next_requested_frame
-                            self.number_of_frames = 0
-
-                # next frame is ready, but more frames fit in the buffer
-                elif self.buffer.shape[0] - self.number_of_frames > self.chunk_size and \
-                        self.length - self.start_frame - self.number_of_frames > 0:
-                    insert_position = self.start_frame + self.number_of_frames
-                    self._sf.seek(insert_position)
-                    limited_chunk_size = min(self.chunk_size, self.length - insert_position)
-                    data = self._sf.read(limited_chunk_size, dtype='float32', always_2d=True)
-                    if data.shape[0] == 0:
-                        raise IOError("SoundFile was unable to read the audio stream")
-                    with self.lock:
-                        if insert_position == self.start_frame + self.number_of_frames:
-                            self.buffer[self.number_of_frames:self.number_of_frames+limited_chunk_size] = data
-                            self.number_of_frames += limited_chunk_size
+            while not self.stop:
+                with self.lock:
+                    index = self._missing_block()
+                    slot = None if index is None else self._take_slot()
+
+                if slot is None:
+                    self.block_requested.wait(0.01)
+                    self.block_requested.clear()
+                    continue
 
-                else:
-                    time.sleep(0.01)
+                insert_position = index * self.block_frames
+                frames = min(self.block_frames, self.length - insert_position)
+                if self._sf_origin + self._sf.tell() != insert_position:
+                    self._seek(insert_position)
+                read = self._sf.read(frames, out=slot[:frames]).shape[0]
+                if read == 0:
+                    raise IOError("SoundFile was unable to read the audio stream")
+                with self.lock:
+                    # blocks only become recently used once played, prefetched ones are evicted first
+                    self.blocks[index] = (slot, read)
+                    self.blocks.move_to_end(index, last=False)
+
+            self._sf.close()
+            if self._index_file is not None:
+                self._index_file.close()
+            if isinstance(self._source, UrlFile):
+                self._source.close()
         except Exception as e:
             self.thread_exception = e
 
 
+class OutputBuffer:
+    """
+    Preallocated output of the audio generators, reused for every device callback.
+    Blocks are handed to miniaudio as byte memoryviews, which it copies without converting them first.
+    """
+    def __init__(self, frame_shape, frames):
+        self.frame_shape = tuple(frame_shape)
+        self.frame_size = int(np.prod(self.frame_shape, dtype=int)) * 4
+        self.array = self.silence_array = None
+        self.bytes = self.silence_bytes = None
+        self._allocate(frames)
+
+    def _allocate(self, frames):
+        # only happens if the device asks for more frames than ever before
+        self.array = np.empty((frames,) + self.frame_shape, dtype=np.float32)
+        self.silence_array = np.zeros_like(self.array)
+        self.bytes = memoryview(self.array).cast("B")
+        self.silence_bytes = memoryview(self.silence_array).cast("B")
+
+    def silence(self, frames) -> memoryview:
+        if frames > self.array.shape[0]:
+            self._allocate(frames)
+        return self.silence_bytes[:frames * self.frame_size]
+
+    def scaled(self, volume: float, *blocks: np.ndarray) -> memoryview:
+        """Copy of the concatenated blocks multiplied by volume, valid until the next call"""
+        frames = sum(block.shape[0] for block in blocks)
+        if frames > self.array.shape[0]:
+            self._allocate(frames)
+        position = 0
+        for block in blocks:
+            np.multiply(block, volume, out=self.array[position:position + block.shape[0]])
+            position += block.shape[0]
+        return self.bytes[:frames * self.frame_size]
+
+
+class NullPlaybackDevice:
+    """
+    Playback device without audio output, pulls blocks from the generator like a sound card would,
+    either in real time from a timer thread or (manual) only when step is called.
+    Its clock is the number of frames pulled. Can be stopped and started again like a miniaudio device.
+    """
+    def __init__(self, sample_rate: int, nchannels: int, buffersize_msec: int = 30, manual: bool = False):
+        self.sample_rate = sample_rate
+        self.nchannels = nchannels
+        self.buffersize_msec = buffersize_msec
+        self.period_frames = sample_rate * buffersize_msec // 1000
+        self.manual = manual
+        self.frames = 0
+        self.generator = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def time(self) -> float:
+        """Virtual time in seconds, the frames pulled so far"""
+        return self.frames / self.sample_rate
+
+    def start(self, generator) -> None:
+        self.generator = generator
+        if not self.manual:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        # pulls are scheduled relative to the start, so the timer does not drift
+        start = time.monotonic() - self.time
+        while not self._stopped.wait(max(0.0, start + self.time - time.monotonic())):
+            self.step(self.period_frames)
+
+    def step(self, frames: int) -> None:
+        """Pull frames from the generator, in blocks of at most the buffer size"""
+        while frames > 0:
+            block = min(frames, self.period_frames)
+            self.generator.send(block)
+            self.frames += block
+            frames -= block
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self) -> None:
+        self.stop()
+
+
+# "device" plays on the sound card, "null" and "manual" use a NullPlaybackDevice in real time or stepped manually
+AUDIO_OUTPUTS = ("device", "null", "manual")
+
+
 class Playback:
+    # seconds between buffer size changes, and without underruns before the buffer is halved again
+    min_resize_interval = 1
+    initial_shrink_delay = 30
+    # seconds between checks of the shared state while suspended, bounds the delay until playback resumes.
+    # the loop must not wait on the shared condition: notify_all blocks the writers forever once a waiting
+    # process was killed (e.g. daemon processes at interpreter exit)
+    max_suspended_poll_interval = 0.02
+
     def __init__(self, so: SharedObject, x: Union[str, np.ndarray], sr):
         self.so = so
 
@@ -117,54 +508,164 @@ class Playback:
         self.new_time_used = False
         self.playback_stopped = False
 
-        with so.lock:
-            self.time = so.time.value
-            self.volume = so.volume.value
-            self.override_time = self.time
-            self.paused = so.paused.value
-            self.looping = so.looping.value
-
-        channel_count = 2 if isinstance(x, str) else (len(x.shape))
-
-        self.device = miniaudio.PlaybackDevice(sample_rate=sr,
-                                               nchannels=channel_count,
-                                               output_format=miniaudio.SampleFormat.FLOAT32,
-                                               buffersize_msec=30)
+        state = so.state.read()
+        self.time = state.time
+        self.volume = state.volume
+        self.paused = state.paused
+        self.looping = state.looping
+        self.seek_count = state.seek_count
+        # (seek_count, time) of a pending time skip, swapped as a whole between the threads
+        self.override = (self.seek_count, self.time)
+        self.published_time = self.time
+
+        # (seek_count, position, audible monotonic timestamp, rate) of the last generated block
+        self.clock = (-1, self.time, time.monotonic(), 0.0)
+        self.published_clock = self.clock
+
+        self.channel_count = 2 if isinstance(x, str) else (len(x.shape))
+        # manually stepped playback has no relation to real time, the clock does not advance between steps
+        self.stepped = so.audio_output == "manual"
+
+        # underruns are counted by the device thread and published by loop
+        self.underrun_count = 0
+        self.published_underrun_count = 0
+        # buffer size adaptation, see adapt_buffersize
+        self.last_underrun = self.resized_at = time.monotonic()
+        self.shrink_delay = self.initial_shrink_delay
+        self.shrunk = False
+        # monotonic time the next device callback is due, None after the device was (re)opened or started
+        self.callback_due = None
+        # the device is stopped while paused
+        self.suspended = False
+
+        self.device = self.open_device(so.buffersize_msec)
 
         # choose generator for audio signal deepening on how the Session was started
         self.gen_exception = None
         self.gen_instance = self.gen_file() if isinstance(x, str) else self.gen()
+        self.callbacks = self.monitored(self.gen_instance)
         # prime generator
-        next(self.gen_instance)
+        next(self.callbacks)
 
         if self.gen_exception:
             raise self.gen_exception
 
         # let miniaudio do its job in its own thread
-        self.device.start(self.gen_instance)
+        self.device.start(self.callbacks)
 
         if self.gen_exception:
             raise self.gen_exception
 
+    def open_device(self, buffersize_msec):
+        if self.so.audio_output == "device":
+            device = miniaudio.PlaybackDevice(sample_rate=self.sr,
+                                              nchannels=self.channel_count,
+                                              output_format=miniaudio.SampleFormat.FLOAT32,
+                                              buffersize_msec=buffersize_msec)
+        else:
+            device = NullPlaybackDevice(self.sr, self.channel_count, buffersize_msec,
+                                        manual=self.so.audio_output == "manual")
+        self.buffersize_msec = buffersize_msec
+        self.callback_due = None
+        # a generated block is audible after the blocks already queued in the device buffer
+        self.latency = 0 if self.stepped else buffersize_msec / 1000
+        self.so.state.update(audio_latency=self.latency)
+        return device
+
+    def monitored(self, generator):
+        """
+        Passes the device callbacks on to generator and counts underruns: callbacks which arrive later than
+        the queued audio lasts, or take longer than the audio they generate (e.g. AudioFileReaderThread.read stalls).
+        Seeks and silence are not counted, the output of a seek has to wait for the new position anyway.
+        """
+        output = next(generator)
+        while True:
+            frames = yield output
+            start = time.monotonic()
+            counted = not (self.stepped or self.paused or self.playback_stopped or self.override is not None)
+            try:
+                output = generator.send(frames)
+            except StopIteration:
+                return
+            period = frames / self.sr
+            if counted and self.callback_due is not None and \
+                    (start > self.callback_due + self.latency or time.monotonic() - start > period):
+                self.underrun_count += 1
+            self.callback_due = start + period
+
+    def adapt_buffersize(self):
+        """
+        Double the device buffer after underruns, halve it again after shrink_delay without underruns,
+        within so.buffersize_bounds. The delay doubles whenever a smaller buffer led to underruns.
+        """
+        low, high = self.so.buffersize_bounds
+        now = time.monotonic()
+        if self.underrun_count != self.published_underrun_count:
+            self.last_underrun = now
+            if self.buffersize_msec < high and now > self.resized_at + self.min_resize_interval:
+                if self.shrunk and now < self.resized_at + self.shrink_delay:
+                    self.shrink_delay *= 2
+                self.resize_device(min(high, self.buffersize_msec * 2))
+                self.shrunk = False
+        elif self.buffersize_msec > low and now > max(self.last_underrun, self.resized_at) + self.shrink_delay:
+            self.resize_device(max(low, self.buffersize_msec // 2))
+            self.shrunk = True
+
+    def resize_device(self, buffersize_msec):
+        """Reopen the device with another buffer size, the generators continue where they were"""
+        self.device.close()
+        self.device = self.open_device(buffersize_msec)
+        self.resized_at = time.monotonic()
+        self.device.start(self.callbacks)
+
+    @property
+    def suspended_poll_interval(self):
+        """At most one buffer period, resuming does not take longer than with a running device"""
+        return min(self.max_suspended_poll_interval, self.buffersize_msec / 1000)
+
+    def suspend(self):
+        self.device.stop()
+        self.suspended = True
+        # the device may have stopped before it played silence, which stops the clock otherwise
+        self.clock = (self.clock[0], self.time, time.monotonic(), 0.0)
+
+    def resume(self):
+        """Continue at the current head, the first block is generated by the first callback of the device"""
+        self.callback_due = None
+        self.suspended = False
+        self.device.start(self.callbacks)
+
+    def playing_clock(self, seek_count, start):
+        """Clock of a block starting at frame start, it is audible after the latency"""
+        if self.stepped:
+            # the end of the block is reached once a step is done
+            return seek_count, self.time, time.monotonic(), 0.0
+        return seek_count, start / self.sr, time.monotonic() + self.latency, 1.0
+
     # generator function based on ndarray
     def gen(self):
         try:
             x: np.ndarray = self.x
+            out = OutputBuffer(x.shape[1:], self.sr // 10)
             required_frames = yield b""
 
             head = 0
+            seek_count = -1
 
             while True:
                 # in paused state play silence
                 if self.paused or self.playback_stopped:
-                    required_frames = yield np.zeros((required_frames, 1), dtype=np.float32)
+                    if self.clock[3] != 0.0:
+                        self.clock = (self.clock[0], self.time, time.monotonic(), 0.0)
+                    required_frames = yield out.silence(required_frames)
                     continue
 
                 # check if time skip occurred
-                if self.override_time is not None:
+                override = self.override
+                if override is not None:
                     self.new_time_used = False
-                    ot = self.override_time
-                    self.override_time = None
+                    self.override = None
+                    seek_count, ot = override
 
                     head = int(ot * self.sr)
 
@@ -180,10 +681,10 @@ class Playback:
                         self.playback_stopped = True
 
                 self.time = head / self.sr
+                self.clock = self.playing_clock(seek_count, start)
                 self.new_time_used = True
 
-                ret = x[start:stop, None]
-                required_frames = yield ret * self.volume
+                required_frames = yield out.scaled(self.volume, x[start:stop])
         except Exception as e:
             if threading.current_thread() is threading.main_thread():
                 raise e
@@ -194,24 +695,29 @@ class Playback:
         try:
             x: str = self.x
 
-            frt = AudioFileReaderThread(x)
+            frt = open_audio_file(x, self.so.read_cache_size, self.so.decode_cache, self.so.decoding_backend, self.sr)
+            out = OutputBuffer((2,), self.sr // 10)
 
             required_frames = yield b""
 
             head = 0
+            seek_count = -1
 
             # in paused state play silence
             while True:
                 # in paused state play silence
                 if self.paused or self.playback_stopped:
-                    required_frames = yield np.zeros((required_frames, 1), dtype=np.float32)
+                    if self.clock[3] != 0.0:
+                        self.clock = (self.clock[0], self.time, time.monotonic(), 0.0)
+                    required_frames = yield out.silence(required_frames)
                     continue
 
                 # check if time skip occurred
-                if self.override_time is not None:
+                override = self.override
+                if override is not None:
                     self.new_time_used = False
-                    ot = self.override_time
-                    self.override_time = None
+                    self.override = None
+                    seek_count, ot = override
 
                     head = int(ot * self.sr)
 
@@ -227,12 +733,11 @@ class Playback:
                         self.playback_stopped = True
 
                 self.time = head / self.sr
+                self.clock = self.playing_clock(seek_count, start)
                 self.new_time_used = True
 
                 # get required frames directly from the file
-                ret = frt.read(start, stop)
-                # ret = ret.sum(axis=1) / ret.shape[1]
-                required_frames = yield ret * self.volume
+                required_frames = yield out.scaled(self.volume, *frt.read(start, stop))
 
         except Exception as e:
             if threading.current_thread() is threading.main_thread():
@@ -246,41 +751,73 @@ class Playback:
             if self.gen_exception:
                 raise self.gen_exception
 
-            with so.lock:
-                if so.stop.value or (so.close_with_last_plot and so.open_plots.value == 0):
-                    break
-
-                time_ = so.time.value
-                time_skip = so.time_skip.value
-                so.time_skip.value = False
-
-                self.looping = so.looping.value
-                self.volume = so.volume.value
-
-                if self.playback_stopped:
-                    so.paused.value = True
-                    self.paused = True
-                    self.playback_stopped = False
+            # reading the shared state does not lock, only changes are written
+            state = so.state.read()
+            if state.stop or (so.close_with_last_plot and state.open_plots == 0):
+                break
+
+            self.looping = state.looping
+            self.volume = state.volume
+
+            if self.playback_stopped:
+                so.state.update(paused=True)
+                self.paused = True
+                self.playback_stopped = False
+            else:
+                self.paused = state.paused
+
+            if state.seek_count != self.seek_count:
+                self.seek_count = state.seek_count
+                self.override = (state.seek_count, state.time)
+
+            # a paused device does not run its callback every period just to play silence
+            if self.paused != self.suspended and not self.stepped:
+                if self.paused:
+                    self.suspend()
                 else:
-                    self.paused = so.paused.value
-
-                if time_skip:
-                    self.override_time = time_
-
-                # prevent old time to be propagated
-                if self.new_time_used and self.override_time is None:
-                    so.time.value = self.time
-
-            sleep(0.001)
+                    self.resume()
+
+            step_frames = state.step_frames_requested - state.step_frames_done if self.stepped else 0
+            if step_frames > 0:
+                self.device.step(step_frames)
+                if self.gen_exception:
+                    raise self.gen_exception
+
+            # prevent old time to be propagated
+            clock = self.clock
+            if self.new_time_used and self.override is None and \
+                    (self.time != self.published_time or clock is not self.published_clock):
+                with so.state.transaction() as record:
+                    # a time skip from another process has priority
+                    if record.seek_count == self.seek_count:
+                        record.time = self.time
+                        self.published_time = self.time
+                    # plots extrapolate the audible time from the clock of the last block
+                    if record.seek_count == clock[0]:
+                        record.clock_seek_count, record.clock_position, record.clock_timestamp, \
+                            record.clock_rate = clock
+                        self.published_clock = clock
+
+            if so.buffersize_bounds is not None and not (self.stepped or self.suspended):
+                self.adapt_buffersize()
+            underrun_count = self.underrun_count
+            if underrun_count != self.published_underrun_count:
+                so.state.update(underrun_count=underrun_count)
+                self.published_underrun_count = underrun_count
+
+            if step_frames > 0:
+                # the time of the step is published, Session.step returns
+                so.state.update(step_frames_done=state.step_frames_requested)
+
+            sleep(self.suspended_poll_interval if self.suspended else 0.001)
 
     def close(self):
         self.device.close()
-        with self.so.lock:
-            self.so.stop.value = True
+        self.so.state.update(stop=True)
 
 
 # audioProcess entry point
-def audio_process_entrypoint(so: SharedObject, x, sr, stack):
+def audio_process_entrypoint(so: SharedObject, x: Union[str, SharedArray], sr, stack):
 
     def handle_exception(exc_type, exc_value, exc_traceback):
         sys.excepthook = sys.__excepthook__
@@ -297,12 +834,13 @@ def audio_process_entrypoint(so: SharedObject, x, sr, stack):
             except Exception:
                 pass
 
-        with so.lock:
-            so.stop.value = True
+        with so.state.transaction() as record:
+            record.stop = True
             if not issubclass(exc_type, KeyboardInterrupt):
-                so.error_queue_size.value += 1
-                so.total_error_count.value += 1
-                so.error_queue.put(exc)
+                record.error_queue_size += 1
+                record.total_error_count += 1
+        if not issubclass(exc_type, KeyboardInterrupt):
+            so.error_queue.put(exc)
 
         exit(0 if issubclass(exc_type, KeyboardInterrupt) else 1)
 
@@ -310,6 +848,16 @@ def audio_process_entrypoint(so: SharedObject, x, sr, stack):
 
     # noinspection PyBroadException
     try:
+        if so.audio_priority is not None or so.audio_cpus is not None:
+            # before the device and reader threads are started, they inherit the settings
+            so.scheduling_queue.put(("audio", apply_scheduling(so.audio_priority, so.audio_cpus)))
+
+        if isinstance(x, SharedArray):
+            # this process is the only one attaching to the samples,
+            # the memory is freed as soon as this process and the session are done with it
+            x.unlink()
+            x = x.array
+
         pb = Playback(so, x, sr)
         pb.loop()
         pb.close()
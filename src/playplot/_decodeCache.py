@@ -0,0 +1,155 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from typing import Optional
+
+import soundfile
+
+from ._scheduling import reset_thread_scheduling
+from ._seekIndex import Mp3SeekIndex, StreamingSoundFile
+
+# decoded float32 wav file of a cached source file and its format
+CacheEntry = namedtuple("CacheEntry", ("file", "samplerate", "frames", "channels"))
+
+
+class DecodeCache:
+    """
+    Decoded audio of compressed files, kept as float32 wav files in a folder so they can be memory mapped.
+    Entries are keyed by the path, modification time and size of the source file.
+    An entry consists of the decoded file with a json metadata file and (for mp3 files) the seek index,
+    the modification time of the metadata or index marks the last use,
+    the least recently used entries are removed once the files exceed the size limit.
+    Several processes can use the same folder, files only appear once they are complete.
+    """
+    decode_frames = 2 ** 18
+    # a decode in progress writes its temporary file continuously, older ones were left behind
+    stale_temp_age = 3600
+
+    def __init__(self, folder: str, size_limit: int):
+        self.folder = os.path.abspath(folder)
+        self.size_limit = size_limit
+
+    def key(self, path: str) -> str:
+        stat = os.stat(path)
+        return hashlib.sha1(f"{os.path.abspath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}".encode()).hexdigest()
+
+    def _paths(self, key):
+        return os.path.join(self.folder, key + ".wav"), os.path.join(self.folder, key + ".json")
+
+    def seek_index(self, path: str) -> Optional[Mp3SeekIndex]:
+        """Stored seek index of a source file, None if there is none (or the file changed since)"""
+        index_file = os.path.join(self.folder, self.key(path) + ".seek.npz")
+        try:
+            index = Mp3SeekIndex.load(index_file)
+            os.utime(index_file)
+        except (OSError, ValueError, KeyError):
+            return None
+        return index
+
+    def store_seek_index(self, path: str, index: Mp3SeekIndex) -> None:
+        os.makedirs(self.folder, exist_ok=True)
+        index_file = os.path.join(self.folder, self.key(path) + ".seek.npz")
+        temp = f"{index_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as f:
+            index.save(f)
+        os.replace(temp, index_file)
+
+    def lookup(self, path: str) -> Optional[CacheEntry]:
+        """Cache entry of a source file, None if it was not decoded yet (or changed since)"""
+        file, metadata_file = self._paths(self.key(path))
+        try:
+            with open(metadata_file) as f:
+                metadata = json.load(f)
+            if not os.path.isfile(file):
+                return None
+            os.utime(metadata_file)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(file, metadata["samplerate"], metadata["frames"], metadata["channels"])
+
+    def store(self, path: str) -> CacheEntry:
+        """Decode a source file into the cache, afterwards least recently used entries are removed"""
+        os.makedirs(self.folder, exist_ok=True)
+        key = self.key(path)
+        file, metadata_file = self._paths(key)
+        temp = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with StreamingSoundFile(path) as source:
+                # plain wav headers can only describe 4 GiB of samples
+                file_format = "RF64" if source.frames * source.channels * 4 >= 2 ** 32 - 2 ** 20 else "WAV"
+                with soundfile.SoundFile(temp, "w", source.samplerate, source.channels, subtype="FLOAT",
+                                         format=file_format) as decoded:
+                    frames = 0
+                    while True:
+                        block = source.read(self.decode_frames, dtype="float32", always_2d=True)
+                        if block.shape[0] == 0:
+                            break
+                        decoded.write(block)
+                        frames += block.shape[0]
+                entry = CacheEntry(file, source.samplerate, frames, source.channels)
+            os.replace(temp, file)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+        metadata = dict(source=os.path.abspath(path), samplerate=entry.samplerate, frames=entry.frames,
+                        channels=entry.channels)
+        with open(metadata_file + f".{os.getpid()}.tmp", "w") as f:
+            json.dump(metadata, f)
+        os.replace(metadata_file + f".{os.getpid()}.tmp", metadata_file)
+
+        self.evict(keep=key)
+        return entry
+
+    def store_in_background(self, path: str) -> threading.Thread:
+        """Decode a source file into the cache in a daemon thread, errors are ignored (the cache is optional)"""
+        def store():
+            # decoding must not compete with the (possibly real-time) thread which started it
+            reset_thread_scheduling()
+            # noinspection PyBroadException
+            try:
+                self.store(path)
+            except Exception:
+                pass
+
+        t = threading.Thread(target=store, daemon=True)
+        t.start()
+        return t
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Remove the least recently used entries until the size limit is met"""
+        # key -> [last use, size, files]
+        entries = dict()
+        for file in glob.glob(os.path.join(self.folder, "*")):
+            try:
+                stat = os.stat(file)
+                if file.endswith(".tmp"):
+                    if stat.st_mtime < time.time() - self.stale_temp_age:
+                        os.remove(file)
+                    continue
+            except OSError:
+                # removed by another process
+                continue
+            entry = entries.setdefault(os.path.basename(file).split(".")[0], [0, 0, []])
+            if not file.endswith(".wav"):
+                entry[0] = max(entry[0], stat.st_mtime)
+            entry[1] += stat.st_size
+            entry[2].append(file)
+
+        total = sum(size for _, size, _ in entries.values())
+        for key, (_, size, files) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.size_limit:
+                break
+            if key == keep:
+                continue
+            try:
+                for file in files:
+                    os.remove(file)
+            except OSError:
+                # still opened (on windows) or removed by another process
+                continue
+            total -= size
@@ -2,85 +2,143 @@ import math
 import os.path
 import sys
 import traceback
-from time import perf_counter, sleep
-from typing import Dict, Any, Optional, Tuple, Callable, List
+from time import perf_counter, sleep, monotonic
+from typing import Dict, Any, Optional, Tuple, Callable, List, Union, Sequence
 import matplotlib
 import matplotlib.axes
+import matplotlib.image
+import matplotlib.lines
+import matplotlib.patches
 import matplotlib.pyplot as plt
+import matplotlib.text
 import numpy as np
-from dill import loads
+from matplotlib.transforms import Bbox
 
-from ._util import SharedObject, show_error_box, PlotProcessException
+from ._scheduling import apply_scheduling
+from ._util import SharedObject, SharedState, show_error_box, PlotProcessException, loads_plot_payload, put_latest
 
+# seconds the cursor keeps moving without a new clock from the audio process
+MAX_CLOCK_EXTRAPOLATION = 0.25
+# seconds between the frame rates a plot reports to the session
+FRAME_RATE_REPORT_INTERVAL = 1.0
+# cursor style if the plot function does not set axvline_kwargs (for an axes)
+DEFAULT_AXVLINE_KWARGS = {"alpha": 0.9, "ls": '--', "color": 'r', "lw": 1, "zorder": 10}
+# origin stack reported for a plot which could not be unpickled (its stack is part of the payload)
+UNKNOWN_STACK = ["  (unknown, the plot could not be unpickled)"]
+# gui events which can change what a plot shows
+INPUT_EVENTS = ("key_press_event", "button_press_event", "button_release_event", "motion_notify_event",
+                "scroll_event", "resize_event")
 
-# builds a piecewise linear function mapping from X to Y
-def build_mapping_function(X, Y):
-    def func(x):
-        if x <= X[0]:
-            return Y[0]
-        if x >= X[-1]:
-            return Y[-1]
-
-        b_i = np.argmax(x < X)
-        a_i = b_i - 1
 
-        a, b = X[a_i], X[b_i]
-
-        alpha = (x - a) / (b - a)
+# builds a piecewise linear function mapping from X to Y, for scalars and arrays
+def build_mapping_function(X, Y):
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    # segments of zero width (repeated X, e.g. at the ends of warping paths) have no slope, values outside of
+    # X map to the first and last Y
+    segments = np.flatnonzero(np.diff(X) > 0)
+    if segments.shape[0] == 0:
+        segments = np.array([0])
+        slopes = np.zeros(1)
+    else:
+        slopes = (Y[segments + 1] - Y[segments]) / (X[segments + 1] - X[segments])
+    starts, offsets = X[segments], Y[segments]
+    last_segment = segments.shape[0] - 1
 
-        ret = (1 - alpha) * Y[a_i] + alpha * Y[b_i]
-        return ret
+    def func(x):
+        if np.ndim(x) == 0:
+            # np.clip is slow for single values
+            if x <= X[0]:
+                return float(Y[0])
+            if x >= X[-1]:
+                return float(Y[-1])
+            i = min(max(int(starts.searchsorted(x, side='right')) - 1, 0), last_segment)
+            return float(offsets[i] + (x - starts[i]) * slopes[i])
+        x = np.asarray(x, dtype=float)
+        i = np.clip(np.searchsorted(starts, x, side='right') - 1, 0, last_segment)
+        ret = offsets[i] + (x - starts[i]) * slopes[i]
+        return np.where(x <= X[0], Y[0], np.where(x >= X[-1], Y[-1], ret))
 
     return func
 
 
 def build_mapping_function_dense_pos_to_time(ticks, first_tick, last_tick):
+    last_index = ticks.shape[0] - 1
+    scale = last_index / (last_tick - first_tick)
+    # the slope after the last tick is never used, it keeps the last index valid
+    slopes = np.append(np.diff(ticks), 0.0)
+
     def func(x):
-        index_float = (x - first_tick) / (last_tick - first_tick) * (ticks.shape[0]-1)
-        index_float = max(0, min(ticks.shape[0]-1, index_float))
-        a_index = math.floor(index_float)
-        b_index = math.ceil(index_float)
-        alpha = index_float % 1
-        a = ticks[a_index]
-        b = ticks[b_index]
-        time = b * alpha + a * (1 - alpha)
-        return time
+        if np.ndim(x) == 0:
+            index_float = min(max((x - first_tick) * scale, 0), last_index)
+            a_index = math.floor(index_float)
+            return float(ticks[a_index] + (index_float - a_index) * slopes[a_index])
+        index_float = np.clip((x - first_tick) * scale, 0, last_index)
+        a_index = np.floor(index_float).astype(np.intp)
+        return ticks[a_index] + (index_float - a_index) * slopes[a_index]
 
     return func
 
 
 def build_mapping_function_dense_time_to_pos(ticks, first_tick, last_tick):
-    def func(x):
-        i = np.searchsorted(ticks, x, side='left')
+    last_index = ticks.shape[0] - 1
+    scale = (last_tick - first_tick) / last_index
+    # infinite for repeated ticks, times within the ticks never fall into such an interval
+    with np.errstate(divide='ignore'):
+        inverse_slopes = 1 / np.diff(ticks)
 
-        if i == ticks.shape[0]:
-            raw_pos = ticks.shape[0] - 1
-        elif i == 0:
-            raw_pos = 0
-        else:
-            a = ticks[i - 1]
-            b = ticks[i]
-            alpha = (x - a) / (b - a)
-            raw_pos = (i - 1) * (1 - alpha) + i * alpha
+    def func(x):
+        # index of the tick interval, times outside of the ticks map to the first and last position
+        if np.ndim(x) == 0:
+            if x <= ticks[0]:
+                return float(first_tick)
+            if x >= ticks[-1]:
+                return float(last_index * scale + first_tick)
+            i = int(ticks.searchsorted(x, side='left'))
+            return float(((i - 1) + (x - ticks[i - 1]) * inverse_slopes[i - 1]) * scale + first_tick)
+        x = np.asarray(x, dtype=float)
+        i = np.clip(np.searchsorted(ticks, x, side='left'), 1, last_index)
+        with np.errstate(invalid='ignore'):
+            raw_pos = (i - 1) + (x - ticks[i - 1]) * inverse_slopes[i - 1]
+        raw_pos = np.where(x <= ticks[0], 0, np.where(x >= ticks[-1], last_index, raw_pos))
+        return raw_pos * scale + first_tick
 
-        pos = (raw_pos / (ticks.shape[0]-1)) * (last_tick - first_tick) + first_tick
+    return func
 
-        return pos
 
-    return func
+def mapping_functions(mapping) -> Tuple[Callable, Callable]:
+    """
+    Functions (time_to_pos, pos_to_time) of a plot ``mapping`` parameter (sparse or dense, see the plot function),
+    they accept single values and numpy arrays, e.g. to position many artists in a draw function at once.
+    """
+    if isinstance(mapping, np.ndarray):
+        return build_mapping_function(mapping[:, 0], mapping[:, 1]), \
+            build_mapping_function(mapping[:, 1], mapping[:, 0])
+    return build_mapping_function_dense_time_to_pos(*mapping), build_mapping_function_dense_pos_to_time(*mapping)
 
 
 # Main plot class
 class MPP:
-    def pos_to_time(self, p: float) -> float:
-        time = self.map_pos_to_time(p)
+    def pos_to_time(self, p: Union[float, np.ndarray], axes_index: int = 0) -> Union[float, np.ndarray]:
+        time = self.maps_pos_to_time[axes_index](p)
+        if np.ndim(time):
+            return np.clip(time, 0, self.so.duration)
         return max(0, min(self.so.duration, time))
 
-    def time_to_pos(self, time: float) -> float:
+    def time_to_pos(self, time: Union[float, np.ndarray], axes_index: int = 0) -> Union[float, np.ndarray]:
         # a, b = self.ax.dataLim.x0, self.ax.dataLim.x1
-        p = self.map_time_to_pos(time)
+        p = self.maps_time_to_pos[axes_index](time)
         return p  # max(a, min(b, p))
 
+    def seek(self, time: float, paused: bool) -> None:
+        with self.so.state.transaction() as record:
+            # only changes are written, writes retry the lock free reads of the other processes
+            if paused != record.paused:
+                record.paused = paused
+            if time != record.time:
+                record.time = time
+                record.seek_count += 1
+
     def on_click(self, event):
         so = self.so
 
@@ -92,95 +150,82 @@ class MPP:
 
         # middle click -> play/pause
         if event.button == 2:
-            with so.lock:
-                so.paused.value = not so.paused.value
+            with so.state.transaction() as record:
+                record.paused = not record.paused
             return
 
-        if event.inaxes != self.ax:
+        if event.inaxes not in self.axes:
             return
 
-        time = self.pos_to_time(event.xdata)
-
-        with so.lock:
-            so.paused.value = True
-            if time != so.time.value:
-                so.time.value = time
-                so.time_skip.value = True
+        self.drag_time = None
+        self.seek(self.pos_to_time(event.xdata, self.axes.index(event.inaxes)), True)
 
     def on_move(self, event):
-        so = self.so
-
         if self.fig.canvas.cursor().shape() != 0 or not (
-                self.pressed_buttons[1] or self.pressed_buttons[3]) or event.inaxes != self.ax:
+                self.pressed_buttons[1] or self.pressed_buttons[3]) or event.inaxes not in self.axes:
             return
 
-        time = self.pos_to_time(event.xdata)
-
-        with so.lock:
-            so.paused.value = True
-            if time != so.time.value:
-                so.time.value = time
-                so.time_skip.value = True
+        # published by the next frame, a fast drag would flood the other processes with seeks otherwise
+        self.drag_time = self.pos_to_time(event.xdata, self.axes.index(event.inaxes))
 
     def on_release(self, event):
-        so = self.so
-
         self.pressed_buttons[event.button] = False
 
-        if self.fig.canvas.cursor().shape() != 0 or event.button != 1 or event.inaxes != self.ax:
+        if self.fig.canvas.cursor().shape() != 0 or event.button != 1 or event.inaxes not in self.axes:
             return
 
-        time = self.pos_to_time(event.xdata)
+        self.drag_time = None
+        self.seek(self.pos_to_time(event.xdata, self.axes.index(event.inaxes)), self.pressed_buttons[3])
 
-        with so.lock:
-            so.paused.value = self.pressed_buttons[3]
-            if time != so.time.value:
-                so.time.value = time
-                so.time_skip.value = True
+    # noinspection PyUnusedLocal
+    def on_input(self, event):
+        self.input_changed = True
 
     def on_key(self, event):
         so = self.so
         if event.key == "c":
             self.hidden = not self.hidden
         if event.key in [" ", "enter"]:
-            with so.lock:
-                so.paused.value = not so.paused.value
+            with so.state.transaction() as record:
+                record.paused = not record.paused
+
+    def per_axes_param(self, name: str, default: Any = None) -> List[Any]:
+        """
+        Value of a param for every axes, a list holds one value per axes, others apply to all axes.
+        None (as a whole or as an entry) is replaced by the default.
+        """
+        value = self.params.get(name)
+        if isinstance(value, list):
+            assert len(value) == len(self.axes), f"{name} requires one entry per axes"
+        else:
+            value = [value] * len(self.axes)
+        return [default if v is None else v for v in value]
 
     # load the default parameter if parameter is not specified from plot function
     def load_default_params(self):
         so = self.so
         params = self.params
-        if "mapping" in params:
-            arr = params["mapping"]
-        else:
-            arr = np.array([[0, self.ax.dataLim.x0], [so.duration, self.ax.dataLim.x1]])
+        for ax, arr, time_to_pos, pos_to_time in zip(self.axes, self.per_axes_param("mapping"),
+                                                     self.per_axes_param("custom_time_to_pos_function"),
+                                                     self.per_axes_param("custom_pos_to_time_function")):
+            if arr is None:
+                arr = np.array([[0, ax.dataLim.x0], [so.duration, ax.dataLim.x1]])
 
-        assert (isinstance(arr, tuple) and len(arr) == 3) or \
-               (len(arr.shape) == 2 and arr.shape[1] == 2 and arr.dtype == float), \
-               "invalid mapping"
+            assert (isinstance(arr, tuple) and len(arr) == 3) or \
+                   (len(arr.shape) == 2 and arr.shape[1] == 2 and arr.dtype == float), \
+                   "invalid mapping"
 
-        if "custom_time_to_pos_function" in params:
-            self.map_time_to_pos = params["custom_time_to_pos_function"]
-        else:
-            if isinstance(arr, np.ndarray):
-                self.map_time_to_pos = build_mapping_function(arr[:, 0], arr[:, 1])
-            else:
-                self.map_time_to_pos = build_mapping_function_dense_time_to_pos(*arr)
+            default_time_to_pos, default_pos_to_time = mapping_functions(arr)
+            time_to_pos = time_to_pos or default_time_to_pos
+            pos_to_time = pos_to_time or default_pos_to_time
 
-        if "custom_pos_to_time_function" in params:
-            self.map_pos_to_time = params["custom_pos_to_time_function"]
-        else:
-            if isinstance(arr, np.ndarray):
-                self.map_pos_to_time = build_mapping_function(arr[:, 1], arr[:, 0])
-            else:
-                self.map_pos_to_time = build_mapping_function_dense_pos_to_time(*arr)
+            self.maps_time_to_pos.append(time_to_pos)
+            self.maps_pos_to_time.append(pos_to_time)
+        self.map_time_to_pos, self.map_pos_to_time = self.maps_time_to_pos[0], self.maps_pos_to_time[0]
 
         if "title" not in params:
             params["title"] = "Fig"
 
-        if "axvline_kwargs" not in params:
-            params["axvline_kwargs"] = {"alpha": 0.9, "ls": '--', "color": 'r', "lw": 1, "zorder": 10}
-
         if "artists" not in params or "draw_function" not in params:
             params["artists"] = []
             params["draw_function"] = lambda *args, **kwargs: False
@@ -194,24 +239,33 @@ class MPP:
         if "window_pos" not in params:
             params["window_pos"] = None
 
-    def __init__(self, fig: plt.Figure, ax: matplotlib.axes.Axes, params: Dict[str, Any], so: SharedObject):
+    def __init__(self, fig: plt.Figure, ax: Union[matplotlib.axes.Axes, Sequence[matplotlib.axes.Axes]],
+                 params: Dict[str, Any], so: SharedObject):
         self.fig: plt.Figure = fig
-        self.ax: matplotlib.axes.Axes = ax
+        # every axes gets a cursor with its own mapping, all of them are updated in one blit
+        self.axes: List[matplotlib.axes.Axes] = [ax] if isinstance(ax, matplotlib.axes.Axes) else list(np.ravel(ax))
+        self.ax: matplotlib.axes.Axes = self.axes[0]
         self.params: Dict[str, Any] = params
         self.so: SharedObject = so
 
+        # mappings of the first axes
         self.map_time_to_pos: Optional[Callable] = None
         self.map_pos_to_time: Optional[Callable] = None
+        self.maps_time_to_pos: List[Callable] = []
+        self.maps_pos_to_time: List[Callable] = []
 
         self.load_default_params()
 
         # keep track of pressed mouse buttons (maybe more than 4?)
         self.pressed_buttons: List[bool] = [False for _ in range(10)]
+        # latest time the mouse was dragged to and not yet published, when the last drag seek was published
+        self.drag_time: Optional[float] = None
+        self.drag_seek_published = 0.0
         self.hidden = False
         self.artists = []
+        self.cursors = []
 
-        with so.lock:
-            self.start_time = so.time.value
+        self.start_time = so.state.time
 
         self.fig.canvas.manager.set_window_title(self.params["title"])
         if params["window_pos"] is not None:
@@ -223,114 +277,260 @@ class MPP:
             fig.canvas.mpl_connect('button_press_event', self.on_click)
             fig.canvas.mpl_connect('motion_notify_event', self.on_move)
 
-            v_line = self.ax.axvline(self.time_to_pos(self.start_time), **self.params["axvline_kwargs"])
-            self.artists.append(v_line)
+            axvline_kwargs_per_axes = self.per_axes_param("axvline_kwargs", DEFAULT_AXVLINE_KWARGS)
+            for index, (ax, axvline_kwargs) in enumerate(zip(self.axes, axvline_kwargs_per_axes)):
+                self.cursors.append(ax.axvline(self.time_to_pos(self.start_time, index), **axvline_kwargs))
+            self.artists.extend(self.cursors)
 
         self.artists.extend(params["artists"])
 
         # BlitManager allows for efficient animations without redrawing everything
         self.blit_manager = BlitManager(self.fig.canvas, self.artists)
 
+        # the draw function is only called if one of its arguments or the figure changed
+        self.input_changed = True
+        self.last_drawn: Optional[Tuple[float, bool]] = None
+        for name in INPUT_EVENTS:
+            fig.canvas.mpl_connect(name, self.on_input)
+        # the last frame updated the screen, frames which did since the last frame rate report
+        self.rendered = False
+        self.rendered_frames = 0
+        self.frame_rate_start = perf_counter()
+
+        self.fig_num = self.fig.number
+        self.last_time = self.start_time
+        self.last_hidden = False
+        self.last_save_index = -1
+
         # Initial plot show + time for gui loop to render
         plt.show(block=False)
         plt.pause(0.1)
 
-    def loop(self):
+    def update(self, state: SharedState.Snapshot, flush_events: bool = True) -> bool:
+        """Render one frame, returns False once the plot was closed"""
         so = self.so
-        fig_num = self.fig.number
-
-        last_time = self.start_time
-        last_hidden = False
-
-        last_frame = perf_counter()
-
-        last_save_index = -1
 
         # detect when window is closed
-        while plt.fignum_exists(fig_num):
-            with so.lock:
-                if so.stop.value:
-                    break
-                save_index = so.save_as_frame_number.value
-                fps_target = so.fps_target.value
-                min_delay = so.plot_min_sleep.value
-                time = so.time.value
-                paused = so.paused.value
-
-            gui_update_necessary = False
-            pos = self.time_to_pos(time)
-
-            if self.params["override_update_function"] is None:
-                if last_time != time or self.hidden != last_hidden:
-                    self.artists[0].set_xdata([pos, pos])
-                    self.artists[0].set(visible=not self.hidden)
-                    last_time = time
-                    last_hidden = self.hidden
-                    gui_update_necessary = True
-
-            else:
-                new_time_or_pos, new_paused = self.params["override_update_function"](time, pos, bool(paused))
-                assert isinstance(new_time_or_pos, float), "the new time must be a float"
-                assert isinstance(new_paused, bool), "the new paused must be a bool"
-                time_or_pos_changed = new_time_or_pos != time
-                if self.params["override_update_function_returns_pos"]:
-                    time_or_pos_changed = new_time_or_pos != pos
-                    new_time_or_pos = self.map_pos_to_time(new_time_or_pos)
-
-                new_time_or_pos = max(0, min(so.duration, new_time_or_pos))
-                if time_or_pos_changed or new_paused != paused:
-                    time = new_time_or_pos
-                    paused = new_paused
-                    with so.lock:
-                        so.paused.value = paused
-                        if time != so.time.value:
-                            so.time.value = time
-                            so.time_skip.value = True
+        if state.stop or not plt.fignum_exists(self.fig_num):
+            return False
+
+        if self.drag_time is not None and \
+                (so.max_seek_rate is None or perf_counter() - self.drag_seek_published >= 1 / so.max_seek_rate):
+            self.seek(self.drag_time, True)
+            self.drag_time = None
+            self.drag_seek_published = perf_counter()
+            state = so.state.read()
+
+        save_index = state.save_as_frame_number
+        time = audible_time(state, so.duration)
+        paused = state.paused
+
+        gui_update_necessary = False
+        pos = self.time_to_pos(time)
+
+        if self.params["override_update_function"] is None:
+            if self.last_time != time or self.hidden != self.last_hidden:
+                for index, cursor in enumerate(self.cursors):
+                    cursor_pos = pos if index == 0 else self.time_to_pos(time, index)
+                    cursor.set_xdata([cursor_pos, cursor_pos])
+                    cursor.set(visible=not self.hidden)
+                self.last_time = time
+                self.last_hidden = self.hidden
+                gui_update_necessary = True
 
+        else:
+            new_time_or_pos, new_paused = self.params["override_update_function"](time, pos, bool(paused))
+            assert isinstance(new_time_or_pos, float), "the new time must be a float"
+            assert isinstance(new_paused, bool), "the new paused must be a bool"
+            time_or_pos_changed = new_time_or_pos != time
+            if self.params["override_update_function_returns_pos"]:
+                time_or_pos_changed = new_time_or_pos != pos
+                new_time_or_pos = self.map_pos_to_time(new_time_or_pos)
+
+            new_time_or_pos = max(0, min(so.duration, new_time_or_pos))
+            if time_or_pos_changed or new_paused != paused:
+                time = new_time_or_pos
+                paused = new_paused
+                self.seek(time, paused)
+
+        # the override update function can change the time at any frame, the draw function has to follow
+        if self.input_changed or self.last_drawn != (time, bool(paused)) or \
+                self.params["override_update_function"] is not None:
             gui_update_necessary |= self.params["draw_function"](time, pos, bool(paused))
+            self.input_changed = False
+            self.last_drawn = (time, bool(paused))
+
+        self.rendered = gui_update_necessary
+        if gui_update_necessary:
+            self.blit_manager.update(flush_events)
+            self.rendered_frames += 1
+        elif flush_events:
+            # gui needs time to process internal updates
+            self.fig.canvas.flush_events()
+
+        now = perf_counter()
+        if now - self.frame_rate_start >= FRAME_RATE_REPORT_INTERVAL:
+            frame_rate = self.rendered_frames / (now - self.frame_rate_start)
+            put_latest(so.frame_rate_queue, (self.params["title"], frame_rate))
+            self.rendered_frames = 0
+            self.frame_rate_start = now
+
+        # save plot as png
+        if save_index != -1 and save_index != self.last_save_index:
+            _save_fig_as_png(self.fig, os.path.join(so.save_folder, f"{self.params['title']}_{save_index:06d}.png"))
+            with so.state.transaction() as record:
+                record.plots_wrote_current_frame += 1
+        self.last_save_index = save_index
+
+        return True
 
-            if gui_update_necessary:
-                self.blit_manager.update()
-            else:
-                # gui needs time to process internal updates
-                self.fig.canvas.flush_events()
+    def loop(self):
+        scheduler = FrameScheduler(self.so.state, self.so.idle_fps)
+        scheduler.watch(self.fig.canvas)
+        while True:
+            # lock free read of the shared state
+            state = self.so.state.read()
+            frame_start = perf_counter()
+            if not self.update(state):
+                break
+            scheduler.wait(state, frame_start, self.rendered, self.fig.canvas)
 
-            # save plot as png
-            if save_index != -1 and save_index != last_save_index:
-                _save_fig_as_png(self.fig, os.path.join(so.save_folder, f"{self.params['title']}_{save_index:06d}.png"))
-                with so.lock:
-                    so.plots_wrote_current_frame.value += 1
-            last_save_index = save_index
+    def close(self) -> None:
+        plt.close(self.fig)
 
-            # sleep to give processor time for other tasks
-            now = perf_counter()
-            delay = (1 / fps_target) - (now - last_frame)
-            delay = max(min_delay, delay)
-            last_frame = now
-            if delay > 0:
-                sleep(delay)
 
+def audible_time(state: SharedState.Snapshot, duration: float) -> float:
+    """
+    Playback time audible right now, extrapolated from the clock the audio process publishes once per audio block.
+    Falls back to the published time while paused or until the audio process has caught up with a time skip.
+    """
+    if state.paused or state.clock_seek_count != state.seek_count:
+        return state.time
 
-def call_func(func, args, kwargs) -> Optional[
-              Tuple[plt.Figure, matplotlib.axes.Axes, Dict[str, Any]]]:
+    # do not run away if the audio process stalls
+    elapsed = min(monotonic() - state.clock_timestamp, MAX_CLOCK_EXTRAPOLATION)
+    time = state.clock_position + elapsed * state.clock_rate
+    if state.looping and duration > 0:
+        time %= duration
+    return max(0.0, min(duration, time))
+
+
+class FrameScheduler:
+    """
+    Decides when the next frame of a plot process is due and yields the processor until then.
+    Frames are due at fps_target, lowered automatically if rendering would take more than max_render_load of the
+    frame time (the render cost is measured). Frames which were missed because rendering fell behind are skipped.
+    While paused and nothing was rendered, frames are only due at idle_fps. This wait runs the gui event loop,
+    input in a watched figure ends it immediately, seeks and save requests end it within a frame of fps_target.
+    """
+    max_render_load = 0.75
+    # weight of the latest rendered frame in the render cost
+    cost_weight = 0.1
+
+    def __init__(self, shared_state: SharedState, idle_fps: float):
+        self.shared_state = shared_state
+        self.idle_fps = idle_fps
+        # seconds per rendered frame (moving average), 0 until the first frame was rendered
+        self.render_cost = 0.0
+        self.next_frame = perf_counter()
+        self.skipped_frames = 0
+        self._waiting_canvas = None
+
+    def watch(self, canvas) -> None:
+        """End idle waits on input events of the canvas"""
+        for name in INPUT_EVENTS:
+            canvas.mpl_connect(name, self.wake)
+
+    # noinspection PyUnusedLocal
+    def wake(self, event=None) -> None:
+        if self._waiting_canvas is not None:
+            self._waiting_canvas.stop_event_loop()
+
+    def _idle_wait(self, state: SharedState.Snapshot, delay: float, canvas) -> None:
+        """Run the event loop of the canvas for delay, until woken or the state requires a frame"""
+        def check_state():
+            current = self.shared_state.read()
+            if current.seek_count != state.seek_count or current.stop or current.paused != state.paused or \
+                    current.save_as_frame_number != state.save_as_frame_number:
+                self.wake()
+
+        # the shared state is checked once per frame of fps_target, by a timer of the running event loop
+        timer = canvas.new_timer(interval=max(1, int(1000 / state.fps_target)))
+        timer.add_callback(check_state)
+        self._waiting_canvas = canvas
+        timer.start()
+        try:
+            canvas.start_event_loop(delay)
+        finally:
+            timer.stop()
+            self._waiting_canvas = None
+
+    def frame_rate(self, state: SharedState.Snapshot) -> float:
+        """Frame rate while rendering, fps_target or lower if rendering is too slow for it"""
+        if self.render_cost > 0:
+            return min(state.fps_target, self.max_render_load / self.render_cost)
+        return state.fps_target
+
+    def wait(self, state: SharedState.Snapshot, frame_start: float, rendered: bool, canvas=None) -> None:
+        """
+        Wait for the next frame after a frame which started at frame_start,
+        an idle wait processes the gui events (of all figures) in the event loop of the canvas meanwhile.
+        """
+        now = perf_counter()
+        if rendered:
+            duration = now - frame_start
+            self.render_cost += self.cost_weight * (duration - self.render_cost) if self.render_cost else duration
+
+        idle = state.paused and not rendered
+        period = 1 / (min(self.idle_fps, state.fps_target) if idle else self.frame_rate(state))
+        self.next_frame += period
+        if self.next_frame < now:
+            # render the current time now instead of catching up on the missed frames
+            missed = int((now - self.next_frame) / period)
+            self.skipped_frames += missed
+            self.next_frame += missed * period
+        delay = max(state.plot_min_sleep, self.next_frame - now)
+
+        if idle and canvas is not None:
+            self._idle_wait(state, delay, canvas)
+            # woken early, the following frames are timed from now on
+            self.next_frame = min(self.next_frame, perf_counter())
+        elif delay > 0:
+            sleep(delay)
+
+
+def use_backend():
     # set backend; Important if we don't set it explicitly we could get anything; this overrides wats in the env
     # Qt is well-supported and generally great, Cairo is way more efficient than Agg
     matplotlib.use("Qt5Cairo")
     plt.ion()
 
+
+def _is_axes(ax) -> bool:
+    """A single Axes or a non-empty sequence (e.g. the array of plt.subplots) of them"""
+    if isinstance(ax, matplotlib.axes.Axes):
+        return True
+    return isinstance(ax, (list, tuple, np.ndarray)) and len(ax) > 0 and \
+        all(isinstance(a, matplotlib.axes.Axes) for a in np.ravel(ax))
+
+
+def call_func(func, args, kwargs) -> Optional[
+              Tuple[plt.Figure, Union[matplotlib.axes.Axes, Sequence[matplotlib.axes.Axes]], Dict[str, Any]]]:
+    use_backend()
+
     # call user defined function passed from other processes
     ret = func(*args, **kwargs)
 
     # Determine return type of func or fallback to "static" plot
     # with mapping (Figure, Axes, ndarray)
     if isinstance(ret, tuple) and len(ret) == 3 and isinstance(ret[0], plt.Figure) and \
-            isinstance(ret[1], matplotlib.axes.Axes) and isinstance(ret[2], dict):
+            _is_axes(ret[1]) and isinstance(ret[2], dict):
         fig, ax, params = ret
         return fig, ax, params
 
     # without mapping (Figure, Axes)
     elif isinstance(ret, tuple) and len(ret) == 2 and isinstance(ret[0], plt.Figure) and \
-            isinstance(ret[1], matplotlib.axes.Axes):
+            _is_axes(ret[1]):
         fig, ax = ret
         return fig, ax, dict()
 
@@ -341,39 +541,62 @@ def call_func(func, args, kwargs) -> Optional[
         raise ValueError("Invalid return value from plotting function")
 
 
+def _count_open_plot(so: SharedObject) -> None:
+    with so.state.transaction() as record:
+        record.open_plots = record.open_plots + (2 if record.open_plots < 0 else 1)
+
+
+def _report_exception(so: SharedObject, stack, exc_type, exc_value, exc_traceback) -> None:
+    """Report an exception of a plot to the session, the plot no longer counts as open"""
+    exc = PlotProcessException(exc_value,
+                               "".join(traceback.format_exception(exc_type, exc_value, exc_traceback)),
+                               stack)
+    print(f"Plot Process {'-' * (100 - 13)}\n{exc}{'-' * 100}", file=sys.stderr)
+
+    if so.show_msg_box_on_error_in_other_process:
+        # noinspection PyBroadException
+        try:
+            show_error_box(str(exc))
+        except Exception:
+            pass
+
+    with so.state.transaction() as record:
+        record.open_plots -= 1
+        if not issubclass(exc_type, KeyboardInterrupt):
+            record.error_queue_size += 1
+            record.total_error_count += 1
+    if not issubclass(exc_type, KeyboardInterrupt):
+        so.error_queue.put(exc)
+
+
+def _apply_plot_scheduling(so: SharedObject):
+    # plot processes are lowered in priority, so they do not compete with the audio process
+    if so.plot_nice is not None or so.plot_cpus is not None:
+        so.scheduling_queue.put(("plot", apply_scheduling(so.plot_nice, so.plot_cpus)))
+
+
 # entry point for process
 def plot_process_entrypoint(so: SharedObject, dill):
+    _apply_plot_scheduling(so)
+    _run_plot(so, dill)
+
+
+def _run_plot(so: SharedObject, dill):
     # keep count of open plots and close on ctrl-c
     try:
-        func, stack, args, kwargs = loads(dill)
-        with so.lock:
-            so.open_plots.value = so.open_plots.value + (2 if so.open_plots.value < 0 else 1)
+        func, stack, args, kwargs = loads_plot_payload(dill)
+        _count_open_plot(so)
 
     except KeyboardInterrupt:
         return
+    except Exception:
+        _count_open_plot(so)
+        _report_exception(so, UNKNOWN_STACK, *sys.exc_info())
+        return
 
     def handle_exception(exc_type, exc_value, exc_traceback):
         sys.excepthook = sys.__excepthook__
-        traceback.format_exc()
-        exc = PlotProcessException(exc_value,
-                                   "".join(traceback.format_exception(exc_type, exc_value, exc_traceback)),
-                                   stack)
-        print(f"Plot Process {'-' * (100 - 13)}\n{exc}{'-' * 100}", file=sys.stderr)
-
-        if so.show_msg_box_on_error_in_other_process:
-            # noinspection PyBroadException
-            try:
-                show_error_box(str(exc))
-            except Exception:
-                pass
-
-        with so.lock:
-            so.open_plots.value -= 1
-            if not issubclass(exc_type, KeyboardInterrupt):
-                so.error_queue_size.value += 1
-                so.total_error_count.value += 1
-                so.error_queue.put(exc)
-
+        _report_exception(so, stack, exc_type, exc_value, exc_traceback)
         exit(0 if issubclass(exc_type, KeyboardInterrupt) else 1)
 
     sys.excepthook = handle_exception
@@ -387,12 +610,135 @@ def plot_process_entrypoint(so: SharedObject, dill):
             mpp = MPP(*func_ret, so=so)
             mpp.loop()
 
-        with so.lock:
-            so.open_plots.value -= 1
+        with so.state.transaction() as record:
+            record.open_plots -= 1
     except Exception:
         handle_exception(*sys.exc_info())
 
 
+class _StaticPlots:
+    """Figures of a plot function without return value, open as long as one of the figures is open"""
+    # nothing is rendered per frame
+    rendered = False
+
+    def __init__(self, fig_nums):
+        self.fig_nums = fig_nums
+        plt.show(block=False)
+
+    # noinspection PyUnusedLocal
+    def update(self, state: SharedState.Snapshot, flush_events: bool = True) -> bool:
+        return not state.stop and any(plt.fignum_exists(fig_num) for fig_num in self.fig_nums)
+
+    def close(self) -> None:
+        for fig_num in self.fig_nums:
+            plt.close(fig_num)
+
+
+# entry point for a process hosting all plots of a session, with one event loop and frame scheduler
+def plot_host_entrypoint(so: SharedObject, connection):
+    # plot and origin stack
+    plots: List[Tuple[Any, List[str]]] = list()
+    connection_open = True
+    _apply_plot_scheduling(so)
+
+    # noinspection PyBroadException
+    try:
+        # warm up, errors get reported when a plot is created
+        use_backend()
+    except Exception:
+        pass
+
+    scheduler = FrameScheduler(so.state, so.idle_fps)
+    try:
+        while True:
+            state = so.state.read()
+            if state.stop or (not connection_open and not plots):
+                break
+
+            # create new plots, an error only affects the plot it occurred in
+            while connection_open and connection.poll(0):
+                try:
+                    payload = connection.recv_bytes()
+                except (EOFError, OSError):
+                    connection_open = False
+                    break
+                _count_open_plot(so)
+                stack = UNKNOWN_STACK
+                # noinspection PyBroadException
+                try:
+                    func, stack, args, kwargs = loads_plot_payload(payload)
+                    fig_nums = set(plt.get_fignums())
+                    func_ret = call_func(func, args, kwargs)
+                    if func_ret is None:
+                        plot = _StaticPlots(set(plt.get_fignums()) - fig_nums)
+                    else:
+                        plot = MPP(*func_ret, so=so)
+                        scheduler.watch(plot.fig.canvas)
+                    plots.append((plot, stack))
+                except Exception:
+                    _report_exception(so, stack, *sys.exc_info())
+
+            # render all plots, the gui events of all figures are processed once per frame
+            frame_start = perf_counter()
+            rendered = False
+            for plot, stack in list(plots):
+                # noinspection PyBroadException
+                try:
+                    open_ = plot.update(state, flush_events=False)
+                except Exception:
+                    plots.remove((plot, stack))
+                    plot.close()
+                    _report_exception(so, stack, *sys.exc_info())
+                    continue
+                if not open_:
+                    plots.remove((plot, stack))
+                    with so.state.transaction() as record:
+                        record.open_plots -= 1
+                    continue
+                rendered |= getattr(plot, "rendered", False)
+            canvas = plt.gcf().canvas if plt.get_fignums() else None
+            if canvas is not None:
+                canvas.flush_events()
+
+            scheduler.wait(state, frame_start, rendered, canvas)
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        # the host itself failed, this affects all of its plots
+        exc_info = sys.exc_info()
+        for _, stack in plots:
+            _report_exception(so, stack, *exc_info)
+        plots.clear()
+    finally:
+        connection.close()
+        with so.state.transaction() as record:
+            record.open_plots -= len(plots)
+
+
+# entry point for a pre-started process of the PlotWorkerPool
+def plot_worker_entrypoint(so: SharedObject, connection):
+    _apply_plot_scheduling(so)
+    try:
+        # warm up, errors get reported when the plot is created
+        # noinspection PyBroadException
+        try:
+            use_backend()
+        except Exception:
+            pass
+
+        # wait for a plot, the pool closes the connection if the worker is no longer needed
+        while not connection.poll(0.1):
+            if so.state.stop:
+                return
+        dill = connection.recv_bytes()
+    except (EOFError, OSError, KeyboardInterrupt):
+        return
+    finally:
+        connection.close()
+
+    _run_plot(so, dill)
+
+
 def _save_fig_as_png(fig, file):
     # No idea how to do it any other way
     # noinspection PyProtectedMember
@@ -403,7 +749,14 @@ def _save_fig_as_png(fig, file):
 class BlitManager:
     """
     From: https://matplotlib.org/stable/tutorials/advanced/blitting.html
+    Only the dirty regions are restored and blitted: the pixels the animated artists covered in the previous frame
+    and cover now, overlapping regions are merged.
     """
+    # pixels added around the window extents for antialiasing
+    margin = 2
+    # backgrounds that can only be restored as a whole (cairo) are copied in tiles of this size
+    tile_size = 32
+
     def __init__(self, canvas, animated_artists=()):
         """
         Parameters
@@ -418,7 +771,17 @@ class BlitManager:
         """
         self.canvas = canvas
         self._bg = None
+        # (column, row) -> background of the tile, None if the background can be restored partially
+        self._tiles: Optional[Dict[Tuple[int, int], Any]] = None
+        # renderer of the last draw, window extents of some artists need it
+        self._renderer = None
         self._artists = []
+        # artist -> pixel rectangle it covered when drawn the last time
+        self._extents: Dict[Any, Optional[Tuple[int, int, int, int]]] = dict()
+        # pixels restored and blitted in the last frame, and in all frames
+        self.frame_pixels = 0
+        self.total_pixels = 0
+        self.frames = 0
 
         for a in animated_artists:
             self.add_artist(a)
@@ -431,8 +794,11 @@ class BlitManager:
         if event is not None:
             if event.canvas != cv:
                 raise RuntimeError
+            self._renderer = event.renderer
         self._bg = cv.copy_from_bbox(cv.figure.bbox)
+        self._tiles = None if self._restores_partially() else self._copy_tiles()
         self._draw_animated()
+        self._extents = {a: self._extent(a) for a in self._artists}
 
     def add_artist(self, art):
         """
@@ -459,19 +825,122 @@ class BlitManager:
         for a in sorted_artists:
             fig.draw_artist(a)
 
-    def update(self):
+    def _size(self):
+        bbox = self.canvas.figure.bbox
+        return int(bbox.width), int(bbox.height)
+
+    def _copy_tiles(self) -> Dict[Tuple[int, int], Any]:
+        width, height = self._size()
+        t = self.tile_size
+        return {(i, j): self.canvas.copy_from_bbox(
+                    Bbox.from_extents(x, max(0, height - y - t), min(width, x + t), height - y))
+                for i, x in enumerate(range(0, width, t)) for j, y in enumerate(range(0, height, t))}
+
+    def _extent(self, artist) -> Optional[Tuple[int, int, int, int]]:
+        """Pixel rectangle (x0, y0, x1, y1) (top left origin, exclusive) the artist covers, None if not visible"""
+        if not artist.get_visible():
+            return None
+        fig = self.canvas.figure
+        clip_box = artist.get_clip_box()
+        # window extents do not include the width of strokes
+        if isinstance(artist, (matplotlib.lines.Line2D, matplotlib.patches.Patch)):
+            bbox = artist.get_window_extent(self._renderer).padded(artist.get_linewidth() * fig.dpi / 72)
+        elif isinstance(artist, matplotlib.text.Text):
+            bbox = artist.get_window_extent(self._renderer)
+            patch = artist.get_bbox_patch()
+            if patch is not None:
+                # the box around the text is only positioned when the text is drawn
+                artist.update_bbox_position_size(self._renderer)
+                bbox = Bbox.union([bbox, patch.get_window_extent(self._renderer).padded(
+                    patch.get_linewidth() * fig.dpi / 72)])
+        elif isinstance(artist, matplotlib.image.AxesImage):
+            bbox = artist.get_window_extent(self._renderer)
+        # the extents of other artists (e.g. collections) do not always include everything that is drawn
+        elif artist.get_clip_on() and clip_box is not None:
+            bbox = clip_box
+        else:
+            bbox = fig.bbox
+        if artist.get_clip_on() and clip_box is not None:
+            bbox = Bbox.intersection(bbox, clip_box)
+            if bbox is None:
+                return None
+        if not np.all(np.isfinite(bbox.extents)):
+            bbox = self.canvas.figure.bbox
+
+        width, height = self._size()
+        m = self.margin
+        x0, x1 = max(0, math.floor(bbox.x0) - m), min(width, math.ceil(bbox.x1) + m)
+        y0, y1 = max(0, height - math.ceil(bbox.y1) - m), min(height, height - math.floor(bbox.y0) + m)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return x0, y0, x1, y1
+
+    def _dirty_regions(self) -> List[Tuple[int, int, int, int]]:
+        """Previous and current extents of all artists, overlapping ones are merged"""
+        extents = {a: self._extent(a) for a in self._artists}
+        regions = [r for a in self._artists for r in (self._extents.get(a), extents[a]) if r is not None]
+        self._extents = extents
+        if self._tiles is not None:
+            # only whole tiles can be restored
+            width, height = self._size()
+            t = self.tile_size
+            regions = [(x0 // t * t, y0 // t * t, min(width, -(-x1 // t) * t), min(height, -(-y1 // t) * t))
+                       for x0, y0, x1, y1 in regions]
+
+        merged = []
+        while regions:
+            x0, y0, x1, y1 = regions.pop()
+            overlapping = True
+            while overlapping:
+                overlapping = False
+                for i, (a0, b0, a1, b1) in enumerate(merged):
+                    if a0 < x1 and x0 < a1 and b0 < y1 and y0 < b1:
+                        x0, y0, x1, y1 = min(x0, a0), min(y0, b0), max(x1, a1), max(y1, b1)
+                        del merged[i]
+                        overlapping = True
+                        break
+            merged.append((x0, y0, x1, y1))
+        return merged
+
+    def _restores_partially(self) -> bool:
+        """Agg backgrounds can be restored partially, others (cairo) only as a whole"""
+        return hasattr(self._bg, "get_extents")
+
+    def _restore(self, x0, y0, x1, y1):
+        """Restore the background of a pixel rectangle"""
+        if self._tiles is not None:
+            # the rectangle is aligned to the tiles
+            t = self.tile_size
+            for i in range(x0 // t, -(-x1 // t)):
+                for j in range(y0 // t, -(-y1 // t)):
+                    self.canvas.restore_region(self._tiles[i, j])
+            return
+        # the rectangle includes its end, xy is the position of the whole background
+        self.canvas.restore_region(self._bg, bbox=(x0, y0, x1 - 1, y1 - 1), xy=(0, 0))
+
+    def update(self, flush_events=True):
         """Update the screen with animated artists."""
         cv = self.canvas
         fig = cv.figure
         # paranoia in case we missed the draw event,
         if self._bg is None:
             self.on_draw(None)
+            width, height = self._size()
+            self.frame_pixels = width * height
         else:
+            regions = self._dirty_regions()
             # restore the background
-            cv.restore_region(self._bg)
-            # draw all the animated artists
+            for region in regions:
+                self._restore(*region)
+            # draw all the animated artists, they are within the regions
             self._draw_animated()
             # update the GUI state
-            cv.blit(fig.bbox)
+            height = self._size()[1]
+            for x0, y0, x1, y1 in regions:
+                cv.blit(Bbox.from_extents(x0, height - y1, x1, height - y0))
+            self.frame_pixels = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+        self.total_pixels += self.frame_pixels
+        self.frames += 1
         # let the GUI event loop process anything it has to do
-        cv.flush_events()
+        if flush_events:
+            cv.flush_events()
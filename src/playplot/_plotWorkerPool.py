@@ -0,0 +1,130 @@
+import threading
+from collections import deque
+from multiprocessing import Process, Pipe
+from multiprocessing.connection import Connection
+from typing import Deque, Tuple, Optional
+
+from ._plotProcess import plot_worker_entrypoint, plot_host_entrypoint
+from ._util import SharedObject
+
+
+class PlotWorkerPool:
+    """
+    Pre-started plot processes with matplotlib and the gui backend already imported.
+    A plot payload is handed to an idle worker, the pool is refilled in the background.
+    """
+    def __init__(self, so: SharedObject, size: int):
+        self.so = so
+        self.size = size
+        self.idle: Deque[Tuple[Process, Connection]] = deque()
+        self.lock = threading.Lock()
+        self.refilling = False
+        self.closed = False
+        self.refill()
+
+    def refill(self) -> None:
+        """Start workers in a background thread until the pool is full"""
+        with self.lock:
+            if self.refilling or self.closed:
+                return
+            self.refilling = True
+
+        t = threading.Thread(target=self._refill)
+        t.daemon = True
+        t.start()
+
+    def _refill(self):
+        while True:
+            with self.lock:
+                if self.closed or len(self.idle) >= self.size:
+                    self.refilling = False
+                    return
+
+            receiver, sender = Pipe(duplex=False)
+            p = Process(target=plot_worker_entrypoint, args=(self.so, receiver))
+            p.daemon = True
+            p.start()
+            receiver.close()
+
+            with self.lock:
+                if self.closed:
+                    # the worker exits as soon as it notices the closed pipe
+                    sender.close()
+                    self.refilling = False
+                    return
+                self.idle.append((p, sender))
+
+    def submit(self, payload: bytes) -> bool:
+        """
+        Hand a pickled plot payload to an idle worker.
+        Returns False if no worker was available, the caller has to start a plot process itself.
+        """
+        try:
+            while True:
+                with self.lock:
+                    if not self.idle:
+                        return False
+                    p, sender = self.idle.popleft()
+
+                try:
+                    if p.is_alive():
+                        sender.send_bytes(payload)
+                        return True
+                except OSError:
+                    pass
+                finally:
+                    sender.close()
+        finally:
+            self.refill()
+
+    def close(self) -> None:
+        """Idle workers exit, workers already plotting are not affected"""
+        with self.lock:
+            self.closed = True
+            while self.idle:
+                _, sender = self.idle.popleft()
+                sender.close()
+
+
+class PlotHost:
+    """
+    One plot process hosting all plots of a session, with a shared event loop and frame scheduler.
+    Started right away, so it is warmed up when the first plot arrives, restarted if it died.
+    """
+    def __init__(self, so: SharedObject):
+        self.so = so
+        self.lock = threading.Lock()
+        self.process: Optional[Process] = None
+        self.sender: Optional[Connection] = None
+        self.closed = False
+        with self.lock:
+            self._start()
+
+    def _start(self):
+        receiver, self.sender = Pipe(duplex=False)
+        self.process = Process(target=plot_host_entrypoint, args=(self.so, receiver))
+        self.process.daemon = True
+        self.process.start()
+        receiver.close()
+
+    def submit(self, payload: bytes) -> bool:
+        """Hand a pickled plot payload to the host process"""
+        with self.lock:
+            if self.closed:
+                return False
+            for _ in range(2):
+                if not self.process.is_alive():
+                    self.sender.close()
+                    self._start()
+                try:
+                    self.sender.send_bytes(payload)
+                    return True
+                except OSError:
+                    pass
+            return False
+
+    def close(self) -> None:
+        """The host exits after its last plot was closed"""
+        with self.lock:
+            self.closed = True
+            self.sender.close()
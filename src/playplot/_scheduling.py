@@ -0,0 +1,116 @@
+import os
+import sys
+from collections import namedtuple
+from typing import Optional, Union, Iterable
+
+# settings in effect for a process: policy name, real-time priority, nice level and cpus (None if unsupported)
+Scheduling = namedtuple("Scheduling", ("policy", "priority", "nice", "cpus"))
+
+# policy number -> name, only available on linux
+_POLICY_NAMES = {getattr(os, "SCHED_" + name.upper()): name for name in ("other", "batch", "idle", "fifo", "rr")
+                 if hasattr(os, "SCHED_" + name.upper())}
+REALTIME_POLICIES = {name: number for number, name in _POLICY_NAMES.items() if name in ("fifo", "rr")}
+# priority of real-time policies (1-99), above most user threads but below the kernel's interrupt threads
+REALTIME_PRIORITY = 10
+# nice level used if a real-time policy is not permitted
+REALTIME_FALLBACK_NICE = -10
+# settings of the process before apply_scheduling was called the first time
+_initial: Optional[Scheduling] = None
+
+
+def _set_nice(nice: int) -> None:
+    """Set the nice level of the calling thread, or the one closest to it that is permitted"""
+    current = os.getpriority(os.PRIO_PROCESS, 0)
+    step = 1 if nice < current else -1
+    for level in range(nice, current, step):
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, level)
+            return
+        except PermissionError:
+            continue
+
+
+def _set_realtime(policy: int) -> bool:
+    """Switch the calling thread to a real-time policy, False if not permitted"""
+    priorities = [REALTIME_PRIORITY]
+    # unprivileged users can be allowed a limited real-time priority
+    if hasattr(os, "RLIMIT_RTPRIO"):
+        import resource
+        limit = resource.getrlimit(resource.RLIMIT_RTPRIO)[0]
+        if 0 < limit < REALTIME_PRIORITY:
+            priorities.append(limit)
+    for priority in priorities:
+        try:
+            os.sched_setscheduler(0, policy, os.sched_param(priority))
+            return True
+        except PermissionError:
+            continue
+    return False
+
+
+def current_scheduling() -> Scheduling:
+    policy = priority = nice = cpus = None
+    if hasattr(os, "sched_getscheduler"):
+        number = os.sched_getscheduler(0)
+        policy = _POLICY_NAMES.get(number, str(number))
+        priority = os.sched_getparam(0).sched_priority
+    if hasattr(os, "getpriority"):
+        nice = os.getpriority(os.PRIO_PROCESS, 0)
+    if hasattr(os, "sched_getaffinity"):
+        cpus = tuple(sorted(os.sched_getaffinity(0)))
+    return Scheduling(policy, priority, nice, cpus)
+
+
+def apply_scheduling(priority: Optional[Union[int, str]], cpus: Optional[Iterable[int]]) -> Scheduling:
+    """
+    Apply a priority and cpu affinity to the calling thread, threads started afterwards inherit them.
+    priority is a nice level or a real-time policy ("fifo", "rr"), which falls back to REALTIME_FALLBACK_NICE.
+    Settings which are not permitted are reduced to what is permitted or skipped, unsupported ones are skipped.
+    Returns the settings in effect afterwards.
+    """
+    global _initial
+    if _initial is None:
+        _initial = current_scheduling()
+    try:
+        if isinstance(priority, str):
+            policy = REALTIME_POLICIES.get(priority)
+            if policy is None or not _set_realtime(policy):
+                priority = REALTIME_FALLBACK_NICE
+        if isinstance(priority, int) and hasattr(os, "setpriority"):
+            _set_nice(priority)
+    except OSError:
+        pass
+
+    if cpus is not None and hasattr(os, "sched_setaffinity"):
+        cpus = set(cpus) & os.sched_getaffinity(0)
+        if cpus:
+            try:
+                os.sched_setaffinity(0, cpus)
+            except OSError:
+                pass
+
+    return current_scheduling()
+
+
+def reset_thread_scheduling() -> None:
+    """
+    Return the calling thread to the settings the process had before apply_scheduling (linux only, elsewhere the
+    settings apply to the whole process), for background work like decoding whole files, which inherits them
+    from the thread that started it but must not compete with playback.
+    """
+    if _initial is None or not sys.platform.startswith("linux"):
+        return
+    try:
+        if _POLICY_NAMES.get(os.sched_getscheduler(0)) in REALTIME_POLICIES and \
+                _initial.policy not in REALTIME_POLICIES:
+            os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+        if _initial.nice is not None:
+            os.setpriority(os.PRIO_PROCESS, 0, _initial.nice)
+    except OSError:
+        # a higher priority than the current one is not permitted
+        pass
+    if _initial.cpus is not None:
+        try:
+            os.sched_setaffinity(0, _initial.cpus)
+        except OSError:
+            pass
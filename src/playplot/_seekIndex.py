@@ -0,0 +1,187 @@
+import io
+import mmap
+import os
+import struct
+from typing import Optional, Tuple, BinaryIO
+
+import numpy as np
+import soundfile
+
+# kbit/s per bitrate index, for mpeg 1 and mpeg 2/2.5 layer III
+_BITRATES = {3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+             2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)}
+_BITRATES[0] = _BITRATES[2]
+# sample rate per sample rate index, for mpeg 1, 2 and 2.5
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+# delay of the mpg123 decoder, trimmed in addition to the encoder delay of gapless files
+_DECODER_DELAY = 529
+
+
+class StreamingSoundFile(soundfile.SoundFile):
+    """
+    SoundFile which does not seek to its current position after every read (soundfile does so for seekable files),
+    explicit seeks still work. The mp3 decoder resets on every seek and outputs a few frames of silence.
+    """
+    def seekable(self):
+        return False
+
+
+class _FileView(io.RawIOBase):
+    """Read only file like object of an opened file from a byte offset on (the file stays open)"""
+    def __init__(self, file: BinaryIO, offset: int):
+        super().__init__()
+        self.file = file
+        self.offset = offset
+        self.length = os.fstat(self.file.fileno()).st_size - offset
+        self.file.seek(offset)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buf):
+        return self.file.readinto(buf)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.tell()
+        elif whence == 2:
+            offset += self.length
+        return self.file.seek(self.offset + offset) - self.offset
+
+    def tell(self):
+        return self.file.tell() - self.offset
+
+
+class Mp3SeekIndex:
+    """
+    Byte offsets of the audio frames of an mp3 file, decoding can start at any indexed frame,
+    so a seek does not have to scan the file up to the position.
+    """
+    # bytes of previous frames a frame can refer to (bit reservoir)
+    max_reservoir = 511
+    # header, crc and side info bytes of a frame (upper bound)
+    frame_overhead = 38
+
+    def __init__(self, offsets: np.ndarray, samples_per_frame: int, front_trim: int):
+        self.offsets = offsets
+        self.samples_per_frame = samples_per_frame
+        # samples at the start the decoder of the whole file drops (gapless playback)
+        self.front_trim = front_trim
+
+    def save(self, f) -> None:
+        np.savez(f, offsets=self.offsets, samples_per_frame=self.samples_per_frame, front_trim=self.front_trim)
+
+    @classmethod
+    def load(cls, f) -> 'Mp3SeekIndex':
+        with np.load(f) as data:
+            return cls(data["offsets"], int(data["samples_per_frame"]), int(data["front_trim"]))
+
+    def decoder(self, file: BinaryIO, frame: int) -> Tuple[soundfile.SoundFile, int]:
+        """
+        Decoder of the opened mp3 file positioned at frame (sample position), started a few mp3 frames earlier
+        to fill the bit reservoir. Returns the decoder and the sample position its own position 0 corresponds to.
+        Only one decoder of a file object can be used at a time.
+        """
+        spf = self.samples_per_frame
+        target = min(max(0, (frame + self.front_trim) // spf), len(self.offsets) - 1)
+        first = target
+        reservoir = 0
+        while first > 0 and reservoir < self.max_reservoir:
+            first -= 1
+            reservoir += int(self.offsets[first + 1] - self.offsets[first]) - self.frame_overhead
+        # the output of a frame overlaps the one of the previous frame
+        first = max(0, first - 2)
+
+        origin = first * spf - self.front_trim
+        decoder = StreamingSoundFile(_FileView(file, int(self.offsets[first])))
+        try:
+            decoder.read(frame - origin, dtype='float32')
+        except Exception:
+            decoder.close()
+            raise
+        return decoder, origin
+
+
+def _frame_header(data, position) -> Optional[Tuple[int, int, int, int]]:
+    """Length, samples per frame, side info length and version of a layer III frame header at position"""
+    if position + 4 > len(data):
+        return None
+    header = struct.unpack(">I", data[position:position + 4])[0]
+    version, layer = (header >> 19) & 3, (header >> 17) & 3
+    bitrate_index, sample_rate_index = (header >> 12) & 15, (header >> 10) & 3
+    if header >> 21 != 0x7FF or version == 1 or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    mono = (header >> 6) & 3 == 3
+    bitrate = _BITRATES[version][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = (header >> 9) & 1
+    if version == 3:
+        return 144 * bitrate // sample_rate + padding, 1152, 17 if mono else 32, version
+    return 72 * bitrate // sample_rate + padding, 576, 9 if mono else 17, version
+
+
+def _front_trim(data, position, side_info) -> Optional[int]:
+    """Samples the decoder drops at the start if the frame at position is a Xing/Info frame, None otherwise"""
+    tag = position + 4 + side_info
+    if data[tag:tag + 4] not in (b"Xing", b"Info"):
+        return None
+    flags = struct.unpack(">I", data[tag + 4:tag + 8])[0]
+    # frame count, byte count, table of contents and quality precede the lame tag
+    lame = tag + 8 + 4 * bool(flags & 1) + 4 * bool(flags & 2) + 100 * bool(flags & 4) + 4 * bool(flags & 8)
+    if data[lame:lame + 4] != b"LAME":
+        return 0
+    return ((data[lame + 21] << 4) | (data[lame + 22] >> 4)) + _DECODER_DELAY
+
+
+def build_seek_index(path: str) -> Optional[Mp3SeekIndex]:
+    """
+    Scan the frame headers of an mp3 file. Decoding from an indexed frame is compared with decoding the file
+    from the start, None if they do not match (or the file is not a plain mp3 file).
+    """
+    if os.path.getsize(path) == 0:
+        return None
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        position = 0
+        while data[position:position + 3] == b"ID3":
+            size = data[position + 6:position + 10]
+            position += 10 + ((size[0] << 21) | (size[1] << 14) | (size[2] << 7) | size[3])
+
+        first = _frame_header(data, position)
+        if first is None:
+            return None
+        samples_per_frame = first[1]
+        front_trim = _front_trim(data, position, first[2])
+        if front_trim is not None:
+            # the info frame does not contain audio
+            position += first[0]
+        else:
+            front_trim = 0
+
+        offsets = []
+        while True:
+            header = _frame_header(data, position)
+            if header is None or header[1] != samples_per_frame:
+                # end of the file or trailing tags
+                break
+            offsets.append(position)
+            position += header[0]
+
+    index = Mp3SeekIndex(np.array(offsets, dtype=np.int64), samples_per_frame, front_trim)
+    check_frame = 100
+    if len(offsets) < 2 * check_frame:
+        # short files can be scanned quickly by the decoder itself
+        return None
+
+    start = check_frame * samples_per_frame - front_trim
+    with StreamingSoundFile(path) as f:
+        expected = f.read(start + 2 * samples_per_frame, dtype='float32', always_2d=True)[start:]
+    with open(path, "rb") as f:
+        decoder, _ = index.decoder(f, start)
+        with decoder:
+            decoded = decoder.read(expected.shape[0], dtype='float32', always_2d=True)
+    if not np.allclose(decoded, expected, atol=1e-6):
+        return None
+    return index
@@ -1,69 +1,721 @@
-import urllib.request
-from multiprocessing import Value, Lock, Queue
+import atexit
+import hashlib
+import http.client
+import io
+import queue
+import struct
+import threading
+import time
+import urllib.error
+import urllib.parse
+import weakref
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from multiprocessing import Lock, Queue, Condition, shared_memory
+from time import sleep
+from typing import Optional, Dict, List, Tuple
+
+import dill
+import numpy as np
+
+# shared memory segments created by this process, unlinked at exit if not unlinked earlier
+_owned_shared_memory = dict()
+
+
+def create_shared_memory(size: int) -> shared_memory.SharedMemory:
+    """Create a shared memory segment owned by this process (unlinked at the latest when this process exits)"""
+    shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+    _owned_shared_memory[shm.name] = shm
+    return shm
+
+
+def unlink_shared_memory(shm: shared_memory.SharedMemory) -> None:
+    """Unlink a shared memory segment, processes already attached to it keep their mapping"""
+    _owned_shared_memory.pop(shm.name, None)
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+@atexit.register
+def _unlink_owned_shared_memory():
+    for shm in list(_owned_shared_memory.values()):
+        unlink_shared_memory(shm)
+
+
+class SharedArray:
+    """Numpy array inside a shared memory segment, unpickling attaches to the segment instead of copying the data"""
+    def __init__(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        self.shm = create_shared_memory(int(np.prod(shape)) * dtype.itemsize)
+        self.array: Optional[np.ndarray] = np.ndarray(shape, dtype, buffer=self.shm.buf)
+
+    def __getstate__(self):
+        return self.shm, self.array.shape, self.array.dtype
+
+    def __setstate__(self, state):
+        self.shm, shape, dtype = state
+        self.array = np.ndarray(shape, dtype, buffer=self.shm.buf)
+        # the segment can not be closed while views on it exist, keep it open as long as this process needs it
+        _attached_shared_arrays.append(self)
+
+    def unlink(self) -> None:
+        unlink_shared_memory(self.shm)
+
+    def close(self) -> None:
+        """Drop the mapping of this process, views on the array keep it alive"""
+        self.array = None
+        if self in _attached_shared_arrays:
+            _attached_shared_arrays.remove(self)
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+
+
+# shared arrays this process attached to
+_attached_shared_arrays: List[SharedArray] = list()
+
+
+class SharedArrayRegistry:
+    """
+    Content addressed store of large arrays passed to plot processes.
+    Each distinct array is copied into shared memory once, plot processes rebuild it as a read-only view.
+    An array that was shared before is not hashed again, so it must not be modified in place afterwards.
+    """
+    def __init__(self, min_bytes: Optional[int]):
+        self.min_bytes = min_bytes
+        self.arrays: Dict[str, SharedArray] = dict()
+        # id of a source array -> (weak reference to it, its shared copy), the reference detects reused ids
+        self.sources: Dict[int, Tuple[weakref.ref, SharedArray]] = dict()
+        # plot processes may be started from multiple threads
+        self.lock = threading.Lock()
+
+    def share(self, array) -> Optional[SharedArray]:
+        """Get the shared copy of `array` or None if it should be pickled as usual"""
+        if self.min_bytes is None or type(array) is not np.ndarray or array.nbytes < self.min_bytes or \
+                array.dtype.hasobject:
+            return None
+
+        with self.lock:
+            source = self.sources.get(id(array))
+            if source is not None and source[0]() is array:
+                return source[1]
+
+        contiguous = np.ascontiguousarray(array)
+        digest = hashlib.sha256(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(contiguous.reshape(-1).view(np.uint8))
+        key = digest.hexdigest()
+
+        with self.lock:
+            shared = self.arrays.get(key)
+            if shared is None:
+                shared = SharedArray(array.shape, array.dtype)
+                shared.array[...] = contiguous
+                self.arrays[key] = shared
+            self.sources[id(array)] = (weakref.ref(array, self._source_collector(id(array))), shared)
+        return shared
+
+    def _source_collector(self, source_id: int):
+        sources = self.sources
+
+        def collect(ref):
+            # the id may already belong to a newer array
+            if sources.get(source_id, (None,))[0] is ref:
+                del sources[source_id]
+        return collect
+
+    def close(self) -> None:
+        """Unlink all arrays, plot processes already attached to them are not affected"""
+        with self.lock:
+            for shared in self.arrays.values():
+                shared.unlink()
+                shared.close()
+            self.arrays.clear()
+            self.sources.clear()
+
+
+class _PlotPayloadPickler(dill.Pickler):
+    def __init__(self, file, shared_arrays: SharedArrayRegistry, **kwargs):
+        super().__init__(file, **kwargs)
+        self.shared_arrays = shared_arrays
+        self.shared_memo = dict()
+
+    def persistent_id(self, obj):
+        if type(obj) is not np.ndarray:
+            return None
+        if id(obj) not in self.shared_memo:
+            self.shared_memo[id(obj)] = (obj, self.shared_arrays.share(obj))
+        return self.shared_memo[id(obj)][1]
+
+
+class _PlotPayloadUnpickler(dill.Unpickler):
+    def __init__(self, file, **kwargs):
+        super().__init__(file, **kwargs)
+        self.shared_memo = dict()
+
+    def persistent_load(self, pid: SharedArray):
+        name = pid.shm.name
+        if name not in self.shared_memo:
+            view = pid.array.view()
+            view.flags.writeable = False
+            self.shared_memo[name] = (pid, view)
+        elif self.shared_memo[name][0] is not pid:
+            # attached twice, only one mapping is needed
+            pid.close()
+        return self.shared_memo[name][1]
+
+
+def dumps_plot_payload(obj, shared_arrays: SharedArrayRegistry) -> bytes:
+    """
+    Pickle with dill to increase compatibility (works in ipy on Windows),
+    large arrays (also captured globals) are moved to `shared_arrays` and only referenced by name
+    """
+    file = io.BytesIO()
+    _PlotPayloadPickler(file, shared_arrays, protocol=-1, byref=False, recurse=True, fmode=dill.HANDLE_FMODE).dump(obj)
+    return file.getvalue()
+
+
+def loads_plot_payload(data: bytes):
+    """Counterpart to dumps_plot_payload, shared arrays are rebuilt as read-only views"""
+    return _PlotPayloadUnpickler(io.BytesIO(data)).load()
+
+
+def _field_layout(offset, fields):
+    """Offsets and Structs of packed fields"""
+    layout = dict()
+    for name, fmt in fields:
+        layout[name] = (offset, struct.Struct("=" + fmt))
+        offset += layout[name][1].size
+    return layout
+
+
+class SharedState:
+    """
+    Seqlock protected record in shared memory.
+    Writers are serialized via `lock` and increment the sequence number before and after writing,
+    readers never lock and retry until they saw the same even sequence number before and after reading.
+    Writing one of the NOTIFY_FIELDS wakes all processes waiting on `changed`.
+    """
+    # (name, struct format character), 8 byte fields first to keep them aligned
+    FIELDS = (
+        ("time", "d"),
+        ("volume", "d"),
+        ("fps_target", "d"),
+        ("plot_min_sleep", "d"),
+        # size of the audio device buffer in seconds
+        ("audio_latency", "d"),
+        # playback clock: clock_position (seconds) is audible at clock_timestamp (time.monotonic) and advances with
+        # clock_rate, valid as long as clock_seek_count equals seek_count
+        ("clock_position", "d"),
+        ("clock_timestamp", "d"),
+        ("clock_rate", "d"),
+        ("clock_seek_count", "q"),
+        ("open_plots", "q"),
+        # incremented with every time skip (seek), the new position is stored in time
+        ("seek_count", "q"),
+        ("save_as_frame_number", "q"),
+        ("plots_wrote_current_frame", "q"),
+        ("total_error_count", "q"),
+        ("error_queue_size", "q"),
+        # frames requested and generated by manual steps of the audio output (cumulative)
+        ("step_frames_requested", "q"),
+        ("step_frames_done", "q"),
+        # late or too slow audio device callbacks
+        ("underrun_count", "q"),
+        ("paused", "?"),
+        ("looping", "?"),
+        ("stop", "?"),
+    )
+    Snapshot = namedtuple("Snapshot", [name for name, _ in FIELDS])
+    NOTIFY_FIELDS = frozenset(("open_plots", "plots_wrote_current_frame", "stop", "step_frames_done"))
+
+    # the sequence number is stored in front of the fields
+    _seq = struct.Struct("=Q")
+    _record = struct.Struct("=Q" + "".join(fmt for _, fmt in FIELDS))
+    # name -> (offset, Struct)
+    _fields = _field_layout(_seq.size, FIELDS)
+
+    def __init__(self, lock, **values):
+        self.lock = lock
+        # wait on it (with the lock acquired) to block until one of the NOTIFY_FIELDS changed
+        self.changed = Condition(lock)
+        self.shm = create_shared_memory(self._record.size)
+        self._record.pack_into(self.shm.buf, 0, 0, *(values.get(name, 0) for name in self.Snapshot._fields))
+
+    def read(self) -> 'SharedState.Snapshot':
+        """Consistent snapshot of all fields, does not lock"""
+        buf = self.shm.buf
+        while True:
+            seq = self._seq.unpack_from(buf)[0]
+            if seq & 1:
+                sleep(0)
+                continue
+            raw = self._record.unpack_from(buf)
+            if self._seq.unpack_from(buf)[0] == seq:
+                return self.Snapshot(*raw[1:])
+
+    def __getattr__(self, name):
+        """Single field read, does not lock"""
+        try:
+            offset, field = self._fields[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        buf = self.shm.buf
+        while True:
+            seq = self._seq.unpack_from(buf)[0]
+            if seq & 1:
+                sleep(0)
+                continue
+            value = field.unpack_from(buf, offset)[0]
+            if self._seq.unpack_from(buf)[0] == seq:
+                return value
+
+    @contextmanager
+    def transaction(self):
+        """Exclusive read-modify-write access, yields a record with attribute access"""
+        buf = self.shm.buf
+        with self.lock:
+            seq = self._seq.unpack_from(buf)[0]
+            self._seq.pack_into(buf, 0, seq + 1)
+            record = _StateRecord(buf)
+            try:
+                yield record
+            finally:
+                self._seq.pack_into(buf, 0, seq + 2)
+                if record._notify:
+                    self.changed.notify_all()
+
+    def update(self, **values) -> None:
+        """Write one or multiple fields at once"""
+        buf = self.shm.buf
+        with self.lock:
+            seq = self._seq.unpack_from(buf)[0]
+            self._seq.pack_into(buf, 0, seq + 1)
+            try:
+                for name, value in values.items():
+                    offset, field = self._fields[name]
+                    field.pack_into(buf, offset, value)
+            finally:
+                self._seq.pack_into(buf, 0, seq + 2)
+                if not self.NOTIFY_FIELDS.isdisjoint(values):
+                    self.changed.notify_all()
+
+    def wait_for(self, predicate, timeout=None) -> bool:
+        """Block until `predicate(snapshot)` is true (re-checked after changes of NOTIFY_FIELDS), False on timeout"""
+        with self.changed:
+            return self.changed.wait_for(lambda: predicate(self.read()), timeout)
+
+
+class _StateRecord:
+    __slots__ = ("_buf", "_notify")
+
+    def __init__(self, buf):
+        object.__setattr__(self, "_buf", buf)
+        object.__setattr__(self, "_notify", False)
+
+    def __getattr__(self, name):
+        offset, field = SharedState._fields[name]
+        return field.unpack_from(self._buf, offset)[0]
+
+    def __setattr__(self, name, value):
+        offset, field = SharedState._fields[name]
+        field.pack_into(self._buf, offset, value)
+        if name in SharedState.NOTIFY_FIELDS:
+            object.__setattr__(self, "_notify", True)
 
 
 class SharedObject:
     """One instance per session handles all ipc"""
     def __init__(self, show_msg_box_on_error_in_other_process, duration, close_with_last_plot, fps_target,
-                 save_folder, plot_min_sleep, looping):
+                 save_folder, plot_min_sleep, looping, read_cache_size, decode_cache=None,
+                 decoding_backend="soundfile", audio_output="device", buffersize_msec=30, buffersize_bounds=None,
+                 audio_priority=None, audio_cpus=None, plot_nice=None, plot_cpus=None, idle_fps=10,
+                 max_seek_rate=None):
         self.show_msg_box_on_error_in_other_process = show_msg_box_on_error_in_other_process
         self.duration = duration
         self.save_folder = save_folder
+        self.read_cache_size = read_cache_size
+        self.decode_cache = decode_cache
+        self.decoding_backend = decoding_backend
+        self.audio_output = audio_output
+        self.buffersize_msec = buffersize_msec
+        self.buffersize_bounds = buffersize_bounds
+        self.audio_priority = audio_priority
+        self.audio_cpus = audio_cpus
+        self.plot_nice = plot_nice
+        self.plot_cpus = plot_cpus
+        self.idle_fps = idle_fps
+        self.max_seek_rate = max_seek_rate
+        # only writers take the lock, see SharedState
         self.lock = Lock()
         self.close_with_last_plot: bool = close_with_last_plot
-        self.fps_target = Value('d', fps_target, lock=False)
-        self.plot_min_sleep = Value('d', plot_min_sleep, lock=False)
-        self.time = Value('d', 0, lock=False)
-        self.volume = Value('d', 0, lock=False)
-        self.paused = Value('i', True, lock=False)
-        self.looping = Value('i', looping, lock=False)
-        self.stop = Value('i', False, lock=False)
-        self.open_plots: Value = Value('i', -1, lock=False)
-        self.time_skip = Value('i', False, lock=False)
-        self.save_as_frame_number = Value('i', -1, lock=False)
-        self.plots_wrote_current_frame = Value('i', 0, lock=False)
-        self.total_error_count = Value('i', 0, lock=False)
-        self.error_queue_size = Value('i', 0, lock=False)
+        self.state = SharedState(self.lock, fps_target=fps_target, plot_min_sleep=plot_min_sleep, time=0, volume=0,
+                                 paused=True, looping=looping, stop=False, open_plots=-1, seek_count=0,
+                                 save_as_frame_number=-1, plots_wrote_current_frame=0, total_error_count=0,
+                                 error_queue_size=0, clock_seek_count=-1, audio_latency=buffersize_msec / 1000)
         self.error_queue = Queue()
+        # ("audio" | "plot", Scheduling) reported by the processes after applying the scheduling settings
+        self.scheduling_queue = Queue()
+        # (title, frames per second) reported by the plots, see FRAME_RATE_REPORT_INTERVAL and put_latest
+        # bounded, so the reports always fit into the pipe even if they are never read
+        self.frame_rate_queue = Queue(64)
+
+
+def put_latest(q: Queue, item) -> None:
+    """
+    Put an item on a bounded queue that may never be read, the oldest item is dropped if it is full.
+    The process does not wait at exit until its items were sent.
+    """
+    q.cancel_join_thread()
+    try:
+        q.put_nowait(item)
+        return
+    except queue.Full:
+        pass
+    try:
+        # the oldest item may still be on the way into the pipe
+        q.get(timeout=0.1)
+        q.put_nowait(item)
+    except (queue.Empty, queue.Full):
+        pass
+
+
+class _ConnectionPool:
+    """Idle persistent (keep-alive) http connections, per scheme and host"""
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle: Dict[tuple, List[http.client.HTTPConnection]] = dict()
+        self.closed = False
+
+    def acquire(self, scheme, netloc) -> http.client.HTTPConnection:
+        with self.lock:
+            connections = self.idle.get((scheme, netloc))
+            if connections:
+                return connections.pop()
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def release(self, scheme, netloc, connection: http.client.HTTPConnection):
+        with self.lock:
+            if not self.closed:
+                self.idle.setdefault((scheme, netloc), []).append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle.clear()
+
+
+class _AdaptiveConcurrency:
+    """
+    Number of concurrent requests, adapted by hill climbing on the throughput measured over rounds of requests:
+    it keeps moving in one direction while the throughput does not drop, otherwise it turns around.
+    """
+    def __init__(self, initial, maximum):
+        self.value = initial
+        self.maximum = maximum
+        self.direction = 1
+        self.throughput = None
+        self._round_start = None
+        self._round_bytes = 0
+        self._round_requests = 0
+
+    def started(self):
+        if self._round_start is None:
+            self._round_start = time.monotonic()
+
+    def finished(self, size):
+        self._round_bytes += size
+        self._round_requests += 1
+        if self._round_requests < 2 * self.value:
+            return
+
+        throughput = self._round_bytes / max(time.monotonic() - self._round_start, 1e-6)
+        if self.throughput is not None and throughput < 0.95 * self.throughput:
+            self.direction = -self.direction
+        self.throughput = throughput
+        self.value = max(1, min(self.maximum, self.value + self.direction))
+        self.idle()
+
+    def idle(self):
+        """Requests are not limited by the connection, the current round is not measured"""
+        self._round_start = None
+        self._round_bytes = 0
+        self._round_requests = 0
 
 
 class UrlFile:
-    """Provide a file like object from a (http) url, with seek capabilities"""
+    """
+    Provide a file like object from a (http) url, with seek capabilities.
+    The file is fetched in aligned blocks via range requests on persistent connections,
+    the blocks are kept in an LRU cache and the blocks following a read are prefetched by concurrent requests.
+    The read ahead window grows while reading sequentially, the number of concurrent requests adapts to the
+    measured throughput.
+    """
+    block_size = 2 ** 18
+    cache_blocks = 64
+    read_ahead_blocks = 16
+    initial_read_ahead_blocks = 2
+    max_concurrency = 8
+    max_redirects = 5
+
     def __init__(self, url):
+        # same errors as urllib.request.urlopen
+        scheme = urllib.parse.urlsplit(url).scheme
+        if not scheme:
+            raise ValueError(f"unknown url type: {url!r}")
+        if scheme not in ("http", "https"):
+            raise urllib.error.URLError(f"unknown url type: {scheme}")
         self.url = url
-        self.sock = urllib.request.urlopen(url, timeout=2)
-        self.length = self.sock.length
         self.pos = 0
-        self.last_pos = 0
-
-    def read(self, n):
-        if self.pos != self.last_pos:
-            req = urllib.request.Request(self.url)
-            req.add_header('Range', f'bytes={self.pos}-')
-            self.sock.close()
-            self.sock = urllib.request.urlopen(req)
-        self.pos += n
-        self.last_pos = self.pos
-        return self.sock.read(n)
+        self.length = None
+        # number of http requests sent
+        self.request_count = 0
+
+        self._pool = _ConnectionPool(timeout=5)
+        self._lock = threading.Lock()
+        # block index -> bytes, least recently used first
+        self._blocks: OrderedDict[int, bytes] = OrderedDict()
+        # block index -> event set once the fetch of the block finished (successful or not)
+        self._fetching: Dict[int, threading.Event] = dict()
+
+        # prefetch workers wait on it for blocks to fetch
+        self._work = threading.Condition(self._lock)
+        self._workers: List[threading.Thread] = []
+        self.concurrency = _AdaptiveConcurrency(2, self.max_concurrency)
+        self._read_ahead_from = 0
+        self._read_ahead_window = self.initial_read_ahead_blocks
+        self._last_block = 0
+        # set after a failed prefetch, the error is raised once the block is actually read
+        self._prefetch_paused = False
+        self._closed = False
+
+        # fetches the length, raises URLError if the file is not available
+        try:
+            self._block(0)
+        except Exception:
+            self._pool.close()
+            raise
+        self._block_count = -(-self.length // self.block_size)
+
+        with self._work:
+            # probing some formats (ogg, mp3) reads the end of the file, an empty file has no blocks to prefetch
+            self._tail = self._block_count - 1 if self._block_count else None
+            self._start_workers()
+
+    def _request(self, start, stop) -> bytes:
+        """Bytes start to stop of the file via a range request, redirects are followed (and remembered)"""
+        url = self.url
+        for _ in range(self.max_redirects):
+            parts = urllib.parse.urlsplit(url)
+            path = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+            headers = {"Range": f"bytes={start}-{stop - 1}"}
+            connection = self._pool.acquire(parts.scheme, parts.netloc)
+            try:
+                for retry in (True, False):
+                    try:
+                        connection.request("GET", path, headers=headers)
+                        response = connection.getresponse()
+                        break
+                    except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                        # the server closed the idle connection in the meantime
+                        connection.close()
+                        if not retry:
+                            raise
+                with self._lock:
+                    self.request_count += 1
+
+                if response.status in (301, 302, 303, 307, 308):
+                    response.read()
+                    self._return_connection(parts, connection, response)
+                    url = urllib.parse.urljoin(url, response.getheader("Location"))
+                    continue
+                if response.status in (206, 416):
+                    data = response.read() if response.status == 206 else b""
+                    total = response.getheader("Content-Range", "").rpartition("/")[2]
+                    if total.isdigit():
+                        self.length = int(total)
+                elif response.status == 200 and start == 0:
+                    # no range support, only the beginning of the file can be used
+                    data = response.read(stop)
+                    if self.length is None:
+                        self.length = len(data) + (response.length or 0)
+                elif response.status == 200:
+                    raise urllib.error.URLError(f"{url} does not support range requests")
+                else:
+                    raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                if isinstance(e, urllib.error.URLError):
+                    raise
+                raise urllib.error.URLError(e) from e
+
+            self._return_connection(parts, connection, response)
+            if self.length is None:
+                raise urllib.error.URLError(f"{url} did not report the file length")
+            self.url = url
+            return data
+        raise urllib.error.URLError(f"too many redirects for {self.url}")
+
+    def _return_connection(self, parts, connection, response):
+        # a connection can only be reused once the response was read completely
+        if response.will_close or not response.isclosed():
+            connection.close()
+        else:
+            self._pool.release(parts.scheme, parts.netloc, connection)
+
+    def _block(self, index) -> bytes:
+        """Cached block, fetched if necessary (or waiting for a running fetch)"""
+        while True:
+            with self._lock:
+                block = self._blocks.get(index)
+                if block is not None:
+                    self._blocks.move_to_end(index)
+                    return block
+                event = self._fetching.get(index)
+                if event is None:
+                    event = self._claim(index, 1)
+                    break
+            # fetched by a prefetch worker, fetch it here if that failed
+            event.wait()
+
+        blocks = self._fetch(index, 1, event)
+        return blocks[0] if blocks else b""
+
+    def _claim(self, first, count) -> threading.Event:
+        """Mark blocks as being fetched (lock held), the event is set once the fetch finished"""
+        event = threading.Event()
+        for index in range(first, first + count):
+            self._fetching[index] = event
+        return event
+
+    def _fetch(self, first, count, event) -> List[bytes]:
+        """Fetch claimed consecutive blocks with a single request"""
+        try:
+            data = self._request(first * self.block_size, (first + count) * self.block_size)
+            blocks = [data[i:i + self.block_size] for i in range(0, len(data), self.block_size)]
+            with self._lock:
+                for index, block in enumerate(blocks, first):
+                    self._blocks[index] = block
+                while len(self._blocks) > self.cache_blocks:
+                    self._blocks.popitem(last=False)
+            return blocks
+        finally:
+            with self._lock:
+                for index in range(first, first + count):
+                    del self._fetching[index]
+                self._work.notify_all()
+            event.set()
+
+    def _start_workers(self):
+        # lock held
+        while len(self._workers) < self.concurrency.value:
+            worker = threading.Thread(target=self._prefetch, args=(len(self._workers),), daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def _next_prefetch_block(self) -> Optional[int]:
+        # lock held
+        if self._prefetch_paused:
+            return None
+        if self._tail is not None:
+            # only once, the tail block may get evicted later on
+            index, self._tail = self._tail, None
+            if index not in self._blocks and index not in self._fetching:
+                return index
+        for index in range(self._read_ahead_from,
+                           min(self._read_ahead_from + self._read_ahead_window, self._block_count)):
+            if index not in self._blocks and index not in self._fetching:
+                return index
+        if not self._fetching:
+            # the reader is the bottleneck, no throughput to measure
+            self.concurrency.idle()
+        return None
+
+    def _prefetch(self, number):
+        while True:
+            with self._work:
+                while True:
+                    if self._closed:
+                        return
+                    index = self._next_prefetch_block() if number < self.concurrency.value else None
+                    if index is not None:
+                        event = self._claim(index, 1)
+                        self.concurrency.started()
+                        break
+                    self._work.wait()
+
+            # noinspection PyBroadException
+            try:
+                blocks = self._fetch(index, 1, event)
+            except Exception:
+                with self._work:
+                    self._prefetch_paused = True
+                continue
+
+            with self._work:
+                self.concurrency.finished(sum(len(block) for block in blocks))
+                self._start_workers()
+
+    def readinto(self, buf):
+        view = memoryview(buf).cast("B")
+        n = max(0, min(len(view), self.length - self.pos))
+        written = 0
+        first = index = self.pos // self.block_size
+        while written < n:
+            index, offset = divmod(self.pos + written, self.block_size)
+            block = self._block(index)
+            count = min(n - written, len(block) - offset)
+            if count <= 0:
+                break
+            view[written:written + count] = block[offset:offset + count]
+            written += count
+        self.pos += written
+
+        with self._work:
+            # the read ahead window grows while reading sequentially, a jump resets it
+            if first not in (self._last_block, self._last_block + 1):
+                self._read_ahead_window = self.initial_read_ahead_blocks
+            elif index > self._last_block:
+                self._read_ahead_window = min(2 * self._read_ahead_window, self.read_ahead_blocks)
+            self._last_block = index
+            self._read_ahead_from = index + 1
+            self._prefetch_paused = False
+            self._work.notify_all()
+        return written
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = max(0, self.length - self.pos)
+        buf = bytearray(n)
+        return bytes(buf[:self.readinto(buf)])
 
     def seek(self, offset, whence=0):
         if whence == 1:
             self.pos += offset
         elif whence == 2:
-            self.pos = self.length - offset
+            self.pos = self.length + offset
         else:
             self.pos = offset
-
-    def readinto(self, buf):
-        data = self.read(len(buf))
-        buf[:len(data)] = data
-        return len(data)
+        return self.pos
 
     def tell(self):
         return self.pos
 
     def close(self):
-        self.sock.close()
+        with self._work:
+            self._closed = True
+            self._work.notify_all()
+        self._pool.close()
 
 
 def show_error_box(text: str):
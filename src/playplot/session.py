@@ -4,22 +4,27 @@ import threading
 import traceback
 from functools import wraps
 from multiprocessing import Process
-from time import sleep, monotonic
-from typing import Optional, Union, List
+from typing import Optional, Union, List, Tuple, Iterable, Dict
 
 import numpy as np
 import soundfile as sf
 
-from dill import dumps, HANDLE_FMODE
-from ._audioProcess import audio_process_entrypoint
+from ._audioProcess import audio_process_entrypoint, DECODING_BACKENDS, AUDIO_OUTPUTS
+from ._decodeCache import DecodeCache
 from ._plotProcess import plot_process_entrypoint
-from ._util import SharedObject, UrlFile, runs_in_notebook, AudioProcessException, \
-    PlotProcessException
+from ._plotWorkerPool import PlotWorkerPool, PlotHost
+from ._scheduling import Scheduling
+from ._util import SharedObject, SharedArray, SharedArrayRegistry, UrlFile, runs_in_notebook, \
+    AudioProcessException, PlotProcessException, dumps_plot_payload
 
 
-def _plot_process_start_helper(func, so, stack, args, kwargs):
-    # pickle with dill to increase compatibility (now works in ipy on Windows)
-    dill = dumps((func, stack, args, kwargs), byref=False, recurse=True, protocol=-1, fmode=HANDLE_FMODE)
+def _plot_process_start_helper(func, so, stack, args, kwargs, shared_arrays, plot_workers):
+    # pickle with dill to increase compatibility (now works in ipy on Windows), large arrays go to shared memory
+    dill = dumps_plot_payload((func, stack, args, kwargs), shared_arrays)
+
+    # prefer a pre-started worker or the plot host process
+    if plot_workers is not None and plot_workers.submit(dill):
+        return
 
     p = Process(target=plot_process_entrypoint, args=(so, dill))
     p.daemon = True
@@ -34,11 +39,27 @@ class Session:
                   close_with_last_plot: bool = True,
                   fps_target: float = 60,
                   plot_min_sleep: float = 0.001,
+                  idle_fps: float = 10,
+                  max_seek_rate: Optional[float] = None,
                   time: float = 0,
                   volume: float = 0.8,
                   looping: bool = False,
                   save_folder: str = ".",
-                  show_msg_box_on_error_in_other_process: Optional[bool] = None) -> 'Session':
+                  show_msg_box_on_error_in_other_process: Optional[bool] = None,
+                  shared_memory_threshold: Optional[int] = 2 ** 20,
+                  plot_worker_pool_size: int = 0,
+                  single_plot_process: bool = False,
+                  read_cache_size: int = 2 ** 27,
+                  decode_cache_folder: Optional[str] = None,
+                  decode_cache_size: int = 2 ** 32,
+                  decoding_backend: str = "soundfile",
+                  audio_output: str = "device",
+                  buffersize_msec: int = 30,
+                  buffersize_bounds: Optional[Tuple[int, int]] = None,
+                  audio_priority: Optional[Union[int, str]] = None,
+                  audio_cpus: Optional[Iterable[int]] = None,
+                  plot_nice: Optional[int] = None,
+                  plot_cpus: Optional[Iterable[int]] = None) -> 'Session':
         """
         Construct a Session from an audio file.
         For more see the constructor of this class
@@ -50,9 +71,16 @@ class Session:
         close_with_last_plot
             After last plot was closed no new plots can be created and audio playback will stop
         fps_target
-            target frames per seconds for plots
+            target frames per seconds for plots, lowered automatically while rendering takes too long
+            *see:* :attr:`~Session.frame_rates`
         plot_min_sleep
             minimal time the plotting processes will yield for (default should suffice)
+        idle_fps
+            frames per second of plots while paused and nothing changes
+            (changes of :attr:`~Session.time`, saving images and user input in the plots still show up immediately)
+        max_seek_rate
+            seeks per second a plot publishes while the mouse is dragged over it, at most one per frame
+            (None: one per frame), only the latest position is used
         time
             start time *see:* :attr:`~Session.time`
         volume
@@ -65,6 +93,51 @@ class Session:
             show a message box if an error occurs, useful if no explicit error handling is performed.
             on by default if running in an interactive context.
             (in jupyter notebooks the stderr is not shown)
+        shared_memory_threshold
+            numpy arrays of at least this many bytes passed to plot functions (also captured globals)
+            are placed in shared memory once and shared read-only by all plot processes (None disables this),
+            they are kept until the session stops. An array that was shared before is not copied again,
+            so changes made to it in place afterwards are not seen by later plots.
+        plot_worker_pool_size
+            number of pre-started plot processes with matplotlib and the gui backend already imported,
+            new plots open faster, the pool gets refilled in the background (0 disables the pool)
+        single_plot_process
+            host all plots in one plot process with a shared event loop (less memory and cpu usage for many plots),
+            by default every plot gets its own process (overrides plot_worker_pool_size)
+        read_cache_size
+            memory budget in bytes for decoded blocks of the audio file, previously played regions stay cached
+            so jumping back to them plays instantly (only used for files and urls, uncompressed wav files are
+            memory mapped instead)
+        decode_cache_folder
+            folder for decoded audio of compressed files (e.g. flac, ogg, mp3), on the first start a file gets
+            decoded in the background, later sessions memory map the decoded audio and start instantly
+            (None disables the cache)
+        decode_cache_size
+            size limit in bytes of the decoded audio in decode_cache_folder,
+            the least recently used files are removed
+        decoding_backend
+            decoder for compressed files, both decode blocks ahead in a reader thread: "soundfile" (supports urls),
+            "miniaudio" uses the native decoders of miniaudio for flac and ogg vorbis files
+            (mp3 files are seeked faster by soundfile, other files fall back to soundfile as well)
+        audio_output
+            "device" plays on the sound card, "null" generates the audio in real time without playing it
+            (for machines without a sound card), "manual" generates audio only when :meth:`step` is called
+        buffersize_msec
+            size of the audio device buffer, larger buffers prevent underruns (audible dropouts) on busy machines,
+            smaller ones keep the plot cursors closer in sync *see:* :attr:`~Session.audio_latency`
+        buffersize_bounds
+            (min, max) buffer size in msec, the buffer is doubled after underruns and halved again after
+            a while without underruns (None keeps buffersize_msec)
+        audio_priority
+            priority of the audio process (linux and macOS): a nice level (negative is higher)
+            or a real-time policy "fifo" or "rr" (linux), which falls back to nice level -10 if not permitted.
+            Levels which are not permitted are reduced to the highest permitted one *see:* :attr:`~Session.scheduling`
+        audio_cpus
+            cpus the audio process may run on (linux)
+        plot_nice
+            nice level of the plot processes, positive values leave more cpu time to the audio process
+        plot_cpus
+            cpus the plot processes may run on (linux)
 
         Raises
         ------
@@ -72,7 +145,8 @@ class Session:
             `file` was a 'url' and the connection failed
 
         ValueError
-            `file` was not a `url` and not a valid file path
+            `file` was not a `url` and not a valid file path, the decoding_backend, audio_output or audio_priority
+            is unknown or the buffersize_bounds, idle_fps or max_seek_rate are invalid
 
         RuntimeError
             the `file` was found but SoundFile was unable to read it
@@ -83,18 +157,41 @@ class Session:
             Session instance
         """
         return cls(file, 0, close_with_last_plot=close_with_last_plot, fps_target=fps_target,
-                   plot_min_sleep=plot_min_sleep, time=time, volume=volume, looping=looping, save_folder=save_folder,
-                   show_msg_box_on_error_in_other_process=show_msg_box_on_error_in_other_process)
+                   plot_min_sleep=plot_min_sleep, idle_fps=idle_fps, max_seek_rate=max_seek_rate, time=time,
+                   volume=volume, looping=looping, save_folder=save_folder,
+                   show_msg_box_on_error_in_other_process=show_msg_box_on_error_in_other_process,
+                   shared_memory_threshold=shared_memory_threshold, plot_worker_pool_size=plot_worker_pool_size,
+                   single_plot_process=single_plot_process, read_cache_size=read_cache_size,
+                   decode_cache_folder=decode_cache_folder, decode_cache_size=decode_cache_size,
+                   decoding_backend=decoding_backend, audio_output=audio_output, buffersize_msec=buffersize_msec,
+                   buffersize_bounds=buffersize_bounds, audio_priority=audio_priority, audio_cpus=audio_cpus,
+                   plot_nice=plot_nice, plot_cpus=plot_cpus)
 
     def __init__(self, x: Union[np.ndarray, str], /, sr: int, *,
                  close_with_last_plot: bool = True,
                  fps_target: float = 60,
                  plot_min_sleep: float = 0.001,
+                 idle_fps: float = 10,
+                 max_seek_rate: Optional[float] = None,
                  time: float = 0,
                  volume: float = 0.8,
                  looping: bool = False,
                  save_folder: str = ".",
-                 show_msg_box_on_error_in_other_process: Optional[bool] = None):
+                 show_msg_box_on_error_in_other_process: Optional[bool] = None,
+                 shared_memory_threshold: Optional[int] = 2 ** 20,
+                 plot_worker_pool_size: int = 0,
+                 single_plot_process: bool = False,
+                 read_cache_size: int = 2 ** 27,
+                 decode_cache_folder: Optional[str] = None,
+                 decode_cache_size: int = 2 ** 32,
+                 decoding_backend: str = "soundfile",
+                 audio_output: str = "device",
+                 buffersize_msec: int = 30,
+                 buffersize_bounds: Optional[Tuple[int, int]] = None,
+                 audio_priority: Optional[Union[int, str]] = None,
+                 audio_cpus: Optional[Iterable[int]] = None,
+                 plot_nice: Optional[int] = None,
+                 plot_cpus: Optional[Iterable[int]] = None):
         """
         A Session allows audio playback linked to multiple interactive matplotlib plots.
         These plots receive a curser and navigation functions,
@@ -117,9 +214,16 @@ class Session:
         close_with_last_plot
             after last plot was closed no new plots can be created and audio playback will stop
         fps_target
-            target frames per seconds for plots
+            target frames per seconds for plots, lowered automatically while rendering takes too long
+            *see:* :attr:`~Session.frame_rates`
         plot_min_sleep
             minimal time the plotting processes will yield for (default should suffice)
+        idle_fps
+            frames per second of plots while paused and nothing changes
+            (changes of :attr:`~Session.time`, saving images and user input in the plots still show up immediately)
+        max_seek_rate
+            seeks per second a plot publishes while the mouse is dragged over it, at most one per frame
+            (None: one per frame), only the latest position is used
         time
             start time *see:* :attr:`~Session.time`
         volume
@@ -132,35 +236,121 @@ class Session:
             show a message box if an error occurs, useful if no explicit error handling is performed.
             on by default if running in an interactive context.
             (in jupyter notebooks the stderr is not shown)
+        shared_memory_threshold
+            numpy arrays of at least this many bytes passed to plot functions (also captured globals)
+            are placed in shared memory once and shared read-only by all plot processes (None disables this),
+            they are kept until the session stops. An array that was shared before is not copied again,
+            so changes made to it in place afterwards are not seen by later plots.
+        plot_worker_pool_size
+            number of pre-started plot processes with matplotlib and the gui backend already imported,
+            new plots open faster, the pool gets refilled in the background (0 disables the pool)
+        single_plot_process
+            host all plots in one plot process with a shared event loop (less memory and cpu usage for many plots),
+            by default every plot gets its own process (overrides plot_worker_pool_size)
+        read_cache_size
+            memory budget in bytes for decoded blocks of the audio file, previously played regions stay cached
+            so jumping back to them plays instantly (only used for files and urls, uncompressed wav files are
+            memory mapped instead)
+        decode_cache_folder
+            folder for decoded audio of compressed files (e.g. flac, ogg, mp3), on the first start a file gets
+            decoded in the background, later sessions memory map the decoded audio and start instantly
+            (None disables the cache)
+        decode_cache_size
+            size limit in bytes of the decoded audio in decode_cache_folder,
+            the least recently used files are removed
+        decoding_backend
+            decoder for compressed files, both decode blocks ahead in a reader thread: "soundfile" (supports urls),
+            "miniaudio" uses the native decoders of miniaudio for flac and ogg vorbis files
+            (mp3 files are seeked faster by soundfile, other files fall back to soundfile as well)
+        audio_output
+            "device" plays on the sound card, "null" generates the audio in real time without playing it
+            (for machines without a sound card), "manual" generates audio only when :meth:`step` is called
+        buffersize_msec
+            size of the audio device buffer, larger buffers prevent underruns (audible dropouts) on busy machines,
+            smaller ones keep the plot cursors closer in sync *see:* :attr:`~Session.audio_latency`
+        buffersize_bounds
+            (min, max) buffer size in msec, the buffer is doubled after underruns and halved again after
+            a while without underruns (None keeps buffersize_msec)
+        audio_priority
+            priority of the audio process (linux and macOS): a nice level (negative is higher)
+            or a real-time policy "fifo" or "rr" (linux), which falls back to nice level -10 if not permitted.
+            Levels which are not permitted are reduced to the highest permitted one *see:* :attr:`~Session.scheduling`
+        audio_cpus
+            cpus the audio process may run on (linux)
+        plot_nice
+            nice level of the plot processes, positive values leave more cpu time to the audio process
+        plot_cpus
+            cpus the plot processes may run on (linux)
         """
         if show_msg_box_on_error_in_other_process is None:
             show_msg_box_on_error_in_other_process = runs_in_notebook()
 
         # get metadata about the audio (file), in case a piece of audio is invalid an error should occur here
+        if decoding_backend not in DECODING_BACKENDS:
+            raise ValueError(f"unknown decoding_backend {decoding_backend!r}, use one of {DECODING_BACKENDS}")
+        if audio_output not in AUDIO_OUTPUTS:
+            raise ValueError(f"unknown audio_output {audio_output!r}, use one of {AUDIO_OUTPUTS}")
+        if buffersize_bounds is not None:
+            if not 0 < buffersize_bounds[0] <= buffersize_bounds[1]:
+                raise ValueError(f"invalid buffersize_bounds {buffersize_bounds}")
+            buffersize_msec = max(buffersize_bounds[0], min(buffersize_bounds[1], buffersize_msec))
+        if not idle_fps > 0:
+            raise ValueError(f"invalid idle_fps {idle_fps}")
+        if max_seek_rate is not None and not max_seek_rate > 0:
+            raise ValueError(f"invalid max_seek_rate {max_seek_rate}")
+        if isinstance(audio_priority, str) and audio_priority not in ("fifo", "rr"):
+            raise ValueError(f"unknown audio_priority {audio_priority!r}, use a nice level, 'fifo' or 'rr'")
+        decode_cache = None if decode_cache_folder is None else DecodeCache(decode_cache_folder, decode_cache_size)
         if isinstance(x, str):
-            if os.path.isfile(x):
-                info = sf.info(x)
+            entry = decode_cache.lookup(x) if decode_cache is not None and os.path.isfile(x) else None
+            if entry is not None:
+                # decoded before, the file itself does not need to be opened
+                sr = entry.samplerate
+                duration = entry.frames / entry.samplerate
             else:
-                source = UrlFile(x)
-                info = sf.info(source)
-                source.close()
+                if os.path.isfile(x):
+                    info = sf.info(x)
+                else:
+                    source = UrlFile(x)
+                    try:
+                        info = sf.info(source)
+                    finally:
+                        source.close()
 
-            sr = info.samplerate
-            duration = info.duration
+                sr = info.samplerate
+                duration = info.duration
         else:
             assert len(x.shape) == 1 or (len(x.shape) == 2 and x.shape[0] == 2), "Invalid signal shape"
             duration = x.shape[-1] / sr
-            x = x.astype(dtype=np.float32).T
+            # place the samples (channels last) in shared memory once, the audio process attaches without copying
+            shared_x = SharedArray(x.shape[::-1], np.float32)
+            shared_x.array[...] = x.T
+            x = shared_x
 
         self.__audio_process: Optional[Process] = None
-        self.__x: Union[np.ndarray, str] = x
+        self.__x: Union[SharedArray, str] = x
         self.__sr: int = sr
-        # the shared object will be available on all processes and allows for ipc via Values
+        # the shared object will be available on all processes and allows for ipc via shared memory
         self.__so: SharedObject = SharedObject(show_msg_box_on_error_in_other_process, duration, close_with_last_plot,
-                                               fps_target, save_folder, plot_min_sleep, looping)
+                                               fps_target, save_folder, plot_min_sleep, looping, read_cache_size,
+                                               decode_cache, decoding_backend, audio_output, buffersize_msec,
+                                               buffersize_bounds, audio_priority,
+                                               None if audio_cpus is None else tuple(audio_cpus), plot_nice,
+                                               None if plot_cpus is None else tuple(plot_cpus), idle_fps,
+                                               max_seek_rate)
         # we need to keep the shared object alive, even after this instance is deconstructed,
         # so all processes can shut down properly
         self.__class__.__shared_object_storage.append(self.__so)
+        self.__shared_arrays = SharedArrayRegistry(shared_memory_threshold)
+        # latest reported Scheduling per process role
+        self.__scheduling: Dict[str, Scheduling] = dict()
+        # latest reported frame rate per plot title
+        self.__frame_rates: Dict[str, float] = dict()
+        self.__plot_workers: Optional[Union[PlotWorkerPool, PlotHost]] = None
+        if single_plot_process:
+            self.__plot_workers = PlotHost(self.__so)
+        elif plot_worker_pool_size > 0:
+            self.__plot_workers = PlotWorkerPool(self.__so, plot_worker_pool_size)
         self.__total_spawned_plots = 0
         self.time = time
         self.volume = volume
@@ -175,10 +365,12 @@ class Session:
         Raises
         ------
         RuntimeError
-            In case the session is already started
+            In case the session is already started or stopped
         """
         if self.__audio_process is not None:
             raise RuntimeError("Session can only be started once")
+        if self.__so.state.stop:
+            raise RuntimeError("Session already stopped")
 
         # record a stack trance, so in the case of an exception in another process, we can know where it originated
         # noinspection PyBroadException
@@ -198,10 +390,22 @@ class Session:
         Calling multiple times is allowed.
         """
         try:
-            with self.__so.lock:
-                self.__so.stop.value = True
+            self.__so.state.update(stop=True)
+            x = self.__x
+            shared_arrays = self.__shared_arrays
+            plot_workers = self.__plot_workers
         except AttributeError:
-            pass
+            return
+
+        shared_arrays.close()
+        if plot_workers is not None:
+            plot_workers.close()
+
+        # free the shared audio samples, once started the audio process unlinks them after attaching
+        if isinstance(x, SharedArray):
+            if self.__audio_process is None:
+                x.unlink()
+            x.close()
 
     def __del__(self):
         self.stop()
@@ -234,20 +438,44 @@ class Session:
         was_paused = self.paused
         self.paused = True
         # signal plot processes
-        with self.__so.lock:
-            self.__so.plots_wrote_current_frame.value = 0
-            self.__so.save_as_frame_number.value = frame_number
+        self.__so.state.update(plots_wrote_current_frame=0, save_as_frame_number=frame_number)
 
-        # wait until all plots have written there file
-        while True:
-            with self.__so.lock:
-                if self.__so.plots_wrote_current_frame.value >= self.__so.open_plots.value:
-                    break
-            sleep(0.001)
+        # wait until all plots have written there file, plot processes notify when they have written it
+        self.__so.state.wait_for(lambda state: state.plots_wrote_current_frame >= state.open_plots)
 
         if not was_paused:
             self.paused = False
 
+    def step(self, seconds: float, timeout: Optional[float] = 10) -> None:
+        """
+        Generate the next `seconds` of audio, only for sessions with audio_output="manual".
+        Blocks until the audio was generated and :attr:`time` was updated, paused sessions generate silence.
+
+        Parameters
+        ----------
+        seconds
+            duration to advance, rounded to whole samples
+        timeout
+            raises TimeoutError if reached
+
+        Raises
+        ------
+        RuntimeError
+            In case the session is not started, already stopped or its audio_output is not "manual"
+        TimeoutError
+            Timeout reached
+        """
+        if self.__so.audio_output != "manual":
+            raise RuntimeError('Session.step requires audio_output="manual"')
+        if self.__audio_process is None or self.__so.state.stop:
+            raise RuntimeError("Session is not running")
+
+        with self.__so.state.transaction() as record:
+            record.step_frames_requested += int(round(seconds * self.__sr))
+            requested = record.step_frames_requested
+        if not self.__so.state.wait_for(lambda state: state.step_frames_done >= requested or state.stop, timeout):
+            raise TimeoutError()
+
     def join(self, timeout=None, force_close_with_last_plot=True) -> None:
         """
         Block until all Plots are closed
@@ -264,20 +492,15 @@ class Session:
         TimeoutError
             Timeout reached
         """
-        start_time = monotonic()
-        while True:
-            if timeout is not None and monotonic() > start_time + timeout:
+        # wake up as soon as the session stops or the last plot gets closed
+        if self.__so.close_with_last_plot:
+            if not self.__so.state.wait_for(lambda state: state.stop or self.__audio_process is None, timeout):
                 raise TimeoutError()
-            if self.__so.close_with_last_plot:
-                if not self.is_running:
-                    return
-            else:
-                with self.__so.lock:
-                    if self.__so.open_plots.value == 0:
-                        if force_close_with_last_plot:
-                            self.stop()
-                        return
-            sleep(0.01)
+        else:
+            if not self.__so.state.wait_for(lambda state: state.open_plots == 0, timeout):
+                raise TimeoutError()
+            if force_close_with_last_plot:
+                self.stop()
 
     def wait_for_plots_opening(self, number_of_plots=None, timeout=10, supress_timeout_error=True):
         """
@@ -298,23 +521,17 @@ class Session:
         TimeoutError
             Timeout reached
         """
-        start_time = monotonic()
-
         if number_of_plots is None:
             number_of_plots = self.total_spawned_plots
 
         if number_of_plots < 0:
             raise ValueError("number_of_plots is negative")
 
-        while True:
-            if timeout is not None and monotonic() > start_time + timeout:
-                if supress_timeout_error:
-                    return
-                raise TimeoutError()
-            with self.__so.lock:
-                if self.__so.open_plots.value >= number_of_plots:
-                    return
-            sleep(0.01)
+        # plot processes notify when they are opened
+        if not self.__so.state.wait_for(lambda state: state.open_plots >= number_of_plots, timeout):
+            if supress_timeout_error:
+                return
+            raise TimeoutError()
 
     def retrieve_errors(self) -> List[Union[AudioProcessException, PlotProcessException]]:
         """
@@ -328,14 +545,17 @@ class Session:
 
         """
         error_list = list()
-        with self.__so.lock:
-            if self.__so.error_queue_size.value > 0:
-                while True:
-                    try:
-                        error_list.append(self.__so.error_queue.get(block=False))
-                    except queue.Empty:
-                        break
-                self.__so.error_queue_size.value = 0
+        error_queue_size = self.__so.state.error_queue_size
+        if error_queue_size > 0:
+            # an error is counted right before it is put into the queue, wait for the ones already counted
+            while True:
+                try:
+                    error_list.append(self.__so.error_queue.get(timeout=1 if len(error_list) < error_queue_size else 0))
+                except queue.Empty:
+                    break
+            # errors which are counted but not yet received stay counted for the next call
+            with self.__so.state.transaction() as record:
+                record.error_queue_size = max(0, record.error_queue_size - len(error_list))
         return error_list
 
     def check(self) -> None:
@@ -368,16 +588,14 @@ class Session:
     @property
     def paused(self) -> bool:
         """
-        Audio playback control.
+        Audio playback control, the audio device is suspended while paused.
         (may stay false after session has stopped running)
         """
-        with self.__so.lock:
-            return self.__so.paused.value
+        return self.__so.state.paused
 
     @paused.setter
     def paused(self, val: bool) -> None:
-        with self.__so.lock:
-            self.__so.paused.value = val
+        self.__so.state.update(paused=val)
 
     @property
     def looping(self) -> bool:
@@ -385,13 +603,11 @@ class Session:
         Restart after end is reached.
         (argument in constructor)
         """
-        with self.__so.lock:
-            return self.__so.looping.value
+        return self.__so.state.looping
 
     @looping.setter
     def looping(self, val: bool) -> None:
-        with self.__so.lock:
-            self.__so.looping.value = val
+        self.__so.state.update(looping=val)
 
     @property
     def time(self) -> float:
@@ -399,15 +615,14 @@ class Session:
         Current cursor time will be clamped between 0-duration.
         (argument in constructor)
         """
-        with self.__so.lock:
-            return self.__so.time.value
+        return self.__so.state.time
 
     @time.setter
     def time(self, val: float) -> None:
-        with self.__so.lock:
-            if val != self.__so.time.value:
-                self.__so.time.value = max(0, min(self.__so.duration, val))
-                self.__so.time_skip.value = True
+        with self.__so.state.transaction() as record:
+            if val != record.time:
+                record.time = max(0, min(self.__so.duration, val))
+                record.seek_count += 1
 
     @property
     def volume(self) -> float:
@@ -415,21 +630,64 @@ class Session:
         Current volume will be clamped between 0-1.
         (argument in constructor)
         """
-        with self.__so.lock:
-            return self.__so.volume.value
+        return self.__so.state.volume
 
     @volume.setter
     def volume(self, val: float) -> None:
-        with self.__so.lock:
-            self.__so.volume.value = max(0.0, min(1.0, val))
+        self.__so.state.update(volume=max(0.0, min(1.0, val)))
 
     @property
     def is_running(self) -> bool:
         """
         Check if the Session is (still) running.
         """
-        with self.__so.lock:
-            return not self.__so.stop.value and self.__audio_process is not None
+        return not self.__so.state.stop and self.__audio_process is not None
+
+    @property
+    def underrun_count(self) -> int:
+        """
+        Number of audio device callbacks which came too late or took longer than the audio they generated,
+        e.g. while the cpu is busy or the file is read too slowly (seeks are not counted).
+        """
+        return self.__so.state.underrun_count
+
+    @property
+    def audio_latency(self) -> float:
+        """
+        Current size of the audio device buffer (in seconds), a generated block is audible after it.
+        *see:* buffersize_bounds argument in constructor
+        """
+        return self.__so.state.audio_latency
+
+    @property
+    def scheduling(self) -> Dict[str, Scheduling]:
+        """
+        Scheduling settings in effect for the "audio" and the "plot" processes, reported by the processes once they
+        applied audio_priority/audio_cpus or plot_nice/plot_cpus (argument in constructor).
+        Fields: policy, priority (real-time), nice, cpus, each None if not supported on this platform.
+        """
+        while True:
+            try:
+                role, scheduling = self.__so.scheduling_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.__scheduling[role] = scheduling
+        return dict(self.__scheduling)
+
+    @property
+    def frame_rates(self) -> Dict[str, float]:
+        """
+        Frames per second the plots rendered, reported by every plot once per second (plots with the same title
+        share an entry). Plots only render if the time, the paused state or the figure changed,
+        so paused plots report 0. *see:* fps_target and idle_fps argument in constructor
+        """
+        while True:
+            try:
+                title, frame_rate = self.__so.frame_rate_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.__frame_rates[title] = frame_rate
+        return dict(self.__frame_rates)
 
     @property
     def duration(self) -> float:
@@ -493,9 +751,8 @@ class Session:
         # create wrapper function transfer metadata
         @wraps(func)
         def wrapper(*args, **kwargs):
-            with so.lock:
-                if so.stop.value:
-                    raise RuntimeError("Session already stopped")
+            if so.state.stop:
+                raise RuntimeError("Session already stopped")
 
             # record a stack trance, so in the case of an exception in another process, we can know where it originated
             # noinspection PyBroadException
@@ -506,11 +763,12 @@ class Session:
 
             # Creating a new process on Windows is slow -> use multithreading to create process
             if os.name == 'nt':
-                t = threading.Thread(target=_plot_process_start_helper, args=(func, so, stack, args, kwargs))
+                t = threading.Thread(target=_plot_process_start_helper,
+                                     args=(func, so, stack, args, kwargs, self.__shared_arrays, self.__plot_workers))
                 t.daemon = True
                 t.start()
             else:
-                _plot_process_start_helper(func, so, stack, args, kwargs)
+                _plot_process_start_helper(func, so, stack, args, kwargs, self.__shared_arrays, self.__plot_workers)
 
             self.__total_spawned_plots += 1
 
@@ -0,0 +1,799 @@
+"""
+Micro benchmarks, not part of the test suite.
+
+Run a single benchmark with ``python tests/benchmarks.py <name>`` or all of them without a name.
+"""
+import multiprocessing
+import os
+import sys
+from multiprocessing import Value, Lock, Event
+from time import perf_counter, sleep
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+from src.playplot._util import SharedState
+
+
+def _print_distribution(name, samples):
+    samples = np.asarray(samples) * 1e6
+    print(f"{name:<40} n={samples.shape[0]:<8} mean={samples.mean():8.1f}us  p50={np.percentile(samples, 50):8.1f}us  "
+          f"p99={np.percentile(samples, 99):8.1f}us  max={samples.max():8.1f}us")
+
+
+def _long_audio(seconds=300, sr=48000):
+    """Generated stereo input (a slowly gliding tone with some noise), float32 samples and the sample rate"""
+    rng = np.random.default_rng(0)
+    t = np.arange(seconds * sr, dtype=np.float32) / sr
+    tone = np.sin(2 * np.pi * (220 * t + 20 * np.sin(2 * np.pi * t / 10)))
+    data = np.stack([tone, np.roll(tone, sr // 100)], axis=1) * 0.3
+    data += rng.standard_normal(data.shape, dtype=np.float32) * 0.05
+    return data, sr
+
+
+def _write_long_audio(folder, seconds=300):
+    """Write the generated input to a 16 bit wav file in folder, returns its path"""
+    import soundfile
+
+    file = os.path.join(folder, "long_audio.wav")
+    data, sr = _long_audio(seconds)
+    soundfile.write(file, data, sr, subtype="PCM_16")
+    return file
+
+
+class _LockedValues:
+    """The former SharedObject layout, one Value per field and a global lock for reads and writes"""
+    def __init__(self):
+        self.lock = Lock()
+        self.time = Value('d', 0, lock=False)
+        self.paused = Value('i', False, lock=False)
+        self.volume = Value('d', 0.8, lock=False)
+        self.fps_target = Value('d', 60, lock=False)
+        self.stop = Value('i', False, lock=False)
+
+
+def _locked_reader(values, stop_event, counter):
+    reads = 0
+    while not stop_event.is_set():
+        with values.lock:
+            _ = values.time.value, values.paused.value, values.volume.value, values.fps_target.value, \
+                values.stop.value
+        reads += 1
+    with counter.get_lock():
+        counter.value += reads
+
+
+def _locked_write(values, t):
+    with values.lock:
+        values.time.value = t
+
+
+def _seqlock_reader(state, stop_event, counter):
+    reads = 0
+    while not stop_event.is_set():
+        _ = state.read()
+        reads += 1
+    with counter.get_lock():
+        counter.value += reads
+
+
+def _seqlock_write(state, t):
+    state.update(time=t)
+
+
+def _contention(shared, reader, write, readers, duration):
+    stop_event = Event()
+    counter = Value('q', 0)
+    processes = [multiprocessing.Process(target=reader, args=(shared, stop_event, counter)) for _ in range(readers)]
+    for p in processes:
+        p.start()
+    sleep(0.2)
+
+    # emulate the audio process, which publishes the time every millisecond
+    write_durations = []
+    tick_intervals = []
+    start = last = perf_counter()
+    while perf_counter() < start + duration:
+        t = perf_counter()
+        write(shared, t)
+        now = perf_counter()
+        write_durations.append(now - t)
+        tick_intervals.append(t - last)
+        last = t
+        sleep(0.001)
+
+    stop_event.set()
+    for p in processes:
+        p.join()
+    return write_durations, tick_intervals[1:], counter.value / duration
+
+
+def benchmark_state_contention(readers=(1, 4, 10, 16), duration=2.0):
+    """Compare the seqlock state block against the former lock protected Values with concurrent readers"""
+    for n in readers:
+        for name, shared, reader, write in (
+                ("lock", _LockedValues(), _locked_reader, _locked_write),
+                ("seqlock", SharedState(Lock()), _seqlock_reader, _seqlock_write)):
+            write_durations, tick_intervals, reads_per_second = _contention(shared, reader, write, n, duration)
+            print(f"{name} with {n} readers: {reads_per_second:,.0f} reads/s")
+            _print_distribution("  write (audio process)", write_durations)
+            _print_distribution("  tick interval (target 1000us)", tick_intervals)
+
+
+def _frame_writer(state, request, stop_event):
+    # emulates a plot process which saves a frame as soon as it is requested
+    while True:
+        request.wait()
+        request.clear()
+        if stop_event.is_set():
+            return
+        with state.transaction() as record:
+            record.plots_wrote_current_frame += 1
+
+
+def benchmark_wait_latency(calls=2000):
+    """Latency of one save_plot_images like round trip, waiting via polling compared to waiting on the condition"""
+    state = SharedState(Lock(), open_plots=1)
+    request = Event()
+    stop_event = Event()
+    p = multiprocessing.Process(target=_frame_writer, args=(state, request, stop_event))
+    p.start()
+
+    def polling():
+        # the former implementation
+        while True:
+            snapshot = state.read()
+            if snapshot.plots_wrote_current_frame >= snapshot.open_plots:
+                return
+            sleep(0.001)
+
+    def condition():
+        state.wait_for(lambda snapshot: snapshot.plots_wrote_current_frame >= snapshot.open_plots)
+
+    for name, wait in (("polling (1ms sleep)", polling), ("condition", condition)):
+        latencies = []
+        for _ in range(calls):
+            start = perf_counter()
+            state.update(plots_wrote_current_frame=0)
+            request.set()
+            wait()
+            latencies.append(perf_counter() - start)
+        _print_distribution(name, latencies)
+
+    stop_event.set()
+    request.set()
+    p.join()
+
+
+def benchmark_audio_callback(sample_rates=(48000, 192000), duration=5.0):
+    """
+    Duration of miniaudio device callbacks, which run the playback generator, on the null backend.
+    A second run traces the memory allocated temporarily by each callback.
+    """
+    import threading
+    import tracemalloc
+    import miniaudio
+    from src.playplot._audioProcess import Playback
+    from src.playplot._util import SharedObject
+
+    durations = []
+    allocations = []
+    data_callback = miniaudio.PlaybackDevice._data_callback
+
+    def timed_data_callback(*args):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            data_callback(*args)
+            allocations.append(tracemalloc.get_traced_memory()[1] - before)
+            return
+        start = perf_counter()
+        data_callback(*args)
+        durations.append(perf_counter() - start)
+
+    miniaudio.PlaybackDevice._data_callback = timed_data_callback
+    try:
+        for sr in sample_rates:
+            x = (np.random.rand(int(sr * (duration + 1)), 2).astype(np.float32) - 0.5) * 0.01
+            durations.clear()
+            allocations.clear()
+            for trace, run_duration in ((False, duration), (True, 1.0)):
+                so = SharedObject(False, x.shape[0] / sr, False, 60, None, 0, True, 0)
+                so.state.update(paused=False, volume=0.5)
+                if trace:
+                    tracemalloc.start()
+                pb = Playback(so, x, sr)
+                threading.Timer(run_duration, lambda: so.state.update(stop=True)).start()
+                pb.loop()
+                pb.close()
+                tracemalloc.stop()
+            _print_distribution(f"{sr} Hz callback", durations[1:])
+            print(f"{sr} Hz allocated per callback: max {max(allocations[1:]):,} bytes")
+    finally:
+        miniaudio.PlaybackDevice._data_callback = data_callback
+
+
+def benchmark_offline_rendering(seconds=60, fps=60):
+    """
+    Step a session with audio_output="manual" frame by frame through a file, independent of the wall clock.
+    Prints the duration of each step and how much faster than real time the audio was generated.
+    """
+    import tempfile
+    from src.playplot import Session
+
+    with tempfile.TemporaryDirectory() as folder:
+        file = _write_long_audio(folder)
+        session = Session.from_file(file, audio_output="manual")
+        session.start()
+        session.paused = False
+        durations = []
+        try:
+            for _ in range(seconds * fps):
+                start = perf_counter()
+                session.step(1 / fps)
+                durations.append(perf_counter() - start)
+            print(f"session time {session.time:.3f}s after {seconds * fps} steps")
+        finally:
+            session.stop()
+    _print_distribution(f"step of 1/{fps}s", durations)
+    print(f"{seconds / sum(durations):.1f}x faster than real time")
+
+def _busy(stop_event, nice=None):
+    if nice is not None:
+        os.nice(nice)
+    while not stop_event.is_set():
+        pass
+
+
+def benchmark_underruns(duration=10.0, load_per_core=16,
+                        settings=(dict(buffersize_msec=10), dict(buffersize_msec=30),
+                                  dict(buffersize_msec=10, buffersize_bounds=(10, 160)),
+                                  dict(buffersize_msec=10, plot_nice=10, audio_priority=-10),
+                                  dict(buffersize_msec=10, audio_priority="fifo"))):
+    """
+    Underruns of a real-time null audio output playing a file while all cores are busy,
+    with fixed buffer sizes, an adaptive one and an elevated priority of the audio process.
+    The busy processes run with plot_nice if given, like plot processes would.
+    """
+    import tempfile
+    from src.playplot import Session
+
+    with tempfile.TemporaryDirectory() as folder:
+        file = _write_long_audio(folder)
+        for kwargs in settings:
+            stop_event = Event()
+            load = [multiprocessing.Process(target=_busy, args=(stop_event, kwargs.get("plot_nice")))
+                    for _ in range(load_per_core * os.cpu_count())]
+            for p in load:
+                p.start()
+            session = Session.from_file(file, audio_output="null", **kwargs)
+            session.start()
+            session.paused = False
+            try:
+                sleep(duration)
+                session.check()
+                print(f"{kwargs}: {session.underrun_count} underruns in {duration:.0f}s, "
+                      f"final latency {session.audio_latency * 1000:.0f} ms, {session.scheduling.get('audio')}")
+            finally:
+                session.stop()
+                stop_event.set()
+                for p in load:
+                    p.join()
+
+
+def _process_wakeups(pid):
+    """Context switches (voluntary and involuntary) of all threads and cpu seconds of a process, linux only"""
+    switches = 0
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/status") as f:
+            switches += sum(int(line.split()[1]) for line in f if "ctxt_switches" in line)
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return switches, (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def benchmark_paused_wakeups(duration=5.0, resumes=20, buffersize_msec=30):
+    """
+    Wakeups per second and cpu usage of the audio process of a paused session,
+    and the delay until playback continues after unpausing.
+    """
+    from src.playplot import Session
+
+    sr = 48000
+    session = Session(np.zeros((2, 600 * sr)), sr, buffersize_msec=buffersize_msec)
+    session.start()
+    session.paused = False
+    sleep(1)
+    session.paused = True
+    sleep(0.5)
+    pid = multiprocessing.active_children()[0].pid
+    try:
+        switches, cpu = _process_wakeups(pid)
+        sleep(duration)
+        switches_after, cpu_after = _process_wakeups(pid)
+        print(f"paused: {(switches_after - switches) / duration:.1f} wakeups/s, "
+              f"{(cpu_after - cpu) / duration * 100:.2f}% cpu")
+
+        delays = []
+        for _ in range(resumes):
+            paused_time = session.time
+            start = perf_counter()
+            session.paused = False
+            while session.time == paused_time:
+                sleep(0.0001)
+            delays.append(perf_counter() - start)
+            sleep(0.1)
+            session.paused = True
+            sleep(0.1)
+        _print_distribution("resume until the time advances", delays)
+    finally:
+        session.stop()
+
+def benchmark_paused_plots(plots=20, duration=5.0):
+    """
+    Cpu usage and wakeups of a session with many plots (each with a draw function updating a label),
+    paused and playing, with the frame rates the plots reported while playing.
+    """
+    from src.playplot import Session
+
+    session = Session(np.zeros((2, 600 * 48000)), 48000, audio_output="null")
+    session.start()
+
+    @session
+    def plot(title):
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots()
+        ax.plot(np.random.rand(1000))
+        text = ax.text(0.01, 0.95, "", transform=ax.transAxes)
+
+        def draw(time, pos, paused):
+            text.set_text(f"{time:.2f}")
+            return True
+
+        return fig, ax, {"title": title, "artists": [text], "draw_function": draw}
+
+    try:
+        for i in range(plots):
+            plot(f"plot {i}")
+        session.wait_for_plots_opening(plots, timeout=60)
+        # the first frames of the plots take a while
+        sleep(5)
+        pids = [p.pid for p in multiprocessing.active_children()]
+        for paused in (True, False):
+            session.paused = paused
+            sleep(2)
+            before = [_process_wakeups(pid) for pid in pids]
+            sleep(duration)
+            after = [_process_wakeups(pid) for pid in pids]
+            switches = sum(a[0] - b[0] for a, b in zip(after, before)) / duration
+            cpu = sum(a[1] - b[1] for a, b in zip(after, before)) / duration
+            print(f"{plots} plots {'paused' if paused else 'playing'}: {switches:.0f} wakeups/s, {cpu * 100:.1f}% cpu")
+        frame_rates = list(getattr(session, "frame_rates", dict()).values())
+        if frame_rates:
+            print(f"frame rates reported while playing: {min(frame_rates):.1f} - {max(frame_rates):.1f} fps")
+    finally:
+        session.stop()
+
+
+def benchmark_drag_seeks(event_rate=1000, duration=5.0, backend="QtAgg"):
+    """
+    Mouse drag over a plot with motion events at event_rate, the plot renders at fps_target:
+    seeks the plot published (one lock acquisition each) and wakeups of the (paused) audio process.
+    """
+    import matplotlib
+    matplotlib.use(backend)
+    import matplotlib.pyplot as plt
+    from types import SimpleNamespace
+    from src.playplot import Session
+    from src.playplot._plotProcess import MPP
+
+    session = Session(np.zeros((2, 600 * 48000)), 48000, audio_output="null")
+    session.start()
+    # the plot runs in this process, with the shared object of the session
+    # noinspection PyUnresolvedReferences
+    so = session._Session__so
+    fig, ax = plt.subplots()
+    ax.plot(np.random.rand(1000))
+    plot = MPP(fig, ax, {}, so)
+    plot.pressed_buttons[1] = True
+    pid = multiprocessing.active_children()[0].pid
+    try:
+        sleep(1)
+        seek_count = so.state.seek_count
+        switches, _ = _process_wakeups(pid)
+        start = next_frame = perf_counter()
+        events = 0
+        while perf_counter() < start + duration:
+            now = perf_counter()
+            while events < (now - start) * event_rate:
+                plot.on_move(SimpleNamespace(inaxes=ax, xdata=events % 1000))
+                events += 1
+            if now >= next_frame:
+                plot.update(so.state.read(), flush_events=False)
+                next_frame += 1 / so.state.fps_target
+            sleep(0.0005)
+        switches_after, _ = _process_wakeups(pid)
+        print(f"{events} motion events: {so.state.seek_count - seek_count} seeks published, "
+              f"audio process {(switches_after - switches) / duration:.0f} wakeups/s")
+    finally:
+        plt.close(fig)
+        session.stop()
+
+
+def benchmark_blitting(sizes=((1920, 1080), (3840, 2160)), frames=300, backend="QtAgg"):
+    """
+    Cursor frames of a plot with a moving axvline and a time label, restoring and blitting the whole figure
+    versus the dirty regions only (headless with QT_QPA_PLATFORM=offscreen).
+    """
+    import matplotlib
+    matplotlib.use(backend)
+    import matplotlib.pyplot as plt
+    from src.playplot._plotProcess import BlitManager
+
+    for width, height in sizes:
+        fig, ax = plt.subplots(figsize=(width / 100, height / 100), dpi=100)
+        ax.plot(np.random.rand(100000))
+        line = ax.axvline(0, alpha=0.9, ls="--", color="r", lw=1, zorder=10)
+        text = ax.text(0.01, 0.95, "", transform=ax.transAxes)
+        blit_manager = BlitManager(fig.canvas, [line, text])
+        plt.show(block=False)
+        fig.canvas.draw()
+        fig.canvas.flush_events()
+        for mode in ("whole figure", "dirty regions"):
+            durations = []
+            for i in range(frames):
+                x = i / frames * 100000
+                line.set_xdata([x, x])
+                text.set_text(f"{x:.0f}")
+                start = perf_counter()
+                if mode == "whole figure":
+                    fig.canvas.restore_region(blit_manager._bg)
+                    blit_manager._draw_animated()
+                    fig.canvas.blit(fig.bbox)
+                    fig.canvas.flush_events()
+                else:
+                    blit_manager.update()
+                durations.append(perf_counter() - start)
+            pixels = width * height if mode == "whole figure" else blit_manager.total_pixels / blit_manager.frames
+            _print_distribution(f"{width}x{height} {mode}", durations)
+            print(f"{'':<40} {pixels:,.0f} pixels per frame")
+        plt.close(fig)
+
+def benchmark_mapping(sizes=(10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7), calls=1000, batch=10000):
+    """
+    Time -> position mapping of sparse (time, position pairs) and dense (time per position) mappings,
+    converting single times versus a batch of times.
+    """
+    from src.playplot._plotProcess import build_mapping_function, build_mapping_function_dense_time_to_pos
+
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        times = np.cumsum(rng.random(n) + 0.01)
+        functions = {"sparse": build_mapping_function(times, np.arange(n, dtype=float)),
+                     "dense": build_mapping_function_dense_time_to_pos(times, 0, n - 1)}
+        queries = rng.uniform(times[0], times[-1], max(calls, batch))
+        for name, function in functions.items():
+            start = perf_counter()
+            for t in queries[:calls]:
+                function(t)
+            single = (perf_counter() - start) / calls
+            try:
+                start = perf_counter()
+                function(queries[:batch])
+                batched = f"{(perf_counter() - start) / batch * 1e9:8.1f}ns"
+            except (TypeError, ValueError):
+                batched = "     n/a"
+            print(f"{n:>10,} points {name:<7} single {single * 1e6:8.2f}us   batch {batched} per time")
+
+
+def benchmark_file_streaming(speed=10, block=1440, duration=5.0):
+    """Time the playback callback waits in AudioFileReaderThread.read while streaming a file faster than real time"""
+    import tempfile
+    from src.playplot._audioProcess import AudioFileReaderThread
+
+    with tempfile.TemporaryDirectory() as folder:
+        file = _write_long_audio(folder)
+        frt = AudioFileReaderThread(file, 2 ** 27)
+        # let the buffer fill up
+        frt.read(0, block)
+        sleep(1)
+
+        waits = []
+        position = 0
+        interval = block / frt._sf.samplerate / speed
+        start = perf_counter()
+        while perf_counter() < start + duration:
+            t = perf_counter()
+            frt.read(position, position + block)
+            waits.append(perf_counter() - t)
+            position = (position + block) % (frt.length - block)
+            sleep(interval)
+        frt.close()
+    _print_distribution(f"read at {speed}x real time", waits)
+
+
+def benchmark_scrubbing(positions=(10, 120, 60, 250, 180), rounds=4, file_format="FLAC"):
+    """Latency of jumps between a few positions of a compressed file, with the default and a minimal read cache"""
+    import random
+    import tempfile
+    import soundfile
+    from src.playplot._audioProcess import AudioFileReaderThread
+
+    with tempfile.TemporaryDirectory() as folder:
+        file = os.path.join(folder, "scrubbing." + file_format.lower())
+        data, sr = _long_audio()
+        # libsndfile crashes writing long ogg files at once
+        with soundfile.SoundFile(file, "w", sr, data.shape[1], format=file_format) as f:
+            for i in range(0, data.shape[0], sr):
+                f.write(data[i:i + sr])
+
+        jumps = [p for _ in range(rounds) for p in positions]
+        random.Random(0).shuffle(jumps)
+        for name, cache_size in (("default cache", 2 ** 27), ("minimal cache", 0)):
+            frt = AudioFileReaderThread(file, cache_size)
+            latencies = []
+            for seconds in jumps:
+                start = perf_counter()
+                frt.read(seconds * sr, seconds * sr + 1440)
+                latencies.append(perf_counter() - start)
+                # play a moment, so the read ahead gets going
+                for frame in range(seconds * sr, seconds * sr + sr // 4, 1440):
+                    frt.read(frame, frame + 1440)
+                    sleep(0.001)
+            frt.close()
+            _print_distribution(f"{name} jump ({len(jumps)} jumps)", latencies)
+
+
+def benchmark_mp3_seeking(positions=(280, 40, 200, 120, 250, 10), block=1440):
+    """
+    Latency of the first read after jumping into an mp3 file, where the decoder would have to scan the file
+    up to the position, without and with the seek index.
+    """
+    import tempfile
+    import soundfile
+    from src.playplot._audioProcess import AudioFileReaderThread
+
+    data, sr = _long_audio()
+    with tempfile.TemporaryDirectory() as folder:
+        file = os.path.join(folder, "seeking.mp3")
+        with soundfile.SoundFile(file, "w", sr, data.shape[1], format="MP3") as f:
+            for i in range(0, data.shape[0], sr):
+                f.write(data[i:i + sr])
+
+        load_seek_index = AudioFileReaderThread._load_seek_index
+        for use_index in (False, True):
+            # without the index the decoder scans the file itself
+            AudioFileReaderThread._load_seek_index = load_seek_index if use_index else lambda *args: None
+            latencies = []
+            for seconds in positions:
+                frt = AudioFileReaderThread(file, 2 ** 27)
+                frt.read(0, block)
+                while use_index and frt.seek_index is None:
+                    sleep(0.01)
+                start = perf_counter()
+                frt.read(seconds * sr, seconds * sr + block)
+                latencies.append(perf_counter() - start)
+                frt.close()
+            _print_distribution(f"jump {'with' if use_index else 'without'} seek index", latencies)
+        AudioFileReaderThread._load_seek_index = load_seek_index
+
+
+def benchmark_decoding_backends(file_formats=("FLAC", "MP3", "OGG"), seconds=20, speed=4, jumps=20, block=1440):
+    """
+    Compare decoding via soundfile and via miniaudio in the reader thread: cpu time used while playing
+    at speed times real time (including the reader thread), the time of a callback read and of a read after a jump.
+    """
+    import random
+    import tempfile
+    import time
+    import soundfile
+    from src.playplot._audioProcess import open_audio_file
+
+    data, sr = _long_audio()
+    with tempfile.TemporaryDirectory() as folder:
+        for file_format in file_formats:
+            file = os.path.join(folder, "backends." + file_format.lower())
+            # libsndfile crashes writing long ogg files at once
+            with soundfile.SoundFile(file, "w", sr, data.shape[1], format=file_format) as f:
+                for i in range(0, data.shape[0], sr):
+                    f.write(data[i:i + sr])
+
+            for backend in ("soundfile", "miniaudio"):
+                reader = open_audio_file(file, 2 ** 27, backend=backend, sample_rate=sr)
+                reader.read(0, block)
+                sleep(1)
+
+                reads = []
+                start_cpu, start = time.process_time(), perf_counter()
+                for position in range(block, seconds * sr, block):
+                    t = perf_counter()
+                    reader.read(position, position + block)
+                    reads.append(perf_counter() - t)
+                    sleep(max(0.0, start + position / sr / speed - perf_counter()))
+                cpu = (time.process_time() - start_cpu) / (perf_counter() - start)
+
+                rng = random.Random(0)
+                latencies = []
+                for _ in range(jumps):
+                    position = rng.randrange(0, reader.length - block)
+                    t = perf_counter()
+                    reader.read(position, position + block)
+                    latencies.append(perf_counter() - t)
+                    sleep(0.01)
+                reader.close()
+
+                print(f"{file_format} {backend} ({type(reader._sf).__name__}): {cpu * 100:.1f}% cpu at {speed}x real time")
+                _print_distribution("  callback read", reads)
+                _print_distribution("  jump", latencies)
+
+
+def benchmark_decode_cache(file_formats=("FLAC", "OGG"), jumps=20, block=1440):
+    """
+    Time to open a compressed file and read its first block (like the first callback), without the decode cache
+    and from the decode cache, and the latency of jumps afterwards.
+    """
+    import random
+    import tempfile
+    import soundfile
+    from src.playplot._audioProcess import open_audio_file
+    from src.playplot._decodeCache import DecodeCache
+
+    data, sr = _long_audio()
+    with tempfile.TemporaryDirectory() as folder:
+        cache = DecodeCache(os.path.join(folder, "cache"), 2 ** 32)
+        for file_format in file_formats:
+            file = os.path.join(folder, "decode_cache." + file_format.lower())
+            # libsndfile crashes writing long ogg files at once
+            with soundfile.SoundFile(file, "w", sr, data.shape[1], format=file_format) as f:
+                for i in range(0, data.shape[0], sr):
+                    f.write(data[i:i + sr])
+
+            start = perf_counter()
+            cache.store(file)
+            print(f"{file_format}: decoding into the cache took {perf_counter() - start:.2f}s")
+
+            for name, decode_cache in (("soundfile", None), ("decode cache", cache)):
+                start = perf_counter()
+                soundfile.info(file) if decode_cache is None else decode_cache.lookup(file)
+                reader = open_audio_file(file, 2 ** 27, decode_cache)
+                reader.read(0, block)
+                opened = perf_counter() - start
+
+                rng = random.Random(0)
+                latencies = []
+                for _ in range(jumps):
+                    position = rng.randrange(0, reader.length - block)
+                    start = perf_counter()
+                    reader.read(position, position + block)
+                    latencies.append(perf_counter() - start)
+                    sleep(0.01)
+                reader.close()
+                print(f"  {name}: opened in {opened * 1000:.1f}ms")
+                _print_distribution("    jump", latencies)
+
+
+def _anonymous_memory():
+    # resident memory not backed by files (linux only)
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def benchmark_wav_reading(subtypes=("PCM_16", "PCM_24"), jumps=200, block=1440):
+    """
+    Jump latency and read time per callback for uncompressed wav files, decoded via soundfile or memory mapped.
+    Reading through the whole file shows the anonymous memory the reader needs.
+    """
+    import random
+    import tempfile
+    import soundfile
+    from src.playplot._audioProcess import AudioFileReaderThread, open_audio_file
+
+    data, sr = _long_audio()
+    with tempfile.TemporaryDirectory() as folder:
+        for subtype in subtypes:
+            file = os.path.join(folder, subtype + ".wav")
+            soundfile.write(file, data, sr, subtype=subtype)
+            for name, open_reader in (("soundfile", AudioFileReaderThread), ("memmap", open_audio_file)):
+                memory = _anonymous_memory()
+                reader = open_reader(file, 2 ** 27)
+                reader.read(0, block)
+
+                rng = random.Random(0)
+                latencies = []
+                for _ in range(jumps):
+                    position = rng.randrange(0, reader.length - block)
+                    start = perf_counter()
+                    reader.read(position, position + block)
+                    latencies.append(perf_counter() - start)
+                    sleep(0.001)
+
+                reads = []
+                for position in range(0, reader.length - block, block):
+                    start = perf_counter()
+                    reader.read(position, position + block)
+                    reads.append(perf_counter() - start)
+                reader.close()
+
+                print(f"{subtype} {name}: {(_anonymous_memory() - memory) / 2 ** 20:.0f}MiB anonymous memory "
+                      f"after reading {os.path.getsize(file) / 2 ** 20:.0f}MiB")
+                _print_distribution(f"  jump", latencies)
+                _print_distribution(f"  sequential read ({block} frames)", reads)
+
+
+def benchmark_url_streaming(seconds=60, jumps=10, keep_alive=True, rtt=0.02, bandwidth=2 ** 22):
+    """
+    Read a file over http the way the audio process does, count the tcp connections the server accepted.
+    The server emulates a network round trip time per request and two for every new connection (handshakes),
+    responses are delayed according to a bandwidth limit per connection (bytes per second).
+    """
+    import http.server
+    import random
+    import tempfile
+    import threading
+    import soundfile
+    from RangeHTTPServer import RangeRequestHandler
+    from src.playplot._util import UrlFile
+
+    with tempfile.TemporaryDirectory() as folder:
+        file = _write_long_audio(folder)
+        connections = []
+
+        class Handler(RangeRequestHandler):
+            protocol_version = "HTTP/1.1" if keep_alive else "HTTP/1.0"
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=os.path.dirname(file), **kwargs)
+
+            def setup(self):
+                connections.append(self.client_address)
+                sleep(2 * rtt)
+                super().setup()
+
+            def send_head(self):
+                first, _, last = self.headers.get("Range", "bytes=0-0")[len("bytes="):].partition("-")
+                sleep(rtt + (int(last) + 1 - int(first)) / bandwidth if last else rtt)
+                return super().send_head()
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(("localhost", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        start = perf_counter()
+        source = UrlFile(f"http://localhost:{server.server_port}/{os.path.basename(file)}")
+        jump_latencies = []
+        with soundfile.SoundFile(source) as f:
+            sr = f.samplerate
+            for position in range(0, seconds * sr, 40000):
+                f.seek(position)
+                f.read(40000, dtype='float32')
+            sequential = perf_counter() - start
+
+            rng = random.Random(0)
+            for _ in range(jumps):
+                t = perf_counter()
+                f.seek(rng.randrange(0, f.frames - 40000))
+                f.read(4000, dtype='float32')
+                jump_latencies.append(perf_counter() - t)
+        source.close()
+        server.shutdown()
+
+        print(f"{'keep-alive' if keep_alive else 'HTTP/1.0'} server, {rtt * 1000:.0f}ms rtt, "
+              f"{bandwidth / 2 ** 20:.0f}MiB/s per connection: "
+              f"first {seconds}s in {sequential * 1000:.0f}ms, {len(connections)} connections, "
+              f"{getattr(source, 'request_count', '?')} requests")
+    _print_distribution("  jump", jump_latencies)
+
+
+BENCHMARKS = {name[len("benchmark_"):]: func for name, func in globals().items() if name.startswith("benchmark_")}
+
+if __name__ == '__main__':
+    for benchmark in sys.argv[1:] or BENCHMARKS:
+        print(f"{'-' * 40} {benchmark}")
+        BENCHMARKS[benchmark]()
@@ -1,21 +1,33 @@
+import http.server
 import multiprocessing
 import os
 import shutil
 import socketserver
+import subprocess
+import tempfile
 import threading
 import unittest
-from time import sleep, perf_counter
+from time import sleep, perf_counter, monotonic
 from unittest.mock import patch
 from urllib.error import URLError
 
 import libfmp.b as lfb
 import numpy as np
+import soundfile
 from RangeHTTPServer import RangeRequestHandler
 import sys
 
 sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
 
 from src.playplot import *
+from src.playplot._util import SharedState, SharedObject, SharedArrayRegistry, UrlFile, dumps_plot_payload, \
+    loads_plot_payload, put_latest
+from src.playplot._plotProcess import BlitManager, FrameScheduler, MPP, audible_time
+from src.playplot._audioProcess import AudioFileReaderThread, MemmapAudioReader, MiniaudioDecoder, Playback, \
+    open_audio_file
+from src.playplot._decodeCache import DecodeCache
+from src.playplot._scheduling import apply_scheduling, current_scheduling, reset_thread_scheduling
+from src.playplot._seekIndex import build_seek_index
 from examples.example_data import simple_audio_file, simple_annotations_file, long_audio_file
 
 sr = 48000
@@ -23,6 +35,11 @@ annotations = np.genfromtxt(simple_annotations_file, delimiter=',')
 audio, _ = lfb.read_audio(simple_audio_file, mono=True, Fs=sr)
 
 
+class _RangeServer(socketserver.TCPServer):
+    # the server closes the connections, the port would be blocked by their TIME_WAIT state otherwise
+    allow_reuse_address = True
+
+
 class TestCaseHelper(unittest.TestCase):
     stopServer = False
 
@@ -45,7 +62,7 @@ class TestCaseHelper(unittest.TestCase):
         shutil.copy(long_audio_file, 'temp.wav')
 
     def runServer(self):
-        with socketserver.TCPServer(("", 8088), RangeRequestHandler) as server:
+        with _RangeServer(("", 8088), RangeRequestHandler) as server:
             while not self.stopServer:
                 try:
                     server.handle_request()
@@ -61,6 +78,119 @@ class TestCaseHelper(unittest.TestCase):
         self.assertTrue(False, msg)
 
 
+def _shared_state_writer(state, n):
+    for i in range(1, n + 1):
+        state.update(time=float(i), seek_count=i)
+
+
+def _frame_rate_reporter(so, n):
+    for i in range(n):
+        put_latest(so.frame_rate_queue, ("plot", float(i)))
+    # let the last report through
+    sleep(0.5)
+
+
+def _raise_unpickling_error():
+    raise RuntimeError("unpickling failed")
+
+
+class _UnpicklingFails:
+    def __reduce__(self):
+        return _raise_unpickling_error, ()
+
+
+class SharedMemoryTests(TestCaseHelper):
+
+    def test_consistent_snapshots(self):
+        state = SharedState(multiprocessing.Lock(), paused=True)
+        p = multiprocessing.Process(target=_shared_state_writer, args=(state, 20000))
+        p.start()
+
+        # every snapshot must contain fields written by the same update
+        while p.is_alive():
+            snapshot = state.read()
+            self.assertEqual(snapshot.time, snapshot.seek_count)
+        p.join()
+
+        self.assertEqual(state.seek_count, 20000)
+        self.assertTrue(state.paused)
+
+    def test_unread_frame_rates(self):
+        so = SharedObject(False, 10, False, 60, None, 0, False, 0)
+        p = multiprocessing.Process(target=_frame_rate_reporter, args=(so, 2000))
+        p.start()
+        # nobody reads the reports, the process exits nevertheless
+        p.join(5)
+        self.assertFalse(p.is_alive())
+
+        # the latest reports are kept
+        reports = []
+        while not so.frame_rate_queue.empty():
+            reports.append(so.frame_rate_queue.get(timeout=1)[1])
+        self.assertLessEqual(len(reports), 64)
+        self.assertEqual(reports[-1], 1999)
+
+    def test_plot_payload_arrays(self):
+        registry = SharedArrayRegistry(2 ** 20)
+        large = np.random.rand(1000, 300)
+        fortran = np.asfortranarray(large)
+        small = np.ones(10)
+
+        def func():
+            return large
+
+        data = dumps_plot_payload((func, large, fortran, large.copy(), small), registry)
+        self.assertLess(len(data), 2 ** 16)
+        # equal content is only stored once
+        self.assertEqual(len(registry.arrays), 1)
+
+        func_, large_, fortran_, copy_, small_ = loads_plot_payload(data)
+        self.assertIs(func_(), large_)
+        self.assertIs(copy_, large_)
+        np.testing.assert_array_equal(fortran_, large)
+        self.assertFalse(large_.flags.writeable)
+        self.assertTrue(small_.flags.writeable)
+
+        registry.close()
+        self.assertEqual(len(registry.arrays), 0)
+
+    def test_repeated_shares(self):
+        registry = SharedArrayRegistry(2 ** 20)
+        large = np.asfortranarray(np.random.rand(1000, 300))
+        shared = registry.share(large)
+
+        # the same array is neither hashed nor copied again
+        with patch("hashlib.sha256") as sha256, patch("numpy.ascontiguousarray") as ascontiguousarray:
+            self.assertIs(registry.share(large), shared)
+        sha256.assert_not_called()
+        ascontiguousarray.assert_not_called()
+
+        # equal arrays are still found by their content, collected arrays are forgotten
+        copy = np.array(large)
+        self.assertIs(registry.share(copy), shared)
+        # changes in place are not detected, see shared_memory_threshold
+        large[0, 0] += 1
+        self.assertIs(registry.share(large), shared)
+        del large, copy
+        self.assertEqual(len(registry.sources), 0)
+        registry.close()
+
+    def test_audible_time(self):
+        now = monotonic()
+        state = SharedState(multiprocessing.Lock(), time=3.0, seek_count=2, looping=True).read()._replace(
+            clock_seek_count=2, clock_position=1.0, clock_timestamp=now - 0.1, clock_rate=1.0)
+
+        self.assertAlmostEqual(audible_time(state, 10.0), 1.1, delta=0.05)
+        # the block is not audible yet
+        self.assertAlmostEqual(audible_time(state._replace(clock_timestamp=now + 0.03), 10.0), 0.97, delta=0.05)
+        # wraps around at the end of the clip while looping, stops at the end otherwise
+        self.assertAlmostEqual(audible_time(state._replace(clock_position=9.95), 10.0), 0.05, delta=0.05)
+        self.assertEqual(audible_time(state._replace(clock_position=9.95, looping=False), 10.0), 10.0)
+        # the published time is used while paused and while a time skip was not played yet
+        self.assertEqual(audible_time(state._replace(paused=True), 10.0), 3.0)
+        self.assertEqual(audible_time(state._replace(seek_count=3), 10.0), 3.0)
+
+
 class AudioPlaybackTestsForArray(TestCaseHelper):
 
     def test_invalid_shapes(self):
@@ -86,6 +216,150 @@ class AudioPlaybackTestsForArray(TestCaseHelper):
         session.stop()
         self.assertAlmostEqual(session.time, 0)
 
+    def test_manual_stepping(self):
+        session = Session(np.zeros((2, 10 * sr)), sr, audio_output="manual")
+        session.start()
+        session.paused = False
+        session.step(1)
+        self.assertEqual(session.time, 1)
+        session.step(0.25)
+        self.assertEqual(session.time, 1.25)
+
+        session.time = 5
+        session.step(0.5)
+        self.assertEqual(session.time, 5.5)
+
+        session.paused = True
+        session.step(1)
+        self.assertEqual(session.time, 5.5)
+        session.stop()
+
+        with self.assertRaises(RuntimeError):
+            session.step(1)
+        with self.assertRaises(RuntimeError):
+            Session(np.zeros((2, sr)), sr).step(1)
+        with self.assertRaises(ValueError):
+            Session(np.zeros((2, sr)), sr, audio_output="speaker")
+
+    def test_null_output(self):
+        session = Session(np.zeros((2, 10 * sr)), sr, audio_output="null")
+        session.start()
+        session.paused = False
+        sleep(1)
+        session.check()
+        self.assertAlmostEqual(session.time, 1, delta=0.2)
+        self.assertEqual(session.audio_latency, 0.03)
+
+        # the device is suspended while paused and continues at the same position
+        session.paused = True
+        sleep(0.1)
+        paused_time = session.time
+        sleep(0.5)
+        self.assertEqual(session.time, paused_time)
+        session.paused = False
+        sleep(0.5)
+        session.check()
+        self.assertAlmostEqual(session.time, paused_time + 0.5, delta=0.15)
+        self.assertEqual(session.underrun_count, 0)
+        session.stop()
+
+    def test_exit_paused(self):
+        # the audio process is a daemon, it is terminated at exit while the session stops
+        script = "import numpy as np, time\n" \
+                 "from src.playplot import Session\n" \
+                 "session = Session(np.zeros(48000), 48000, audio_output='null')\n" \
+                 "session.start()\n" \
+                 "time.sleep(1)\n"
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.run([sys.executable, "-c", script], cwd=root, timeout=20, check=True)
+
+    def test_underruns(self):
+        so = SharedObject(False, 10, False, 60, None, 0, False, 0, audio_output="null", buffersize_msec=10,
+                          buffersize_bounds=(10, 40))
+        so.state.update(paused=False)
+        playback = Playback(so, np.zeros((10 * sr, 2), dtype=np.float32), sr)
+        # a suspended device resumes within a buffer period
+        self.assertEqual(playback.suspended_poll_interval, 0.01)
+        # drive the callbacks by hand, one of them arrives late
+        playback.device.close()
+        for delay in (0, 0.002, 0.002, 0.05, 0.002):
+            sleep(delay)
+            playback.callbacks.send(sr // 100)
+        self.assertEqual(playback.underrun_count, 1)
+
+        playback.resized_at -= playback.min_resize_interval
+        playback.adapt_buffersize()
+        self.assertEqual(playback.buffersize_msec, 20)
+        self.assertEqual(so.state.audio_latency, 0.02)
+        self.assertEqual(playback.suspended_poll_interval, 0.02)
+        playback.resize_device(40)
+        self.assertEqual(playback.suspended_poll_interval, playback.max_suspended_poll_interval)
+        playback.close()
+
+        with self.assertRaises(ValueError):
+            Session(np.zeros((2, sr)), sr, buffersize_bounds=(40, 10))
+
+
+class SchedulingTests(TestCaseHelper):
+
+    def test_session_scheduling(self):
+        session = Session(np.zeros((2, sr)), sr, audio_output="null", audio_priority=5, audio_cpus=[0])
+        self.assertEqual(session.scheduling, dict())
+        session.start()
+        self.timeout_assert(lambda: "audio" in session.scheduling)
+        self.assertEqual(session.scheduling["audio"].nice, 5)
+        self.assertEqual(session.scheduling["audio"].cpus, (0,))
+        session.stop()
+
+        with self.assertRaises(ValueError):
+            Session(np.zeros((2, sr)), sr, audio_priority="realtime")
+
+    @unittest.skipUnless(hasattr(os, "sched_setscheduler"), "linux only")
+    def test_degraded_scheduling(self):
+        set_priority = os.setpriority
+        result = []
+
+        def restricted_set_priority(which, who, value):
+            if value < -3:
+                raise PermissionError()
+            set_priority(which, who, value)
+
+        def apply():
+            with patch("os.sched_setscheduler", side_effect=PermissionError), \
+                    patch("os.setpriority", restricted_set_priority):
+                result.append(apply_scheduling("fifo", [0, 10 ** 6]))
+
+        # the settings only apply to the calling thread
+        t = threading.Thread(target=apply)
+        t.start()
+        t.join()
+        self.assertEqual(result[0].policy, "other")
+        self.assertEqual(result[0].nice, -3)
+        self.assertEqual(result[0].cpus, (0,))
+        self.assertEqual(os.getpriority(os.PRIO_PROCESS, 0), 0)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "linux only")
+    def test_background_scheduling(self):
+        result = []
+
+        def background():
+            reset_thread_scheduling()
+            result.append(current_scheduling())
+
+        def apply():
+            result.append(apply_scheduling(-2, None))
+            t = threading.Thread(target=background)
+            t.start()
+            t.join()
+
+        # threads doing background work return to the settings of the process
+        t = threading.Thread(target=apply)
+        t.start()
+        t.join()
+        if result[0].nice != -2:
+            self.skipTest("a higher priority is not permitted")
+        self.assertEqual(result[1].nice, os.getpriority(os.PRIO_PROCESS, 0))
+
 
 class ProcessCreationTests(TestCaseHelper):
 
@@ -118,6 +392,97 @@ class ProcessCreationTests(TestCaseHelper):
 
         del session
 
+    def test_worker_pool(self):
+        session = Session(audio, sr, plot_worker_pool_size=2)
+        self.timeout_assert(lambda: len(multiprocessing.active_children()) == 2, timeout=5)
+
+        @session
+        def plot():
+            raise ValueError()
+
+        plot()
+
+        # the used worker gets replaced
+        self.timeout_assert(lambda: session.retrieve_errors() != [], timeout=5)
+        self.timeout_assert(lambda: len(multiprocessing.active_children()) == 2, timeout=5)
+
+        # idle workers exit with the session
+        session.stop()
+        self.timeout_assert(lambda: len(multiprocessing.active_children()) == 0)
+
+    def test_single_plot_process(self):
+        session = Session(audio, sr, single_plot_process=True)
+        self.addCleanup(session.stop)
+        self.timeout_assert(lambda: len(multiprocessing.active_children()) == 1, timeout=5)
+
+        @session
+        def plot(audio_, sr_, name):
+            import libfmp.b as lfb_
+            if name == "error":
+                raise ValueError()
+
+            fig, ax, _ = lfb_.plot_signal(audio_, sr_)
+            return fig, ax, {'title': name}
+
+        plot(audio, sr, "Fig 1")
+        plot(audio, sr, "error")  # stack marker test_single_plot_process
+        plot(audio, sr, "Fig 2")
+        session.wait_for_plots_opening(2, timeout=5, supress_timeout_error=False)
+        session.start()
+        self.timeout_assert(lambda: len(multiprocessing.active_children()) == 2)
+
+        # the error only closes its own plot
+        with self.assertRaises(PlotProcessException) as e:
+            session.check()
+        e = e.exception
+        self.assertTrue(isinstance(e.original_exception, ValueError))
+        self.assertTrue("stack marker test_single_plot_process" in e.origin_stack[-1])
+
+        sleep(0.5)
+        session.check()
+        self.assertTrue(session.is_running)
+        session.stop()
+
+    def test_single_plot_process_payload_errors(self):
+        session = Session(audio, sr, single_plot_process=True)
+        self.addCleanup(session.stop)
+
+        @session
+        def plot(arg):
+            import matplotlib.pyplot as plt
+
+            fig, ax = plt.subplots()
+            ax.plot(np.arange(10))
+            if arg is None:
+                # no cursor
+                return None
+            return fig, ax
+
+        plot(_UnpicklingFails())
+        plot(None)
+        plot(1)
+        session.wait_for_plots_opening(2, timeout=5, supress_timeout_error=False)
+        session.start()
+
+        # a plot which can not be unpickled is reported, the host keeps serving the other plots
+        with self.assertRaises(PlotProcessException) as e:
+            session.check()
+        self.assertEqual(str(e.exception.original_exception), "unpickling failed")
+        sleep(0.5)
+        session.check()
+        self.assertTrue(session.is_running)
+        session.wait_for_plots_opening(2, timeout=1, supress_timeout_error=False)
+        session.stop()
+
+    def test_static_plots_close(self):
+        import matplotlib.pyplot as plt
+        from src.playplot._plotProcess import _StaticPlots
+
+        figures = [plt.figure(), plt.figure()]
+        plots = _StaticPlots({fig.number for fig in figures})
+        plots.close()
+        self.assertFalse(any(plt.fignum_exists(fig.number) for fig in figures))
+
     @patch('src.playplot.session._plot_process_start_helper')
     def test_process_creation(self, mocked):
         session = Session(audio, sr)
@@ -178,6 +543,223 @@ class AudioPlaybackTestsForFile(TestCaseHelper):
         with self.assertRaises(RuntimeError):
             Session.from_file(__file__)
 
+    def test_streamed_frames(self):
+        expected, _ = soundfile.read(long_audio_file, dtype='float32', always_2d=True)
+        frt = AudioFileReaderThread(long_audio_file, 2 ** 27)
+
+        # crosses many block borders, then jumps back and forth
+        positions = list(range(0, 20 * sr, 1441)) + [200 * sr, 100, 200 * sr + 7]
+        for start in positions:
+            views = frt.read(start, start + 1441)
+            np.testing.assert_array_equal(np.concatenate(views), expected[start:start + 1441])
+        frt.close()
+
+    def test_memmap_wav(self):
+        expected, _ = soundfile.read(long_audio_file, dtype='float32', always_2d=True, frames=10 * sr)
+        for file_format, subtype in (("WAV", "PCM_16"), ("WAV", "PCM_24"), ("WAV", "PCM_32"), ("WAV", "FLOAT"),
+                                     ("WAVEX", "PCM_24")):
+            soundfile.write('temp.wav', expected, sr, subtype=subtype, format=file_format)
+            decoded, _ = soundfile.read('temp.wav', dtype='float32', always_2d=True)
+            reader = open_audio_file('temp.wav', 2 ** 27)
+            self.assertIsInstance(reader, MemmapAudioReader, subtype)
+            self.assertEqual(reader.length, decoded.shape[0])
+            for start in (0, 5 * sr + 3, 100, decoded.shape[0] - 1000):
+                np.testing.assert_array_equal(reader.read(start, start + 1441)[0], decoded[start:start + 1441],
+                                              subtype)
+            reader.close()
+
+        # compressed and unusual formats are decoded via soundfile
+        for file_format, subtype in (("FLAC", "PCM_16"), ("WAV", "PCM_U8"), ("WAV", "ULAW")):
+            soundfile.write('temp.' + file_format.lower(), expected[:sr], sr, subtype=subtype, format=file_format)
+            reader = open_audio_file('temp.' + file_format.lower(), 2 ** 27)
+            self.assertIsInstance(reader, AudioFileReaderThread, subtype)
+            reader.close()
+        os.unlink('temp.flac')
+
+    def test_decode_cache(self):
+        samples, _ = soundfile.read(long_audio_file, dtype='float32', always_2d=True, frames=10 * sr)
+        with tempfile.TemporaryDirectory() as folder:
+            first, second = os.path.join(folder, "first.flac"), os.path.join(folder, "second.flac")
+            soundfile.write(first, samples, sr)
+            soundfile.write(second, samples[:5 * sr], sr)
+            expected, _ = soundfile.read(first, dtype='float32', always_2d=True)
+
+            # room for one of the files only
+            cache = DecodeCache(os.path.join(folder, "cache"), int(expected.nbytes * 1.5))
+            self.assertIsNone(cache.lookup(first))
+
+            # decoded in the background on the first use
+            reader = open_audio_file(first, 2 ** 27, cache)
+            self.assertIsInstance(reader, AudioFileReaderThread)
+            self.timeout_assert(lambda: cache.lookup(first) is not None, timeout=10)
+            reader.close()
+
+            reader = open_audio_file(first, 2 ** 27, cache)
+            self.assertIsInstance(reader, MemmapAudioReader)
+            self.assertEqual(reader.length, expected.shape[0])
+            np.testing.assert_array_equal(reader.read(0, reader.length)[0], expected)
+            reader.close()
+
+            entry = cache.store(second)
+            self.assertEqual((entry.samplerate, entry.frames, entry.channels), (sr, 5 * sr, 2))
+            self.assertIsNone(cache.lookup(first))
+            self.assertIsNotNone(cache.lookup(second))
+
+            # a modified file is decoded again
+            os.utime(second, (0, 0))
+            self.assertIsNone(cache.lookup(second))
+
+    def test_seek_index(self):
+        samples, _ = soundfile.read(long_audio_file, dtype='float32', always_2d=True, frames=60 * sr)
+        with tempfile.TemporaryDirectory() as folder:
+            file = os.path.join(folder, "seek.mp3")
+            with soundfile.SoundFile(file, "w", sr, 2, format="MP3") as f:
+                for i in range(0, samples.shape[0], sr):
+                    f.write(samples[i:i + sr])
+            expected, _ = soundfile.read(file, dtype='float32', always_2d=True)
+            self.assertIsNone(build_seek_index(long_audio_file))
+
+            # built in the background and stored in the decode cache
+            cache = DecodeCache(folder, 2 ** 30)
+            frt = AudioFileReaderThread(file, 2 ** 27, cache)
+            self.timeout_assert(lambda: frt.seek_index is not None, timeout=10)
+            np.testing.assert_array_equal(cache.seek_index(file).offsets, frt.seek_index.offsets)
+
+            # decoding after seeks and across blocks matches decoding the whole file
+            for start in [50 * sr + 13, 10 * sr, 100, 59 * sr] + list(range(20 * sr, 22 * sr, 1441)):
+                views = frt.read(start, start + 1441)
+                np.testing.assert_array_equal(np.concatenate(views), expected[start:start + 1441], start)
+            frt.close()
+
+    def test_miniaudio_backend(self):
+        samples, _ = soundfile.read(long_audio_file, dtype='float32', always_2d=True, frames=20 * sr)
+        with tempfile.TemporaryDirectory() as folder:
+            for file_format in ("FLAC", "OGG", "MP3", "AIFF"):
+                file = os.path.join(folder, "backend." + file_format.lower())
+                soundfile.write(file, samples, sr, format=file_format)
+                expected, _ = soundfile.read(file, dtype='float32', always_2d=True)
+
+                # decoded in the reader thread, never in the callback
+                reader = open_audio_file(file, 2 ** 27, backend="miniaudio", sample_rate=sr)
+                self.assertIsInstance(reader, AudioFileReaderThread)
+                if file_format in ("MP3", "AIFF"):
+                    # mp3 files are seeked with a seek index by soundfile, aiff is not supported by miniaudio
+                    self.assertNotIsInstance(reader._sf, MiniaudioDecoder)
+                    reader.close()
+                    continue
+                self.assertIsInstance(reader._sf, MiniaudioDecoder)
+                self.assertEqual(reader.length, expected.shape[0])
+                for start in list(range(0, 2 * sr, 1441)) + [15 * sr + 7, 100, reader.length - 1000]:
+                    np.testing.assert_allclose(np.concatenate(reader.read(start, start + 1000)),
+                                               expected[start:start + 1000], atol=1e-6)
+                reader.close()
+
+        with self.assertRaises(ValueError):
+            Session.from_file(long_audio_file, decoding_backend="ffmpeg")
+
+    def test_read_cache(self):
+        block_bytes = AudioFileReaderThread.block_frames * 2 * 4
+        frt = AudioFileReaderThread(long_audio_file, 16 * block_bytes)
+        self.assertEqual(frt.slot_count, 16)
+
+        def block(seconds):
+            return seconds * sr // frt.block_frames
+
+        for seconds in (0, 100, 150, 200, 250):
+            frt.read(seconds * sr, seconds * sr + 1440)
+            self.timeout_assert(lambda: frt._missing_block() is None)
+
+        # the loop start and the played blocks stay, prefetched blocks which were never played were evicted
+        self.assertLessEqual(len(frt.blocks), 16)
+        for seconds in (0, 100, 150, 200, 250):
+            self.assertIn(block(seconds), frt.blocks)
+        self.assertNotIn(block(100) + 1, frt.blocks)
+        frt.close()
+
+    def test_url_file(self):
+        self.loadTemp()
+        connections = []
+        ranges = []
+
+        class KeepAliveHandler(RangeRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                connections.append(self.client_address)
+                super().setup()
+
+            def send_head(self):
+                ranges.append(self.headers["Range"])
+                return super().send_head()
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(("", 8089), KeepAliveHandler)
+        threading.Thread(target=server.serve_forever).start()
+        try:
+            expected, _ = soundfile.read(long_audio_file, dtype='float32', always_2d=True)
+            source = UrlFile('http://localhost:8089/temp.wav')
+            with soundfile.SoundFile(source) as f:
+                for start in (0, 100 * sr, 20 * sr, 100 * sr + 40000, 299 * sr):
+                    f.seek(start)
+                    np.testing.assert_array_equal(f.read(40000, dtype='float32', always_2d=True),
+                                                  expected[start:start + 40000])
+            source.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        # one connection for reads and one per prefetch worker, every block is only requested once
+        self.assertLessEqual(len(connections), UrlFile.max_concurrency + 1)
+        self.assertEqual(len(ranges), len(set(ranges)))
+        self.assertEqual(source.request_count, len(ranges))
+        self.assertLessEqual(source.concurrency.value, UrlFile.max_concurrency)
+
+    def test_url_probing_fails(self):
+        ranges = []
+
+        class QuietHandler(RangeRequestHandler):
+            def send_head(self):
+                ranges.append(self.headers["Range"])
+                if os.path.getsize(self.translate_path(self.path)) == 0:
+                    # RangeRequestHandler leaves out the length of unsatisfiable ranges
+                    self.send_response(416)
+                    self.send_header("Content-Range", "bytes */0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return None
+                return super().send_head()
+
+            def log_message(self, *args):
+                pass
+
+        open('empty.wav', 'wb').close()
+        with open('temp.txt', 'w') as f:
+            f.write("not audio\n" * 1000)
+        threads = threading.active_count()
+        server = http.server.ThreadingHTTPServer(("", 8089), QuietHandler)
+        threading.Thread(target=server.serve_forever).start()
+        try:
+            source = UrlFile('http://localhost:8089/empty.wav')
+            self.assertEqual(0, source.length)
+            self.assertEqual(b"", source.read())
+            source.close()
+
+            with self.assertRaises(RuntimeError):
+                Session.from_file('http://localhost:8089/empty.wav')
+            with self.assertRaises(RuntimeError):
+                Session.from_file('http://localhost:8089/temp.txt')
+        finally:
+            server.shutdown()
+            server.server_close()
+            os.unlink('empty.wav')
+            os.unlink('temp.txt')
+
+        # only ranges within the files were requested, the prefetch workers of the failed probes exited
+        self.assertTrue(all(not r.startswith("bytes=-") for r in ranges), ranges)
+        self.timeout_assert(lambda: threading.active_count() == threads, "prefetch workers still running")
+
     def test_url_missing(self):
         print("ConnectionResetErrors are normal")
         self.loadTemp()
@@ -197,7 +779,8 @@ class AudioPlaybackTestsForFile(TestCaseHelper):
         self.stopServer = True
         sleep(1)
 
-        session.time = 200
+        # a region which was not played yet (played ones are cached)
+        session.time = 100
 
         sleep(3)
         session.check()
@@ -276,6 +859,214 @@ class PlotTests(TestCaseHelper):
         session.check()
         session.stop()
 
+    def test_dirty_blitting(self):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        class ScreenCanvas(FigureCanvasAgg):
+            """Copies blitted rectangles to a screen, like the canvas of a gui"""
+            screen = None
+
+            def blit(self, bbox=None):
+                buffer = np.asarray(self.buffer_rgba())
+                height = buffer.shape[0]
+                rows, columns = slice(int(height - bbox.y1), int(height - bbox.y0)), slice(int(bbox.x0), int(bbox.x1))
+                self.screen[rows, columns] = buffer[rows, columns]
+
+        def frames(dirty):
+            fig = Figure(figsize=(8, 4), dpi=100)
+            canvas = ScreenCanvas(fig)
+            ax = fig.subplots()
+            ax.plot(annotations[:, 0])
+            line = ax.axvline(10, alpha=0.9, ls="--", color="r", lw=1, zorder=10)
+            thick_line = ax.axvline(10, color="g", lw=12)
+            text = ax.text(5, 5, "")
+            boxed_text = ax.text(5, 3, "", bbox=dict(boxstyle="round"))
+            blit_manager = BlitManager(canvas, [line, thick_line, text, boxed_text])
+            canvas.draw()
+            canvas.screen = np.asarray(canvas.buffer_rgba()).copy()
+            for x in (10.5, 11, 30, 29.7, 0):
+                line.set_xdata([x, x])
+                thick_line.set_xdata([x + 5, x + 5])
+                text.set_text(f"{x}")
+                boxed_text.set_text(f"{x}" * int(x % 4 + 1))
+                boxed_text.set_x(x)
+                if dirty:
+                    blit_manager.update(False)
+                    yield canvas.screen.copy(), blit_manager.frame_pixels
+                else:
+                    canvas.restore_region(blit_manager._bg)
+                    blit_manager._draw_animated()
+                    yield np.asarray(canvas.buffer_rgba()).copy(), None
+
+        # only the dirty regions are restored and blitted, the result is the same as restoring the whole figure
+        for partially in (True, False):
+            # backgrounds of cairo can only be restored as a whole, they are restored in tiles
+            with patch.object(BlitManager, "_restores_partially", return_value=partially):
+                for (dirty, pixels), (full, _) in zip(frames(True), frames(False)):
+                    np.testing.assert_array_equal(dirty, full)
+                    self.assertLess(pixels, 800 * 400 / (5 if partially else 3))
+
+    def test_multiple_axes(self):
+        import matplotlib.pyplot as plt
+
+        so = SharedObject(False, 10, False, 60, None, 0, False, 0)
+        fig, axes = plt.subplots(2, 1)
+        axes[0].plot(np.arange(101))
+        axes[1].plot(np.arange(1001))
+        plot = MPP(fig, axes, {"mapping": [None, np.array([[0., 0.], [10., 500.]])]}, so)
+        self.assertEqual(len(plot.cursors), 2)
+
+        # all cursors are updated in one frame, each with the mapping of its axes
+        so.state.update(time=5.0)
+        frames = plot.blit_manager.frames
+        self.assertTrue(plot.update(so.state.read(), flush_events=False))
+        self.assertEqual(plot.blit_manager.frames, frames + 1)
+        self.assertAlmostEqual(plot.cursors[0].get_xdata()[0], 50)
+        self.assertAlmostEqual(plot.cursors[1].get_xdata()[0], 250)
+        self.assertAlmostEqual(plot.pos_to_time(250, 1), 5)
+        plt.close(fig)
+
+        # None entries are replaced by the default
+        fig, axes = plt.subplots(2, 1)
+        axes[0].plot(np.arange(101))
+        axes[1].plot(np.arange(101))
+        plot = MPP(fig, axes, {"axvline_kwargs": [None, {"color": "b"}], "mapping": [None, None]}, so)
+        self.assertEqual(plot.cursors[0].get_linestyle(), "--")
+        self.assertEqual(plot.cursors[1].get_color(), "b")
+        plt.close(fig)
+
+    def test_frame_scheduling(self):
+        import matplotlib.pyplot as plt
+
+        so = SharedObject(False, 10, False, 60, None, 0, False, 0)
+        fig, ax = plt.subplots()
+        ax.plot(np.arange(101))
+        calls = []
+        plot = MPP(fig, ax, {"artists": [ax.text(0, 0, "")],
+                             "draw_function": lambda *args: calls.append(args) or False}, so)
+
+        # the draw function is only called if its arguments or the figure changed
+        for _ in range(3):
+            plot.update(so.state.read(), flush_events=False)
+        self.assertEqual(len(calls), 1)
+        self.assertFalse(plot.rendered)
+        so.state.update(time=5.0)
+        for _ in range(3):
+            plot.update(so.state.read(), flush_events=False)
+        self.assertEqual(len(calls), 2)
+        plot.on_input(None)
+        plot.update(so.state.read(), flush_events=False)
+        self.assertEqual(len(calls), 3)
+
+        # paused without changes, frames are due at the idle frame rate
+        scheduler = FrameScheduler(so.state, idle_fps=10)
+        scheduler.watch(fig.canvas)
+        start = perf_counter()
+        scheduler.wait(so.state.read(), start, False, fig.canvas)
+        self.assertGreater(perf_counter() - start, 0.08)
+
+        # a seek ends the idle wait within a frame
+        state = so.state.read()
+        threading.Timer(0.02, lambda: so.state.update(time=1.0, seek_count=state.seek_count + 1)).start()
+        start = perf_counter()
+        scheduler.wait(state, start, False, fig.canvas)
+        self.assertLess(perf_counter() - start, 0.06)
+
+        # the frame rate is lowered to the measured render cost, missed frames are skipped
+        so.state.update(paused=False)
+        state = so.state.read()
+        scheduler.wait(state, perf_counter() - 0.04, True, fig.canvas)
+        self.assertAlmostEqual(scheduler.frame_rate(state), 0.75 / 0.04, delta=1)
+        scheduler.next_frame = perf_counter() - 1
+        start = perf_counter()
+        scheduler.wait(state, start, False, fig.canvas)
+        self.assertGreaterEqual(scheduler.skipped_frames, 15)
+        self.assertLess(perf_counter() - start, 0.05)
+        plt.close(fig)
+
+        with self.assertRaises(ValueError):
+            Session(np.zeros((2, sr)), sr, idle_fps=0)
+
+    def test_frame_rates(self):
+        session = Session(audio, sr, audio_output="null")
+        session.start()
+
+        @session
+        def plot():
+            import matplotlib.pyplot as plt
+
+            fig, ax = plt.subplots()
+            ax.plot(np.arange(100))
+            return fig, ax, {"title": "frame_rates"}
+
+        plot()
+        session.wait_for_plots_opening(1)
+        session.paused = False
+        self.timeout_assert(lambda: session.frame_rates.get("frame_rates", 0) > 10, timeout=5)
+        # paused plots do not render
+        session.paused = True
+        self.timeout_assert(lambda: session.frame_rates.get("frame_rates") == 0, timeout=5)
+
+        session.check()
+        session.stop()
+
+    def test_drag_seeks(self):
+        from types import SimpleNamespace
+        import matplotlib.pyplot as plt
+
+        so = SharedObject(False, 10, False, 60, None, 0, False, 0, max_seek_rate=5)
+        fig, ax = plt.subplots()
+        ax.plot(np.arange(101))
+        plot = MPP(fig, ax, {}, so)
+        plot.pressed_buttons[1] = True
+
+        # motion events are coalesced, the next frame publishes the latest position only
+        for x in np.linspace(10, 60, 50):
+            plot.on_move(SimpleNamespace(inaxes=ax, xdata=x))
+        self.assertEqual(so.state.seek_count, 0)
+        plot.update(so.state.read(), flush_events=False)
+        self.assertEqual(so.state.seek_count, 1)
+        self.assertAlmostEqual(so.state.time, 6)
+        self.assertAlmostEqual(plot.cursors[0].get_xdata()[0], 60)
+
+        # at most max_seek_rate seeks per second
+        plot.on_move(SimpleNamespace(inaxes=ax, xdata=30.0))
+        plot.update(so.state.read(), flush_events=False)
+        self.assertEqual(so.state.seek_count, 1)
+        sleep(0.2)
+        plot.update(so.state.read(), flush_events=False)
+        self.assertEqual(so.state.seek_count, 2)
+        self.assertAlmostEqual(so.state.time, 3)
+        plt.close(fig)
+
+    def test_mapping_functions(self):
+        ticks = np.cumsum(np.random.RandomState(0).rand(100) + 0.01)
+        for mapping, (start, end), positions in (
+                (np.array([[0., 10.], [2., 30.], [5., 40.]]), (0., 5.), np.array([10, 20, 30, 40])),
+                ((ticks, 0., 99.), (ticks[0], ticks[-1]), np.arange(100.))):
+            time_to_pos, pos_to_time = mapping_functions(mapping)
+            times = np.linspace(start - 1, end + 1, 1000)
+            np.testing.assert_allclose(time_to_pos(times), [time_to_pos(t) for t in times])
+            np.testing.assert_allclose(pos_to_time(time_to_pos(times)), np.clip(times, start, end), atol=1e-9)
+            np.testing.assert_allclose(time_to_pos(pos_to_time(positions)), positions)
+        self.assertEqual(time_to_pos(-5.0), 0)
+        self.assertIsInstance(time_to_pos(3.0), float)
+
+        # warping paths repeat coordinates at their ends, times outside map to the first and last position
+        time_to_pos, pos_to_time = mapping_functions(np.array([[0., 0.], [0., 1.], [1., 2.], [2., 2.], [2., 3.]]))
+        times = np.array([-0.5, 0, 0.5, 1.5, 2, 2.5])
+        expected = [0, 0, 1.5, 2, 3, 3]
+        np.testing.assert_array_equal(time_to_pos(times), expected)
+        self.assertEqual([time_to_pos(t) for t in times], expected)
+        positions = np.array([-1, 0.5, 1.5, 2.5, 4])
+        expected = [0, 0, 0.5, 2, 2]
+        np.testing.assert_array_equal(pos_to_time(positions), expected)
+        self.assertEqual([pos_to_time(p) for p in positions], expected)
+        time_to_pos, _ = mapping_functions((np.array([0., 0., 1., 2., 2.]), 0., 4.))
+        np.testing.assert_array_equal(time_to_pos(times), [0, 0, 1.5, 2.5, 4, 4])
+        self.assertEqual([time_to_pos(t) for t in times], [0, 0, 1.5, 2.5, 4, 4])
+
 
 if __name__ == '__main__':
     unittest.main()